@@ -0,0 +1,142 @@
+# fds_v2/benchmarks/codec.py
+"""
+Codec benchmark
+
+Bytes and CPU per event for each serialization hop, comparing the previous
+path (recursive Decimal normalization + stdlib/kombu JSON) with fds_core.codec.
+
+  ingest:     payload dict        -> Outbox.payload text
+  dispatch:   Outbox.payload text -> dict -> task message body
+  worker:     task message body   -> dict
+  log:        hits                -> DetectionLog.extra text
+
+Usage (from fds_v2/):
+    python -m benchmarks.codec [--items 1,10,50] [--codec orjson] [--number 2000]
+"""
+
+import argparse
+import json
+import timeit
+from dataclasses import asdict
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Tuple
+
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+from fds_core.codec import CODECS, JSON_CODEC, CodecJSONEncoder, get_codec, register_task_serializers
+from fds_core.enums import Decision
+from fds_core.hit import Hit, RegisterTarget
+
+
+def _legacy_normalize(obj: Any) -> Any:
+    # previous services.payload._normalize
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, dict):
+        return {k: _legacy_normalize(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_legacy_normalize(i) for i in obj]
+    return obj
+
+
+def order_payload(n_items: int) -> Dict[str, Any]:
+    return {
+        "kind": "order",
+        "order_id": "ORD123",
+        "account_id": "A100",
+        "device_id": "D100",
+        "country": "JP",
+        "price": "12000.00",
+        "currency": "JPY",
+        "items": [
+            {"product_id": f"P{i}", "unit_price": Decimal("6000.00"), "quantity": 2}
+            for i in range(n_items)
+        ],
+        "metadata": {"source": "mobile-web", "ip": "203.0.113.7", "ua": "Mozilla/5.0"},
+    }
+
+
+def sample_hits() -> List[Hit]:
+    return [
+        Hit(rule_id=f"R{i:03d}", decision=Decision.REVIEW, register_target=RegisterTarget.DEVICE)
+        for i in range(5)
+    ]
+
+
+def _message_body(payload: Dict[str, Any]) -> Tuple[Any, ...]:
+    # Celery protocol 2 body: (args, kwargs, embed)
+    kwargs = {"event_type": "order_upserted", "shard_id": "default", "aggregate_id": "ORD123", "payload": payload}
+    return (), kwargs, {"callbacks": None, "errbacks": None, "chain": None, "chord": None}
+
+
+def _per_call_us(fn: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def run(n_items: int, serializer: str, number: int) -> List[Tuple[str, float, float, int, int]]:
+    payload = order_payload(n_items)
+    hits = sample_hits()
+
+    legacy_text = json.dumps(_legacy_normalize(payload))
+    new_text = json.dumps(payload, cls=CodecJSONEncoder)
+    legacy_msg = kombu_dumps(_message_body(json.loads(legacy_text)), serializer="json")
+    new_msg = kombu_dumps(_message_body(JSON_CODEC.loads(new_text)), serializer=serializer)
+    legacy_log = json.dumps({"hits": [asdict(h) for h in hits]})
+    new_log = json.dumps({"hits": hits}, cls=CodecJSONEncoder)
+
+    hops = [
+        (
+            "ingest",
+            lambda: json.dumps(_legacy_normalize(payload)),
+            lambda: json.dumps(payload, cls=CodecJSONEncoder),
+            len(legacy_text.encode()), len(new_text.encode()),
+        ),
+        (
+            "dispatch",
+            lambda: kombu_dumps(_message_body(json.loads(legacy_text)), serializer="json"),
+            lambda: kombu_dumps(_message_body(JSON_CODEC.loads(new_text)), serializer=serializer),
+            len(legacy_msg[2]), len(new_msg[2]),
+        ),
+        (
+            "worker",
+            lambda: kombu_loads(legacy_msg[2], legacy_msg[0], legacy_msg[1]),
+            lambda: kombu_loads(new_msg[2], new_msg[0], new_msg[1], accept=[new_msg[0]]),
+            len(legacy_msg[2]), len(new_msg[2]),
+        ),
+        (
+            "log",
+            lambda: json.dumps({"hits": [asdict(h) for h in hits]}),
+            lambda: json.dumps({"hits": hits}, cls=CodecJSONEncoder),
+            len(legacy_log.encode()), len(new_log.encode()),
+        ),
+    ]
+    return [
+        (name, _per_call_us(legacy, number), _per_call_us(new, number), legacy_bytes, new_bytes)
+        for name, legacy, new, legacy_bytes, new_bytes in hops
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", default="1,10,50", help="comma separated item counts")
+    parser.add_argument("--codec", default=None, choices=sorted(CODECS), help="task message codec")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    register_task_serializers()
+    serializer = f"fds-{get_codec(args.codec).name}"
+    print(f"column codec: {JSON_CODEC.name}, task codec: {serializer}")
+
+    for n in args.items.split(","):
+        rows = run(int(n), serializer, args.number)
+        print(f"\nitems={n}")
+        print(f"{'hop':<10}{'old us':>10}{'new us':>10}{'old B':>10}{'new B':>10}")
+        for name, old_us, new_us, old_b, new_b in rows:
+            print(f"{name:<10}{old_us:>10.1f}{new_us:>10.1f}{old_b:>10}{new_b:>10}")
+        old_total = sum(r[1] for r in rows)
+        new_total = sum(r[2] for r in rows)
+        print(f"{'total':<10}{old_total:>10.1f}{new_total:>10.1f}   saved {old_total - new_total:.1f} us/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# fds_v2/benchmarks/cold_start.py
+"""
+Cold start benchmark
+
+Time from process start to the first detection, in fresh interpreter
+processes (as a new gunicorn worker or Celery prefork child would start):
+
+  - eager:     rules loaded from the database during startup (previous
+               AppConfig.ready() behaviour), snapshots disabled
+  - lazy:      rules loaded from the database on the first detection
+  - snapshot:  rules read from the snapshot file during startup, verified
+               against the rules table on the first detection
+
+Per mode: django.setup() seconds, first detection seconds, their sum, and
+DB statements issued until the first decision (p50 / max over --runs).
+
+The parent installs the benchmark rule set (benchmarks.pipeline.build_rules,
+restored afterwards), writes the snapshot and picks the latest order as the
+case to detect. Needs a database shared between processes (not in-memory
+SQLite).
+
+Usage (from fds_v2/):
+    python -m benchmarks.cold_start [--rules 20] [--runs 10] [--out report.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fds_api.settings")
+
+_STARTED = time.perf_counter()
+
+MODES = ("eager", "lazy", "snapshot")
+
+
+# --------------------------
+# Child: one cold start
+# --------------------------
+
+def child(mode: str, snapshot: str, order_id: str) -> Dict[str, Any]:
+    from django.conf import settings
+
+    # before django.setup(): AppConfig.ready() reads the snapshot setting
+    settings.FDS_RULE_SNAPSHOT_PATH = snapshot if mode == "snapshot" else None
+
+    t0 = time.perf_counter()
+    django.setup()
+    from django.db import connection
+    from fds_core import rule_cache
+    from fds_core.rules_engine import detect_order_core
+
+    statements = [0]
+
+    def count(execute, sql, params, many, context):
+        statements[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        if mode == "eager":
+            rule_cache.load_rules_from_db()
+        t1 = time.perf_counter()
+        detect_order_core(order_id)
+        t2 = time.perf_counter()
+
+    return {
+        "import_seconds": t0 - _STARTED,
+        "setup_seconds": t1 - t0,
+        "first_detection_seconds": t2 - t1,
+        "total_seconds": t2 - _STARTED,
+        "statements": statements[0],
+    }
+
+
+# --------------------------
+# Parent
+# --------------------------
+
+def _spawn(mode: str, snapshot: str, order_id: str) -> Dict[str, Any]:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child", mode, "--snapshot", snapshot, "--order-id", order_id],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    # the child's last line is its JSON result (rule_cache prints before it)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _summary(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from benchmarks.pipeline import percentile
+
+    keys = ("setup_seconds", "first_detection_seconds", "total_seconds", "statements")
+    return {
+        key: {"p50": percentile([r[key] for r in runs], 50), "max": max(r[key] for r in runs)}
+        for key in keys
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=20, help="number of SQL rules")
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per mode")
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    parser.add_argument("--child", choices=MODES, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--snapshot", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--order-id", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.snapshot, args.order_id)))
+        return
+
+    from benchmarks.pipeline import build_rules, rule_set
+    from fds_core import rule_cache
+    from fds_django.models import Order
+
+    order_id = Order.objects.order_by("-created_at").values_list("order_id", flat=True).first()
+    if order_id is None:
+        sys.exit("no orders in the database: run benchmarks.pipeline first")
+
+    report: Dict[str, Any] = {"rules": args.rules, "runs": args.runs, "modes": {}}
+    with tempfile.TemporaryDirectory() as tmp, rule_set(build_rules(args.rules)):
+        snapshot = os.path.join(tmp, "rules.snapshot")
+        rule_cache.write_snapshot(snapshot)
+        for mode in MODES:
+            runs = [_spawn(mode, snapshot, order_id) for _ in range(args.runs)]
+            report["modes"][mode] = _summary(runs)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+# fds_v2/benchmarks/pipeline.py
+"""
+End-to-end pipeline benchmark
+
+Drives the real pipeline with a synthetic workload:
+
+  IngestOrderView / IngestPurchaseView -> dispatch_outbox_batch
+    -> detect_outbox_chunk_task / detect_case_task (FDS_DISPATCH_MODE)
+
+Workload (seeded, reproducible):
+  - regular traffic: accounts with their own devices and cards, 1-5 items
+    per order, most orders followed by a purchase, a few failed payments
+  - fraud rings: groups of accounts sharing a small pool of cards / devices
+  - velocity bursts: one device placing many orders and one card failing
+    repeatedly, back to back
+
+Rule set: N SQL rules cycling through order / purchase templates (indexed
+lookups, correlated COUNT subqueries, item scans), replacing the stored
+rules for the duration of the run (restored afterwards).
+
+Modes:
+  - eager:  Celery task_always_eager, detection runs inline on dispatch;
+            DB statements are counted for every stage
+  - worker: tasks go to running workers (docker-compose); only ingest and
+            dispatch statements are counted in this process
+
+Report (JSON): events/sec, p50/p95/p99 ingest-to-decision latency from
+Outbox.created_at to Processed.created_at, DB statements per event per
+stage, and micro-benchmarks for _evaluate_target_rules, resolve_p0 and
+upsert_order_and_emit. --baseline compares against a previous report.
+--trace-rate samples events for pipeline tracing (fds_core.tracing) and adds
+the stage breakdown to the report (worker mode: set FDS_TRACE_EXPORTER to
+"file" so worker spans are visible here).
+
+Run against a dedicated database (e.g. the docker-compose Postgres):
+benchmark rows are written with a per-run id prefix and are not deleted.
+
+Usage (from fds_v2/):
+    python -m benchmarks.pipeline [--orders 2000] [--rules 20] [--mode eager]
+        [--out report.json] [--baseline previous.json]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import timeit
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fds_api.settings")
+django.setup()
+
+from celery import current_app  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from fds_core import tracing  # noqa: E402
+from fds_core.enums import Decision  # noqa: E402
+from fds_core.hit import Hit  # noqa: E402
+from fds_core.rule_cache import reload_rules  # noqa: E402
+from fds_core.rules_engine import _evaluate_target_rules, resolve_p0  # noqa: E402
+from fds_django.models import Outbox, Processed, Rules  # noqa: E402
+from fds_django.services.upsert_and_emit import upsert_order_and_emit  # noqa: E402
+from fds_django.tasks import dispatch_outbox_batch  # noqa: E402
+from fds_django.views_async import IngestOrderView, IngestPurchaseView  # noqa: E402
+
+Event = Tuple[str, Dict[str, Any]]  # ("order" | "purchase", request payload)
+
+
+# --------------------------
+# Workload
+# --------------------------
+
+def generate_events(
+    n_orders: int,
+    seed: int,
+    prefix: str,
+    rings: int = 3,
+    ring_size: int = 8,
+    bursts: int = 2,
+    burst_size: int = 30,
+) -> List[Event]:
+    """
+    Synthetic ingestion stream: orders, each optionally followed by its purchase.
+    """
+    rnd = random.Random(seed)
+    n_accounts = max(10, n_orders // 4)
+    events: List[Event] = []
+    seq = 0
+
+    def order(account: str, device: str, n_items: Optional[int] = None) -> Dict[str, Any]:
+        nonlocal seq
+        seq += 1
+        items = [
+            {
+                "product_id": f"P{rnd.randrange(500)}",
+                "unit_price": f"{rnd.randrange(100, 20000)}.00",
+                "quantity": rnd.randint(1, 3),
+            }
+            for _ in range(n_items if n_items is not None else rnd.randint(1, 5))
+        ]
+        total = sum(Decimal(i["unit_price"]) * i["quantity"] for i in items)
+        return {
+            "order_id": f"{prefix}O{seq}",
+            "account_id": account,
+            "device_id": device,
+            "order_country": rnd.choice(["JP", "JP", "JP", "KR", "US"]),
+            "total_price": str(total),
+            "currency": "JPY",
+            "order_status": "CREATED",
+            "items": items,
+            "metadata": {"source": rnd.choice(["web", "ios", "android"])},
+        }
+
+    def purchase(o: Dict[str, Any], card: str, status: str = "SUCCESS") -> Dict[str, Any]:
+        return {
+            "purchase_id": f"{prefix}P{o['order_id'][len(prefix) + 1:]}",
+            "order_id": o["order_id"],
+            "method_type": "CARD",
+            "card_brand": "VISA",
+            "bin": card[-6:].rjust(6, "4"),
+            "card_id": card,
+            "payment_country": o["order_country"],
+            "payment_status": status,
+            "failure_reason": "DECLINED" if status == "FAIL" else None,
+            "price": o["total_price"],
+            "currency": o["currency"],
+            "metadata": {},
+        }
+
+    # regular traffic
+    n_regular = max(0, n_orders - rings * ring_size * 2 - bursts * burst_size)
+    for _ in range(n_regular):
+        a = rnd.randrange(n_accounts)
+        o = order(f"{prefix}A{a}", f"{prefix}D{a}-{rnd.randrange(2)}")
+        events.append(("order", o))
+        if rnd.random() < 0.9:
+            status = "FAIL" if rnd.random() < 0.03 else "SUCCESS"
+            events.append(("purchase", purchase(o, f"{prefix}C{a}", status)))
+
+    # fraud rings: many accounts, few shared cards / devices
+    for r in range(rings):
+        cards = [f"{prefix}RC{r}-{i}" for i in range(2)]
+        devices = [f"{prefix}RD{r}-{i}" for i in range(2)]
+        for _ in range(ring_size * 2):
+            o = order(f"{prefix}RA{r}-{rnd.randrange(ring_size)}", rnd.choice(devices))
+            events.append(("order", o))
+            events.append(("purchase", purchase(o, rnd.choice(cards))))
+
+    # velocity bursts: one device ordering, one card failing, back to back
+    for b in range(bursts):
+        device, card = f"{prefix}BD{b}", f"{prefix}BC{b}"
+        burst: List[Event] = []
+        for _ in range(burst_size):
+            o = order(f"{prefix}BA{b}-{rnd.randrange(3)}", device, n_items=1)
+            burst.append(("order", o))
+            burst.append(("purchase", purchase(o, card, "FAIL")))
+        at = rnd.randrange(len(events) + 1)
+        events[at:at] = burst
+
+    return events
+
+
+# Templates take one %s (order_id / purchase_id); {n} is varied per rule
+_ORDER_RULES: Tuple[str, ...] = (
+    "SELECT 1 FROM fds_django_order WHERE order_id = %s AND total_price > {n}000",
+    "SELECT 1 FROM fds_django_order o WHERE o.order_id = %s "
+    "AND (SELECT COUNT(*) FROM fds_django_order o2 WHERE o2.device_id = o.device_id) > {n}",
+    "SELECT 1 FROM fds_django_orderitem WHERE order_id = %s AND quantity * unit_price > {n}0000",
+    "SELECT 1 FROM fds_django_order o WHERE o.order_id = %s AND o.order_country <> 'JP' "
+    "AND (SELECT COUNT(*) FROM fds_django_order o2 WHERE o2.account_id = o.account_id) > {n}",
+)
+_PURCHASE_RULES: Tuple[str, ...] = (
+    "SELECT 1 FROM fds_django_purchase WHERE purchase_id = %s AND payment_status = 'FAIL'",
+    "SELECT 1 FROM fds_django_purchase p WHERE p.purchase_id = %s "
+    "AND (SELECT COUNT(*) FROM fds_django_purchase p2 WHERE p2.card_id = p.card_id "
+    "AND p2.payment_status = 'FAIL') > {n}",
+    "SELECT 1 FROM fds_django_purchase p WHERE p.purchase_id = %s "
+    "AND (SELECT COUNT(DISTINCT o.account_id) FROM fds_django_purchase p2 "
+    "JOIN fds_django_order o ON o.order_id = p2.order_id WHERE p2.card_id = p.card_id) > {n}",
+    "SELECT 1 FROM fds_django_purchase WHERE purchase_id = %s AND price > {n}0000",
+)
+
+
+def build_rules(n: int) -> List[Rules]:
+    """
+    N SQL rules alternating between order and purchase templates.
+    """
+    rules: List[Rules] = []
+    for i in range(n):
+        target = "order" if i % 2 == 0 else "purchase"
+        templates = _ORDER_RULES if target == "order" else _PURCHASE_RULES
+        sql = templates[(i // 2) % len(templates)].format(n=2 + i % 5)
+        rules.append(Rules(
+            rule_id=f"BENCH{i:03d}",
+            rule_sql=sql,
+            rule_action="BLOCK" if i % 7 == 6 else "REVIEW",
+            target=target,
+            register_blocklist=False,
+        ))
+    return rules
+
+
+@contextmanager
+def rule_set(rules: List[Rules]) -> Iterator[None]:
+    """Replace stored rules for the run, restore them afterwards."""
+    saved = list(Rules.objects.all())
+    Rules.objects.all().delete()
+    Rules.objects.bulk_create(rules)
+    reload_rules()
+    try:
+        yield
+    finally:
+        Rules.objects.all().delete()
+        Rules.objects.bulk_create(saved)
+        reload_rules()
+
+
+# --------------------------
+# Measurement helpers
+# --------------------------
+
+class StatementCounter:
+    """
+    connection.execute_wrapper hook counting statements per stage
+    (no query text is kept, unlike CaptureQueriesContext).
+    """
+    def __init__(self) -> None:
+        self.stage = "other"
+        self.counts: Dict[str, int] = {}
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        self.counts[self.stage] = self.counts.get(self.stage, 0) + 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    # nearest rank
+    ordered = sorted(values)
+    k = max(0, math.ceil(p / 100.0 * len(ordered)) - 1)
+    return ordered[k]
+
+
+def _per_call_us(fn: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def _git_version() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# --------------------------
+# Pipeline run
+# --------------------------
+
+def run_pipeline(events: List[Event], prefix: str, mode: str, dispatch_every: int, timeout: float) -> Dict[str, Any]:
+    factory = APIRequestFactory()
+    views = {"order": IngestOrderView.as_view(), "purchase": IngestPurchaseView.as_view()}
+    paths = {"order": "/fds/ingest/order", "purchase": "/fds/ingest/purchase"}
+
+    counter = StatementCounter()
+    rejected = 0
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for i, (kind, payload) in enumerate(events, 1):
+            counter.stage = "ingest"
+            response = views[kind](factory.post(paths[kind], payload, format="json"))
+            if response.status_code != 201:
+                rejected += 1
+            if i % dispatch_every == 0:
+                counter.stage = "dispatch_detect"
+                dispatch_outbox_batch("default")
+
+        counter.stage = "dispatch_detect"
+        deadline = time.monotonic() + timeout
+        while dispatch_outbox_batch("default")["status"] != "empty" and time.monotonic() < deadline:
+            pass
+
+        counter.stage = "other"
+        expected = len(events) - rejected
+        while mode == "worker" and time.monotonic() < deadline:
+            if Processed.objects.filter(aggregate_id__startswith=prefix).count() >= expected:
+                break
+            time.sleep(0.2)
+    wall = time.perf_counter() - started
+
+    ingested = dict(
+        Outbox.objects.filter(aggregate_id__startswith=prefix)
+        .values_list("aggregate_id", "created_at")
+    )
+    decided = dict(
+        Processed.objects.filter(aggregate_id__startswith=prefix)
+        .values_list("aggregate_id", "created_at")
+    )
+    latencies_ms = [
+        (decided[agg] - at).total_seconds() * 1000.0
+        for agg, at in ingested.items()
+        if agg in decided
+    ]
+    last_decision = max(decided.values()) if decided else None
+    first_ingest = min(ingested.values()) if ingested else None
+    span = (last_decision - first_ingest).total_seconds() if last_decision and first_ingest else wall
+
+    n = len(events)
+    return {
+        "events": n,
+        "rejected": rejected,
+        "decided": len(decided),
+        "wall_seconds": round(wall, 3),
+        "events_per_sec": round(len(decided) / span, 1) if span > 0 else None,
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "max": max(latencies_ms) if latencies_ms else None,
+        },
+        "statements_per_event": {
+            stage: round(count / n, 2) for stage, count in sorted(counter.counts.items())
+        } | {"total": round(sum(counter.counts.values()) / n, 2)},
+    }
+
+
+# --------------------------
+# Micro-benchmarks
+# --------------------------
+
+def run_micro(prefix: str, number: int) -> Dict[str, float]:
+    sample_order = Outbox.objects.filter(aggregate_id__startswith=prefix, event_type="order_upserted").values_list("aggregate_id", flat=True).first()
+    sample_purchase = Outbox.objects.filter(aggregate_id__startswith=prefix, event_type="purchase_upserted").values_list("aggregate_id", flat=True).first()
+
+    hits = [Hit(rule_id=f"R{i}", decision=d) for i, d in enumerate([Decision.REVIEW] * 4 + [Decision.BLOCK])]
+
+    seq = 0
+
+    def upsert() -> None:
+        nonlocal seq
+        seq += 1
+        upsert_order_and_emit({
+            "order_id": f"{prefix}M{seq}",
+            "account_id": f"{prefix}MA",
+            "device_id": f"{prefix}MD",
+            "order_country": "JP",
+            "total_price": Decimal("1200.00"),
+            "currency": "JPY",
+            "order_status": "CREATED",
+            "items": [{"product_id": "P1", "unit_price": Decimal("600.00"), "quantity": 2}],
+            "metadata": {},
+        })
+
+    db_number = max(1, number // 20)
+    micro = {
+        "evaluate_order_rules_us": _per_call_us(lambda: _evaluate_target_rules("order", {"order_id": sample_order}), db_number),
+        "evaluate_purchase_rules_us": _per_call_us(lambda: _evaluate_target_rules("purchase", {"purchase_id": sample_purchase}), db_number),
+        "resolve_p0_us": _per_call_us(lambda: resolve_p0(hits), number),
+        "upsert_order_and_emit_us": _per_call_us(upsert, db_number),
+    }
+    # keep the dispatcher of later runs from picking up the micro-benchmark events
+    Outbox.objects.filter(aggregate_id__startswith=f"{prefix}M", status=Outbox.Status.READY).update(status=Outbox.Status.SENT)
+    return micro
+
+
+# --------------------------
+# Report
+# --------------------------
+
+# Structure: dotted report path -> True when higher is better
+_COMPARED: Dict[str, bool] = {
+    "pipeline.events_per_sec": True,
+    "pipeline.latency_ms.p50": False,
+    "pipeline.latency_ms.p95": False,
+    "pipeline.latency_ms.p99": False,
+    "pipeline.statements_per_event.total": False,
+    "micro.evaluate_order_rules_us": False,
+    "micro.evaluate_purchase_rules_us": False,
+    "micro.resolve_p0_us": False,
+    "micro.upsert_order_and_emit_us": False,
+}
+
+
+def _get(report: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Print the change of each compared metric; return the regressions
+    beyond `tolerance` (fraction).
+    """
+    regressions: List[str] = []
+    print(f"\n{'metric':<40}{'baseline':>12}{'current':>12}{'change':>10}")
+    for path, higher_is_better in _COMPARED.items():
+        old, new = _get(baseline, path), _get(report, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = "  REGRESSION" if worse > tolerance else ""
+        print(f"{path:<40}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{mark}")
+        if mark:
+            regressions.append(path)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--rules", type=int, default=20, help="number of SQL rules")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mode", choices=["eager", "worker"], default="eager")
+    parser.add_argument("--dispatch-every", type=int, default=50, help="ingested events per dispatcher run")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds to wait for decisions")
+    parser.add_argument("--number", type=int, default=2000, help="micro-benchmark iterations")
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression (fraction)")
+    parser.add_argument("--trace-rate", type=float, default=0.0, help="fraction of events traced")
+    args = parser.parse_args()
+
+    if args.mode == "eager":
+        current_app.conf.task_always_eager = True
+        current_app.conf.task_eager_propagates = True
+
+    if args.trace_rate > 0:
+        settings.FDS_TRACE_SAMPLE_RATE = args.trace_rate
+
+    prefix = f"B{uuid.uuid4().hex[:6]}-"
+    events = generate_events(args.orders, args.seed, prefix)
+    print(f"run {prefix} events={len(events)} rules={args.rules} mode={args.mode} db={connection.vendor}")
+
+    with rule_set(build_rules(args.rules)):
+        pipeline = run_pipeline(events, prefix, args.mode, args.dispatch_every, args.timeout)
+        micro = run_micro(prefix, args.number)
+
+    report = {
+        "version": _git_version(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "orders": args.orders,
+            "events": len(events),
+            "rules": args.rules,
+            "seed": args.seed,
+            "mode": args.mode,
+            "dispatch_every": args.dispatch_every,
+            "dispatch_mode": getattr(settings, "FDS_DISPATCH_MODE", "claim_check"),
+            "db_vendor": connection.vendor,
+        },
+        "pipeline": pipeline,
+        "micro": micro,
+    }
+    if args.trace_rate > 0:
+        report["trace"] = tracing.breakdown([s for s in tracing.exporter().spans() if s["aggregate_id"].startswith(prefix)])
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# fds_v2/benchmarks/replica.py
+"""
+Replica routing benchmark
+
+Ingest latency under heavy detection load, with rule evaluation on the
+primary or on read replicas (FDS_REPLICA_ALIASES):
+
+  - ingest:    IngestOrderView requests back to back in the main thread,
+               latency per request
+  - detection: --threads threads evaluating the order rule set for
+               already ingested orders in a loop, bound (fds_core.replica)
+               to the primary, or to services.replicas.detection_alias()
+               re-checked every 50 cases like a worker chunk
+
+Modes: idle (no detection load), primary, replica. Report (JSON): ingest
+p50 / p95 / p99 ms and detection throughput per mode, and the aliases the
+replica mode evaluated on (primary fallbacks included).
+
+Needs PostgreSQL with a streaming replica, e.g. docker-compose
+`--profile replica` with DATABASES["replica"] on port 5433 and
+FDS_REPLICA_ALIASES = ("replica",). Rows are written with a per-run prefix
+and are not deleted.
+
+Usage (from fds_v2/):
+    python -m benchmarks.replica [--orders 500] [--rules 20] [--threads 8] [--out report.json]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fds_api.settings")
+django.setup()
+
+from django.db import connections  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from benchmarks.pipeline import build_rules, generate_events, percentile, rule_set  # noqa: E402
+from fds_core.replica import reading_from  # noqa: E402
+from fds_core.rules_engine import _evaluate_target_rules  # noqa: E402
+from fds_django.services.replicas import detection_alias, replica_aliases  # noqa: E402
+from fds_django.views_async import IngestOrderView  # noqa: E402
+
+MODES = ("idle", "primary", "replica")
+
+
+def _ingest(orders: List[Dict[str, Any]]) -> List[float]:
+    factory = APIRequestFactory()
+    view = IngestOrderView.as_view()
+    latencies: List[float] = []
+    for payload in orders:
+        started = time.perf_counter()
+        view(factory.post("/orders", payload, format="json"))
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return latencies
+
+
+def _detection_load(mode: str, case_ids: List[str], stop: threading.Event, stats: Dict[str, Any]) -> None:
+    done = 0
+    aliases: Dict[str, int] = {}
+    try:
+        while not stop.is_set():
+            alias = detection_alias() if mode == "replica" else "default"
+            aliases[alias] = aliases.get(alias, 0) + 1
+            with reading_from(alias):
+                for _ in range(50):
+                    _evaluate_target_rules("order", {"order_id": case_ids[done % len(case_ids)]})
+                    done += 1
+    finally:
+        connections.close_all()  # this thread's connections
+        with stats["lock"]:
+            stats["detections"] += done
+            for alias, n in aliases.items():
+                stats["aliases"][alias] = stats["aliases"].get(alias, 0) + n
+
+
+def run_mode(mode: str, orders: List[Dict[str, Any]], case_ids: List[str], threads: int) -> Dict[str, Any]:
+    stop = threading.Event()
+    stats: Dict[str, Any] = {"lock": threading.Lock(), "detections": 0, "aliases": {}}
+    workers = [] if mode == "idle" else [
+        threading.Thread(target=_detection_load, args=(mode, case_ids, stop, stats)) for _ in range(threads)
+    ]
+    for w in workers:
+        w.start()
+    time.sleep(0.5 if workers else 0)  # let detection load ramp up
+
+    started = time.perf_counter()
+    latencies = _ingest(orders)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for w in workers:
+        w.join()
+
+    return {
+        "ingest_ms": {p: percentile(latencies, float(p[1:])) for p in ("p50", "p95", "p99")},
+        "ingested": len(latencies),
+        "detections_per_sec": stats["detections"] / elapsed if workers else 0.0,
+        "aliases": stats["aliases"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=500, help="orders ingested per mode")
+    parser.add_argument("--rules", type=int, default=20, help="number of SQL rules")
+    parser.add_argument("--threads", type=int, default=8, help="detection threads")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+
+    if not replica_aliases():
+        print("[bench] FDS_REPLICA_ALIASES is empty: replica mode falls back to the primary")
+
+    run_id = uuid.uuid4().hex[:8]
+    report: Dict[str, Any] = {
+        "run_id": run_id,
+        "rules": args.rules,
+        "threads": args.threads,
+        "replicas": replica_aliases(),
+        "modes": {},
+    }
+    with rule_set(build_rules(args.rules)):
+        # cases for the detection threads to evaluate
+        seed_orders = [p for kind, p in generate_events(args.orders, args.seed, f"{run_id}S") if kind == "order"]
+        _ingest(seed_orders)
+        case_ids = [o["order_id"] for o in seed_orders]
+
+        for mode in MODES:
+            orders = [
+                p for kind, p in generate_events(args.orders, args.seed, f"{run_id}{mode[0].upper()}")
+                if kind == "order"
+            ]
+            report["modes"][mode] = run_mode(mode, orders, case_ids, args.threads)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
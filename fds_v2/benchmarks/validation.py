@@ -0,0 +1,91 @@
+# fds_v2/benchmarks/validation.py
+"""
+Validation micro-benchmark
+
+Compares per-request validation cost of the DRF serializers (reference)
+against the fast-path schemas used by the ingestion and detect views.
+
+Usage (from fds_v2/):
+    python -m benchmarks.validation [--items 1,10,50] [--number 2000]
+"""
+
+import argparse
+import os
+import timeit
+from typing import Any, Callable, Dict
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fds_api.settings")
+django.setup()
+
+from fds_django.serializers import DetectOrderSerializer, DetectPurchaseSerializer  # noqa: E402
+from fds_django.services.validation import validate_order, validate_purchase  # noqa: E402
+
+
+def order_payload(n_items: int) -> Dict[str, Any]:
+    return {
+        "order_id": "ORD123",
+        "account_id": "A100",
+        "device_id": "D100",
+        "order_country": "JP",
+        "total_price": 12000,
+        "currency": "JPY",
+        "order_status": "CREATED",
+        "items": [
+            {"product_id": f"P{i}", "unit_price": "6000.00", "quantity": 2}
+            for i in range(n_items)
+        ],
+        "metadata": {"source": "mobile-web"},
+    }
+
+
+def purchase_payload() -> Dict[str, Any]:
+    return {
+        "purchase_id": "PUR123",
+        "order_id": "ORD123",
+        "method_type": "CARD",
+        "card_brand": "VISA",
+        "bin": "411111",
+        "card_id": "C100",
+        "payment_country": "JP",
+        "payment_status": "SUCCESS",
+        "price": 12000,
+        "currency": "JPY",
+        "metadata": {"source": "mobile-web"},
+    }
+
+
+def _per_call_us(fn: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def _drf(serializer_class, data) -> Callable[[], Any]:
+    def run():
+        s = serializer_class(data=data)
+        s.is_valid(raise_exception=True)
+        return s.validated_data
+    return run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", default="1,10,50", help="comma separated item counts")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    cases = [
+        (f"order items={n}", DetectOrderSerializer, validate_order, order_payload(int(n)))
+        for n in args.items.split(",")
+    ]
+    cases.append(("purchase", DetectPurchaseSerializer, validate_purchase, purchase_payload()))
+
+    print(f"{'case':<20}{'drf us':>12}{'fast us':>12}{'ratio':>10}")
+    for name, serializer_class, validate, data in cases:
+        drf_us = _per_call_us(_drf(serializer_class, data), args.number)
+        fast_us = _per_call_us(lambda: validate(data), args.number)
+        print(f"{name:<20}{drf_us:>12.1f}{fast_us:>12.1f}{drf_us / fast_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
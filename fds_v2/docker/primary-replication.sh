@@ -0,0 +1,4 @@
+#!/bin/sh
+# Runs once, when the db volume is initialized: allow the db-replica
+# service (docker-compose profile "replica") to stream WAL from the primary.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
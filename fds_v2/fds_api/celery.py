@@ -1,6 +1,8 @@
 import os
 from celery import Celery
 
+from fds_core.codec import register_task_serializers
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fds_api.settings")
 
 app = Celery("fds_api")
@@ -8,5 +10,12 @@ app = Celery("fds_api")
 # Read CELERY_* settings from Django settings.py
 app.config_from_object("django.conf:settings", namespace="CELERY")
 
+# Task messages use the shared codec layer (fds_core/codec.py, FDS_CODEC)
+_serializer, _accepted = register_task_serializers()
+app.conf.task_serializer = _serializer
+app.conf.result_serializer = _serializer
+app.conf.accept_content = _accepted + ["json"]
+app.conf.result_accept_content = _accepted + ["json"]
+
 # Auto-discover tasks in installed apps
 app.autodiscover_tasks()
\ No newline at end of file
@@ -0,0 +1,199 @@
+# fds_v2/fds_core/codec.py
+"""
+Codec Layer
+
+One serialization layer for every hop that encodes event data:
+  - Outbox.payload column         (ingestion -> dispatcher)
+  - Celery task messages          (dispatcher -> worker)
+  - DetectionLog.extra column     (worker -> storage)
+
+Decimal, Enum and dataclass values are encoded by the codec itself (default
+hook), so payloads are written as built: no recursive pre-normalization pass
+and exactly one serialization per hop.
+
+Backends:
+  - "orjson":  JSON, preferred whenever orjson is installed; values orjson
+               cannot represent (integers beyond 64 bits) go through the
+               stdlib backend, so they round-trip exactly as with "json"
+  - "msgpack": binary, task messages only (DB columns are jsonb); integers
+               beyond 64 bits cannot be encoded (OverflowError)
+  - "json":    stdlib fallback
+
+Settings:
+  - FDS_CODEC: backend for Celery task messages (default: "orjson" if
+    installed, else "json"). DB columns always use the best JSON backend.
+"""
+
+import datetime
+import json
+import uuid
+from dataclasses import asdict, is_dataclass
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+
+class Codec(NamedTuple):
+    name: str
+    content_type: str
+    content_encoding: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[Any], Any]
+
+
+def _default(obj: Any) -> Any:
+    """
+    Encode values the backends do not handle natively.
+    Decimal -> str keeps the previous payload format (was _normalize).
+    """
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+    if isinstance(obj, int):
+        # only reached for integers a binary backend cannot hold (msgpack)
+        raise OverflowError(f"Integer out of the 64-bit range: {obj}")
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+# A run of 19+ digits may be an integer outside orjson's 64-bit range
+# (parsed as a lossy float); such documents are decoded by json instead.
+# Digit runs are found on a digit mask (bytes.translate + find), several
+# times faster than a regex search.
+_DIGIT_MASK = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+_WIDE_INT_RUN = b"0" * 19
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj, default=_default)
+    except orjson.JSONEncodeError:
+        # integers beyond 64 bits; unserializable values raise TypeError here too
+        return _json_dumps(obj)
+
+
+def _orjson_loads(data: Any) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    raw = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+    if _WIDE_INT_RUN in raw.translate(_DIGIT_MASK):
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+def _build_codecs() -> Dict[str, Codec]:
+    codecs: Dict[str, Codec] = {
+        "json": Codec("json", "application/x-fds+json", "utf-8", _json_dumps, json.loads),
+    }
+    if orjson is not None:
+        codecs["orjson"] = Codec(
+            "orjson",
+            "application/x-fds+orjson",
+            "utf-8",
+            _orjson_dumps,
+            _orjson_loads,
+        )
+    if msgpack is not None:
+        codecs["msgpack"] = Codec(
+            "msgpack",
+            "application/x-fds+msgpack",
+            "binary",
+            lambda obj: msgpack.packb(obj, default=_default, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False),
+        )
+    return codecs
+
+
+# Structure: name -> Codec, only backends importable in this process
+CODECS: Dict[str, Codec] = _build_codecs()
+
+# JSON text backend for jsonb columns
+JSON_CODEC: Codec = CODECS.get("orjson") or CODECS["json"]
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """
+    Return the codec for task messages: `name`, else settings.FDS_CODEC,
+    else the JSON backend.
+    """
+    if name is None:
+        try:
+            from django.conf import settings
+            name = getattr(settings, "FDS_CODEC", None)
+        except Exception:
+            name = None
+    if name is None:
+        return JSON_CODEC
+    if name not in CODECS:
+        raise ValueError(f"Unsupported codec: {name} (available: {', '.join(CODECS)})")
+    return CODECS[name]
+
+
+# --------------------------
+# Django JSONField hooks
+# --------------------------
+
+class CodecJSONEncoder(json.JSONEncoder):
+    """
+    JSONField(encoder=...) hook: Django calls json.dumps(value, cls=encoder),
+    which lands here and is served by a single JSON_CODEC pass.
+    """
+    def encode(self, o: Any) -> str:
+        return JSON_CODEC.dumps(o).decode("utf-8")
+
+    def default(self, o: Any) -> Any:
+        return _default(o)
+
+
+class CodecJSONDecoder(json.JSONDecoder):
+    """
+    JSONField(decoder=...) hook: Django calls json.loads(value, cls=decoder).
+    """
+    def decode(self, s: str, *args: Any) -> Any:
+        return JSON_CODEC.loads(s)
+
+
+# --------------------------
+# Celery / kombu
+# --------------------------
+
+def register_task_serializers() -> Tuple[str, List[str]]:
+    """
+    Register every available codec with kombu as "fds-<name>".
+
+    Returns (serializer for outgoing messages, accepted serializer names).
+    All codecs are accepted so workers can drain messages produced by a
+    dispatcher configured with a different FDS_CODEC.
+    """
+    from kombu.serialization import register
+
+    for codec in CODECS.values():
+        register(
+            f"fds-{codec.name}",
+            codec.dumps,
+            codec.loads,
+            content_type=codec.content_type,
+            content_encoding=codec.content_encoding,
+        )
+    accepted = [f"fds-{name}" for name in CODECS]
+    return f"fds-{get_codec().name}", accepted
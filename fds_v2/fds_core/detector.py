@@ -1,28 +1,101 @@
-from typing import Any
+from typing import Any, Collection, List, Optional
 
-from .enums import CaseKind
-from .models import Result
-from .rules_engine import detect_order_core, detect_purchase_core
-from .side_effects import register_blocklist
+from . import tracing
+from .enums import CaseKind, Decision
+from .hit import Hit
+from .models import CaseParams, PartialResult, RegisterParams, Result
+from .rule_cache import get_rules
+from .rules_engine import detect_order_core, detect_purchase_core, evaluate_rules_until, finalize_hits
+from .side_effects import log_decision, register_blocklist
 
 
 def detect_case(kind: CaseKind | str, ref_id: Any) -> Result:
+    """
+    Run detection for one case. `ref_id` is the case id or CaseParams
+    (whose refs are the blocklist registration targets).
+    """
     if isinstance(kind, str):
         kind = CaseKind(kind)
 
-    if kind == CaseKind.ORDER:
-        final, hits = detect_order_core(ref_id)
-    elif kind == CaseKind.PURCHASE:
-        final, hits = detect_purchase_core(ref_id)
-    else:
-        raise ValueError(f"Unsupported CaseKind: {kind}")
-
-    if any(h.register_blocklist for h in hits):
-        register_blocklist(kind.value, ref_id, hits)
-
-    return Result(
-        kind=kind,
-        ref_id=str(ref_id),
-        decision=final,
-        hits=hits,
-    )
\ No newline at end of file
+    params = ref_id if isinstance(ref_id, CaseParams) else None
+    case_id = params.case_id if params is not None else ref_id
+
+    evaluated = [rule[0] for rule in get_rules(kind.value)]
+    with tracing.span("rules"):
+        if kind == CaseKind.ORDER:
+            final, hits = detect_order_core(case_id)
+        elif kind == CaseKind.PURCHASE:
+            final, hits = detect_purchase_core(case_id)
+        else:
+            raise ValueError(f"Unsupported CaseKind: {kind}")
+
+    outcome = _outcome(kind, params, final, hits)
+    with tracing.span("decision_log"):
+        log_decision(kind.value, case_id, final, hits, evaluated=evaluated)
+    return Result(**outcome)
+
+
+def _outcome(kind: CaseKind, params: Optional[CaseParams], final: Decision, hits: List[Hit]) -> dict:
+    """
+    Apply blocklist side effects for the hits and build the Result fields.
+    """
+    rp = RegisterParams()
+    if params is not None and any(h.register_blocklist for h in hits):
+        rp = RegisterParams(user=params.refs.user, device=params.refs.device, card=params.refs.card)
+        with tracing.span("blocklist"):
+            register_blocklist(kind.value, rp)
+
+    return {
+        "decision": final,
+        "reasons": [h.reason or f"rule={h.rule_id}, decision={h.decision.value}" for h in hits],
+        "register_blocklist": not rp.is_empty(),
+        "register_params": rp,
+    }
+
+
+def _params_for(kind: CaseKind, params: CaseParams) -> dict:
+    return {"order_id": params.case_id} if kind == CaseKind.ORDER else {"purchase_id": params.case_id}
+
+
+def detect_case_within(kind: CaseKind | str, params: CaseParams, deadline: Optional[float]) -> PartialResult:
+    """
+    Deadline-bound detection: evaluate rules in priority / cost order until
+    `deadline` (time.monotonic()). The decision covers the evaluated rules
+    only; the rest are listed in pending_rules for complete_case.
+    """
+    if isinstance(kind, str):
+        kind = CaseKind(kind)
+
+    hits, evaluated, pending = evaluate_rules_until(kind.value, _params_for(kind, params), deadline)
+    final, hits_sorted = finalize_hits(hits)
+
+    return PartialResult(
+        **_outcome(kind, params, final, hits_sorted),
+        evaluated_rules=evaluated,
+        pending_rules=pending,
+        hits=hits_sorted,
+    )
+
+
+def complete_case(
+    kind: CaseKind | str,
+    params: CaseParams,
+    prior_hits: List[Hit],
+    exclude: Collection[str],
+) -> PartialResult:
+    """
+    Finish a provisional detection: evaluate the rules not in `exclude`
+    (no deadline) and resolve the final decision together with the hits
+    of the provisional pass. evaluated_rules covers both passes.
+    """
+    if isinstance(kind, str):
+        kind = CaseKind(kind)
+
+    with tracing.span("rules"):
+        hits, evaluated, _ = evaluate_rules_until(kind.value, _params_for(kind, params), exclude=set(exclude))
+    final, hits_sorted = finalize_hits(list(prior_hits) + hits)
+    return PartialResult(
+        **_outcome(kind, params, final, hits_sorted),
+        evaluated_rules=list(exclude) + evaluated,
+        hits=hits_sorted,
+    )
@@ -0,0 +1,130 @@
+# fds_v2/fds_core/entity_links.py
+"""
+Entity Link Index
+
+Graph of accounts, devices and cards that appeared together, maintained at
+ingestion (fds_django.services.entity_links) so linked-entity rules are
+indexed lookups instead of self-joins across Order / Purchase.
+
+Tables:
+  - fds_django_entitylink:    adjacency, one row per direction
+                              (src_type, src_id, dst_type, dst_id)
+  - fds_django_entitynode:    entity -> cluster_id (union-find, flattened)
+  - fds_django_entitycluster: cluster size and number of blocklisted members
+
+Edges: account-device (order), card-account and card-device (purchase, via
+its order). Clusters are merged by relabeling the smaller one, so every node
+points straight at its cluster: lookups never walk parent chains.
+
+State lives in the database, so workers start without rebuilding anything;
+`manage.py rebuild_entity_links` rebuilds it from history.
+
+Rules query it instead of SQL:
+
+    LINK accounts card > 3          distinct accounts linked to the card
+    LINK devices account >= 5       distinct devices linked to the account
+    LINK cluster_size device > 20   entities in the device's cluster
+    LINK blocked device > 0         blocklisted entities in the device's cluster
+
+The entity is resolved from the case like velocity windows
+(fds_core.velocity.ENTITY_SOURCES).
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from .replica import read_connection
+from .velocity import ENTITY_SOURCES, OPS
+
+ENTITY_TYPES: Tuple[str, ...] = ("account", "device", "card")
+
+# Structure: measure -> neighbour type counted (degree measures only)
+_DEGREE_MEASURES: Dict[str, str] = {"accounts": "account", "devices": "device", "cards": "card"}
+_CLUSTER_MEASURES: Tuple[str, ...] = ("cluster_size", "blocked")
+
+_RULE_RE = re.compile(r"\s*LINK\s+(\w+)\s+(\w+)\s*(>=|<=|>|<|=)\s*(\d+)\s*;?\s*", re.IGNORECASE)
+
+
+def linked_count(entity_type: str, entity_id: str, neighbour_type: str) -> int:
+    """
+    Distinct entities of `neighbour_type` directly linked to an entity.
+    """
+    sql = """
+        SELECT COUNT(*)
+        FROM fds_django_entitylink
+        WHERE src_type = %s AND src_id = %s AND dst_type = %s
+    """
+    with read_connection().cursor() as cur:
+        cur.execute(sql, [entity_type, entity_id, neighbour_type])
+        return int(cur.fetchone()[0])
+
+
+def cluster_stats(entity_type: str, entity_id: str) -> Optional[Dict[str, int]]:
+    """
+    {"cluster_id", "size", "blocked"} for the entity's cluster, None if unseen.
+    """
+    sql = """
+        SELECT c.id, c.size, c.blocked
+        FROM fds_django_entitynode n
+        JOIN fds_django_entitycluster c ON c.id = n.cluster_id
+        WHERE n.entity_type = %s AND n.entity_id = %s
+    """
+    with read_connection().cursor() as cur:
+        cur.execute(sql, [entity_type, entity_id])
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return {"cluster_id": row[0], "size": row[1], "blocked": row[2]}
+
+
+def measure(name: str, entity_type: str, entity_id: Optional[str]) -> int:
+    if not entity_id:
+        return 0
+    if name in _DEGREE_MEASURES:
+        return linked_count(entity_type, entity_id, _DEGREE_MEASURES[name])
+    stats = cluster_stats(entity_type, entity_id)
+    if stats is None:
+        return 1 if name == "cluster_size" else 0
+    return stats["size"] if name == "cluster_size" else stats["blocked"]
+
+
+# --------------------------
+# Link rules
+# --------------------------
+
+def is_link_rule(rule_sql: str) -> bool:
+    return rule_sql.lstrip()[:4].upper() == "LINK"
+
+
+@lru_cache(maxsize=256)
+def parse_link_rule(rule_sql: str) -> Tuple[str, str, str, int]:
+    """
+    Parse "LINK <measure> <entity> <op> <threshold>".
+    """
+    m = _RULE_RE.fullmatch(rule_sql)
+    if not m:
+        raise ValueError(f"Invalid link rule: {rule_sql!r}")
+    name, entity, op, threshold = m.group(1).lower(), m.group(2).lower(), m.group(3), int(m.group(4))
+    if name not in _DEGREE_MEASURES and name not in _CLUSTER_MEASURES:
+        raise ValueError(f"Unknown link measure: {name}")
+    if entity not in ENTITY_TYPES:
+        raise ValueError(f"Unsupported link entity: {entity}")
+    return name, entity, op, threshold
+
+
+def run_link_rule(rule_sql: str, case_id: str, target: str) -> bool:
+    """
+    Evaluate a link rule for a case: entity lookup plus one or two indexed reads.
+    """
+    name, entity, op, threshold = parse_link_rule(rule_sql)
+    source = ENTITY_SOURCES.get((target, entity))
+    if source is None:
+        raise ValueError(f"Entity {entity} is not available for {target} rules")
+
+    with read_connection().cursor() as cur:
+        cur.execute(source, [case_id])
+        row = cur.fetchone()
+    if not row:
+        return False
+    return OPS[op](measure(name, entity, row[0]), threshold)
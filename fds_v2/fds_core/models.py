@@ -1,6 +1,7 @@
 from typing import Optional, List
 from pydantic import BaseModel, Field
 from .enums import Decision, CaseKind
+from .hit import Hit
 
 class EntityRefs(BaseModel):
     user: Optional[str] = None
@@ -24,4 +25,17 @@ class Result(BaseModel):
     decision: Decision
     reasons: List[str] = Field(default_factory=list)
     register_blocklist: bool = False
-    register_params: RegisterParams = Field(default_factory=RegisterParams)
\ No newline at end of file
+    register_params: RegisterParams = Field(default_factory=RegisterParams)
+
+class PartialResult(Result):
+    """
+    Result of deadline-bound detection: `decision` covers evaluated_rules
+    only; pending_rules are completed asynchronously (complete_case).
+    """
+    evaluated_rules: List[str] = Field(default_factory=list)
+    pending_rules: List[str] = Field(default_factory=list)
+    hits: List[Hit] = Field(default_factory=list)
+
+    @property
+    def provisional(self) -> bool:
+        return bool(self.pending_rules)
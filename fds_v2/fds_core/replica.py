@@ -0,0 +1,42 @@
+# fds_v2/fds_core/replica.py
+"""
+Read alias for rule evaluation
+
+Rule SQL only reads. Workers pick the database alias a case is evaluated
+on (fds_django.services.replicas.detection_alias) and bind it for the
+evaluation with `reading_from(alias)`; rules_engine, velocity and
+entity_links run their rule queries on `read_connection()`.
+
+Outside reading_from everything reads from "default" (the primary), so the
+synchronous /fds/detect path, which evaluates rows it has just written,
+never reads from a replica. ORM reads follow the same alias through
+fds_django.db_router.ReplicaRouter.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from django.db import connections
+
+_READ_ALIAS: ContextVar[str] = ContextVar("fds_read_alias", default="default")
+
+
+def read_alias() -> str:
+    return _READ_ALIAS.get()
+
+
+def read_connection():
+    """
+    Connection rule queries run on: the bound read alias, else the primary.
+    """
+    return connections[_READ_ALIAS.get()]
+
+
+@contextmanager
+def reading_from(alias: str) -> Iterator[str]:
+    token = _READ_ALIAS.set(alias)
+    try:
+        yield alias
+    finally:
+        _READ_ALIAS.reset(token)
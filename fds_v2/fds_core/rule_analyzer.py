@@ -0,0 +1,347 @@
+# fds_v2/fds_core/rule_analyzer.py
+"""
+Rule Cost Analyzer
+
+Runs EXPLAIN on every rule before it goes live (rule_cache loader) or on
+demand (`manage.py analyze_rules`), with a representative case id bound to
+the %s placeholder.
+
+Per rule it reports:
+  - cost:      total plan cost (PostgreSQL; None on backends without costs)
+  - seq_scans: tables read by a sequential scan even with enable_seqscan off,
+               i.e. no index can serve the predicate (on SQLite: "SCAN" steps)
+  - flags:     "seq_scan", "over_budget", "error"
+  - suggested_indexes: CREATE INDEX statements for predicate columns of
+               Order / Purchase / OrderItem that no index leads with
+
+Reports are stored per rule generation (model RuleGeneration), one per
+distinct rule set by fingerprint, so cost regressions can be compared
+across rule changes.
+
+Settings:
+  - FDS_RULE_EXPLAIN:            analyze in the loader (default True)
+  - FDS_RULE_COST_BUDGET:        max plan cost per rule (default 10000.0)
+  - FDS_RULE_REJECT_OVER_BUDGET: do not activate rules over budget (default False)
+  - FDS_RULE_EXPLAIN_IDS:        {"order": id, "purchase": id} to bind instead
+                                 of the highest case ids
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db import connection, transaction
+
+from .codec import JSON_CODEC
+from .entity_links import is_link_rule
+from .velocity import is_velocity_rule
+
+# Tables index suggestions are made for
+INDEXED_TABLES: Tuple[str, ...] = ("fds_django_order", "fds_django_purchase", "fds_django_orderitem")
+
+_CASE_ID_SQL: Dict[str, str] = {
+    # primary key order: one index probe (created_at is not indexed)
+    "order": "SELECT order_id FROM fds_django_order ORDER BY order_id DESC LIMIT 1",
+    "purchase": "SELECT purchase_id FROM fds_django_purchase ORDER BY purchase_id DESC LIMIT 1",
+}
+
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+\"?(\w+)\"?(?:\s+(?:AS\s+)?(?!WHERE\b|JOIN\b|ON\b|INNER\b|LEFT\b|RIGHT\b|GROUP\b|ORDER\b|LIMIT\b)(\w+))?", re.IGNORECASE)
+_PREDICATE_KEYS: Tuple[str, ...] = ("Filter", "Index Cond", "Recheck Cond", "Join Filter", "Hash Cond", "Merge Cond")
+
+
+def _setting(name: str, default: Any) -> Any:
+    from django.conf import settings
+    return getattr(settings, name, default)
+
+
+def rules_fingerprint(rules: Dict[str, List[Tuple[str, str, str, bool]]]) -> str:
+    """
+    Stable hash of a rule set (target -> rule tuples).
+    """
+    h = hashlib.sha256()
+    for target in sorted(rules):
+        for rule in sorted(rules[target]):
+            h.update(repr((target,) + tuple(rule)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def representative_ids() -> Dict[str, str]:
+    """
+    Case ids bound to rule placeholders: FDS_RULE_EXPLAIN_IDS, else the
+    order / purchase with the highest id, else a dummy id.
+    """
+    ids = dict(_setting("FDS_RULE_EXPLAIN_IDS", {}))
+    with connection.cursor() as cur:
+        for target, sql in _CASE_ID_SQL.items():
+            if target in ids:
+                continue
+            cur.execute(sql)
+            row = cur.fetchone()
+            ids[target] = str(row[0]) if row else "0"
+    return ids
+
+
+# --------------------------
+# Schema helpers
+# --------------------------
+
+def _table_aliases(rule_sql: str) -> Dict[str, str]:
+    """Structure: alias or table name -> table name"""
+    aliases: Dict[str, str] = {}
+    for table, alias in _TABLE_REF.findall(rule_sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def _columns(cur: Any, table: str) -> List[str]:
+    return [c.name for c in connection.introspection.get_table_description(cur, table)]
+
+
+def _indexed_columns(cur: Any, table: str) -> Set[str]:
+    """Columns that lead an index, primary key or unique constraint."""
+    leading: Set[str] = set()
+    for c in connection.introspection.get_constraints(cur, table).values():
+        if (c.get("index") or c.get("primary_key") or c.get("unique")) and c.get("columns"):
+            leading.add(c["columns"][0])
+    return leading
+
+
+def _predicate_columns(text: str, columns: Iterable[str]) -> List[str]:
+    return [c for c in columns if re.search(rf"\b{re.escape(c)}\b", text)]
+
+
+def _suggest(cur: Any, table: str, predicate: str) -> List[str]:
+    if table not in INDEXED_TABLES:
+        return []
+    indexed = _indexed_columns(cur, table)
+    return [
+        f"CREATE INDEX ON {table} ({col})"
+        for col in _predicate_columns(predicate, _columns(cur, table))
+        if col not in indexed
+    ]
+
+
+# --------------------------
+# EXPLAIN per backend
+# --------------------------
+
+def _walk(plan: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def _explain_postgresql(cur: Any, rule_sql: str, args: List[Any]) -> Tuple[Optional[float], List[Tuple[str, str]]]:
+    """
+    Returns (total cost, [(seq-scanned table, predicate text)]).
+    Seq scans are taken from a plan with enable_seqscan off, so small tables
+    (where the planner would scan anyway) do not produce false positives.
+    """
+    def explain() -> Dict[str, Any]:
+        cur.execute("EXPLAIN (FORMAT JSON) " + rule_sql, args)
+        doc = cur.fetchone()[0]
+        if isinstance(doc, str):
+            doc = JSON_CODEC.loads(doc)
+        return doc[0]["Plan"]
+
+    cost = float(explain()["Total Cost"])
+    with transaction.atomic():
+        cur.execute("SET LOCAL enable_seqscan = off")
+        try:
+            plan = explain()
+        finally:
+            # SET LOCAL outlives a released savepoint inside an outer transaction
+            cur.execute("SET LOCAL enable_seqscan TO DEFAULT")
+
+    scans: List[Tuple[str, str]] = []
+    for node in _walk(plan):
+        if node.get("Node Type") == "Seq Scan":
+            predicate = " ".join(str(node.get(k, "")) for k in _PREDICATE_KEYS)
+            scans.append((node.get("Relation Name", ""), predicate))
+    return cost, scans
+
+
+def _explain_sqlite(cur: Any, rule_sql: str, args: List[Any]) -> Tuple[Optional[float], List[Tuple[str, str]]]:
+    """
+    SQLite has no plan costs; "SCAN <table|alias>" steps are full scans.
+    The predicate is approximated by the rule SQL text.
+    """
+    aliases = _table_aliases(rule_sql)
+    cur.execute("EXPLAIN QUERY PLAN " + rule_sql, args)
+    scans: List[Tuple[str, str]] = []
+    for row in cur.fetchall():
+        detail = str(row[-1])
+        if detail.startswith("SCAN "):
+            name = detail.split()[1]
+            scans.append((aliases.get(name, name), rule_sql))
+    return None, scans
+
+
+_EXPLAINERS = {
+    "postgresql": _explain_postgresql,
+    "sqlite": _explain_sqlite,
+}
+
+
+def explain_rule(rule_id: str, rule_sql: str, target: str, case_id: str, budget: float) -> Dict[str, Any]:
+    """
+    Analyze one rule. Never raises: failures are reported with the "error"
+    flag, and rolled back to a savepoint so an enclosing transaction stays
+    usable (PostgreSQL aborts a transaction on any failed statement).
+    """
+    entry: Dict[str, Any] = {
+        "rule_id": rule_id,
+        "target": target,
+        "cost": None,
+        "seq_scans": [],
+        "flags": [],
+        "suggested_indexes": [],
+        "error": None,
+    }
+    if is_velocity_rule(rule_sql):
+        entry["kind"] = "velocity"   # bucket lookup, constant cost
+        return entry
+    if is_link_rule(rule_sql):
+        entry["kind"] = "link"       # entity link index lookup
+        return entry
+
+    explainer = _EXPLAINERS.get(connection.vendor)
+    if explainer is None:
+        entry["error"] = f"EXPLAIN not supported on {connection.vendor}"
+        return entry
+
+    try:
+        with transaction.atomic(), connection.cursor() as cur:
+            cost, scans = explainer(cur, rule_sql, [case_id])
+            suggestions: List[str] = []
+            for table, predicate in scans:
+                for stmt in _suggest(cur, table, predicate):
+                    if stmt not in suggestions:
+                        suggestions.append(stmt)
+    except Exception as e:
+        entry["error"] = str(e)
+        entry["flags"].append("error")
+        return entry
+
+    entry["cost"] = cost
+    entry["seq_scans"] = sorted({table for table, _ in scans})
+    entry["suggested_indexes"] = suggestions
+    if scans:
+        entry["flags"].append("seq_scan")
+    if cost is not None and cost > budget:
+        entry["flags"].append("over_budget")
+    return entry
+
+
+def analyze_rules(rules: Dict[str, List[Tuple[str, str, str, bool]]], budget: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Analyze a rule set (target -> rule tuples, as in rule_cache).
+
+    Returns {"fingerprint", "budget", "vendor", "case_ids", "rules": [...],
+    "rejected": [rule_id, ...]}; "rejected" lists over-budget rules and is
+    only filled when FDS_RULE_REJECT_OVER_BUDGET is set.
+    """
+    budget = float(_setting("FDS_RULE_COST_BUDGET", 10000.0) if budget is None else budget)
+    case_ids = representative_ids()
+
+    entries = [
+        explain_rule(rule_id, rule_sql, target, case_ids[target], budget)
+        for target in ("order", "purchase")
+        for rule_id, rule_sql, _action, _register_bl in rules.get(target, [])
+    ]
+    report = {
+        "fingerprint": rules_fingerprint(rules),
+        "budget": budget,
+        "vendor": connection.vendor,
+        "case_ids": case_ids,
+        "rules": entries,
+    }
+    report["rejected"] = rejected_rule_ids(report)
+    return report
+
+
+def cost_policy() -> Dict[str, Any]:
+    """
+    Settings that decide which analyzed rules are activated.
+    """
+    return {
+        "budget": float(_setting("FDS_RULE_COST_BUDGET", 10000.0)),
+        "reject_over_budget": bool(_setting("FDS_RULE_REJECT_OVER_BUDGET", False)),
+    }
+
+
+def apply_budget(report: Dict[str, Any], budget: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Re-flag a stored report from its raw costs against `budget` (default
+    FDS_RULE_COST_BUDGET) and refresh "rejected" for the current settings.
+    The fingerprint covers the rules only, so a reused report may have been
+    flagged under another budget.
+    """
+    budget = float(_setting("FDS_RULE_COST_BUDGET", 10000.0) if budget is None else budget)
+    for e in report["rules"]:
+        e["flags"] = [f for f in e["flags"] if f != "over_budget"]
+        if e["cost"] is not None and e["cost"] > budget:
+            e["flags"].append("over_budget")
+    report["budget"] = budget
+    report["rejected"] = rejected_rule_ids(report)
+    return report
+
+
+def rejected_rule_ids(report: Dict[str, Any]) -> List[str]:
+    """
+    Rules not to activate: over budget, when FDS_RULE_REJECT_OVER_BUDGET is set.
+    """
+    if not _setting("FDS_RULE_REJECT_OVER_BUDGET", False):
+        return []
+    return [e["rule_id"] for e in report["rules"] if "over_budget" in e["flags"]]
+
+
+# --------------------------
+# Rule generations
+# --------------------------
+
+def latest_generation() -> Optional[Dict[str, Any]]:
+    """
+    Most recently saved rule generation: {"id", "fingerprint", "rule_count", "report"}.
+    """
+    from fds_django.models import RuleGeneration
+    return (
+        RuleGeneration.objects.order_by("-updated_at", "-id")
+        .values("id", "fingerprint", "rule_count", "report")
+        .first()
+    )
+
+
+def save_generation(report: Dict[str, Any]) -> int:
+    """
+    Store a report as the generation of its rule set: created for a new
+    fingerprint, refreshed (and made the latest) for a known one. The
+    unique fingerprint keeps concurrent loaders to one row. Returns the
+    generation id.
+    """
+    from fds_django.models import RuleGeneration
+    generation, _ = RuleGeneration.objects.update_or_create(
+        fingerprint=report["fingerprint"],
+        defaults={"rule_count": len(report["rules"]), "report": report},
+    )
+    return generation.id
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Human-readable report (management command output).
+    """
+    lines = [f"budget={report['budget']} vendor={report['vendor']} fingerprint={report['fingerprint'][:12]}"]
+    for e in report["rules"]:
+        cost = "-" if e["cost"] is None else f"{e['cost']:.1f}"
+        flags = ",".join(e["flags"]) or "ok"
+        lines.append(f"  {e['target']:<8} {e['rule_id']:<24} cost={cost:<10} {flags}")
+        if e["error"]:
+            lines.append(f"      error: {e['error']}")
+        for stmt in e["suggested_indexes"]:
+            lines.append(f"      suggest: {stmt};")
+    if report["rejected"]:
+        lines.append(f"rejected: {', '.join(report['rejected'])}")
+    return "\n".join(lines)
@@ -7,33 +7,80 @@ It is designed to be lightweight, thread-safe, and fast to query during
 runtime detection.
 
 Responsible for:
-  - Load rule definitions from the database at application startup
+  - Load rule definitions lazily, on first detection in each process
   - Store rules separately per detection target (“order” / “purchase”)
+  - EXPLAIN rules before activation and store the cost report with the
+    rule generation (see rule_analyzer)
+  - Persist the active rule set to a snapshot file, so new processes start
+    from it and only verify it against the database
   - Expose efficient read-only access for the rule-engine layer
 
+Loading (ensure_rules_loaded, called by get_rules):
+  1. the snapshot file (FDS_RULE_SNAPSHOT_PATH), if present: no database
+     access; AppConfig.ready() reads it at startup
+  2. the snapshot is verified against the rules table (one SELECT, no
+     EXPLAIN) and the cost budget settings; on mismatch the rules are
+     reloaded from the database
+  3. without a snapshot, rules are loaded from the database
+  Until a rule set is loaded, get_rules raises RulesUnavailable: detection
+  fails closed instead of allowing everything. Failed database loads are
+  retried after FDS_RULE_LOAD_RETRY_SECONDS.
+
 Schema reference (fds_django.models.Rule):
   - rule_id: unique rule identifier (str)
   - rule_sql: SQL fragment evaluated by the engine (str)
   - rule_action: result on hit ("BLOCK" | "REVIEW")
   - target: detection type ("order" | "purchase")
   - register_blocklist: whether a hit requests blocklist registration (bool)
+
+Settings:
+  - FDS_RULE_SNAPSHOT_PATH: snapshot file (default: None, snapshots disabled)
+  - FDS_RULE_LOAD_RETRY_SECONDS: delay before retrying a failed load (default 5)
+  - FDS_RULES_ALLOW_EMPTY: accept an empty rules table as a loaded rule set
+    (default False: an empty table fails closed like a failed load)
 """
 
-from typing import Dict, List, Tuple
-from django.db import connection
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
 from threading import Lock
 
+from . import rule_analyzer
+from .codec import JSON_CODEC
+
+SNAPSHOT_FORMAT = 1
+
+
+class RulesUnavailable(RuntimeError):
+    """No rule set is loaded: detection must not run (fail closed)."""
+
 
 # Structure: target -> list of (rule_id, rule_sql, action, register_blocklist)
 _RULES: Dict[str, List[Tuple[str, str, str, bool]]] = {"order": [], "purchase": []}
 
+# Structure: rule_id -> plan cost from the rule generation report (see rule_analyzer)
+_COSTS: Dict[str, float] = {}
+
+# Structure: loader state of this process
+#   source: "db" | "snapshot" | None, fingerprint: rules_fingerprint of the
+#   rules table the active set was built from, policy: rule_analyzer.cost_policy
+#   it was filtered under, verified: checked against the DB
+_STATE: Dict[str, Any] = {
+    "loaded": False, "source": None, "fingerprint": None, "policy": None, "verified": False, "retry_at": 0.0,
+}
+
 # Simple thread lock for safe concurrent access and refresh
 _LOCK = Lock()
 
+# Serializes loading; held across database reads, never by readers
+_LOAD_LOCK = Lock()
 
-def load_rules_from_db() -> None:
+
+def read_rules_from_db() -> Dict[str, List[Tuple[str, str, str, bool]]]:
     """
-    Load rules from the 'rules' table at Django startup (AppConfig.ready)
+    Read and normalize rules from the 'rules' table without activating them.
     """
     sql = """
         SELECT
@@ -41,7 +88,7 @@ def load_rules_from_db() -> None:
             rule_sql,
             rule_action,
             target,
-            COALESCE(register_blocklist, 0) AS register_blocklist
+            register_blocklist
         FROM fds_django_rules
         ORDER BY rule_id ASC
     """
@@ -70,26 +117,223 @@ def load_rules_from_db() -> None:
                 continue
 
         cache[target].append((rule_id, rule_sql, action, register_bl))
+    return cache
+
+
+def load_rules_from_db() -> None:
+    """
+    Load rules from the 'rules' table, activate them and refresh the snapshot.
+    """
+    _load_from_db(read_rules_from_db())
+
+
+def _load_from_db(db_rules: Dict[str, List[Tuple[str, str, str, bool]]]) -> None:
+    cache, costs = _check_rule_costs(db_rules)
+    _activate(cache, costs, rule_analyzer.rules_fingerprint(db_rules), rule_analyzer.cost_policy(), source="db")
+    print(f"[rules_cache] Loaded {len(cache['order'])} order rules, {len(cache['purchase'])} purchase rules.")
 
+    if _snapshot_path():
+        try:
+            write_snapshot()
+        except OSError as e:
+            print(f"[rules_cache] skip snapshot write: {e}")
+
+
+def _activate(
+    cache: Dict[str, List[Tuple[str, str, str, bool]]],
+    costs: Dict[str, float],
+    fingerprint: str,
+    policy: Optional[Dict[str, Any]],
+    source: str,
+) -> None:
+    empty = not cache["order"] and not cache["purchase"]
+    loaded = not empty or getattr(settings, "FDS_RULES_ALLOW_EMPTY", False)
     with _LOCK:
         _RULES["order"] = cache["order"]
         _RULES["purchase"] = cache["purchase"]
+        _COSTS.clear()
+        _COSTS.update(costs)
+        _STATE.update(loaded=loaded, source=source, fingerprint=fingerprint, policy=policy, verified=source == "db")
+    if not loaded:
+        print(f"[rules_cache] No rules in {source}: detection stays unavailable (FDS_RULES_ALLOW_EMPTY).")
 
-    print(f"[rules_cache] Loaded {len(cache['order'])} order rules, {len(cache['purchase'])} purchase rules.")
 
+def _check_rule_costs(
+    cache: Dict[str, List[Tuple[str, str, str, bool]]],
+) -> Tuple[Dict[str, List[Tuple[str, str, str, bool]]], Dict[str, float]]:
+    """
+    EXPLAIN the rule set before activation (fds_core.rule_analyzer).
+
+    The report is stored with the rule generation; an unchanged rule set
+    reuses its stored costs, re-flagged against the current budget.
+    Over-budget rules are dropped when FDS_RULE_REJECT_OVER_BUDGET is set.
+    Analysis failures never block loading; the analysis runs in a
+    savepoint, so a failure cannot abort a caller's transaction either.
+
+    Returns (rules to activate, rule_id -> plan cost for rules with a cost).
+    """
+    if not getattr(settings, "FDS_RULE_EXPLAIN", True):
+        return cache, {}
+    try:
+        with transaction.atomic():
+            latest = rule_analyzer.latest_generation()
+            if latest is not None and latest["fingerprint"] == rule_analyzer.rules_fingerprint(cache):
+                report = rule_analyzer.apply_budget(latest["report"])
+            else:
+                report = rule_analyzer.analyze_rules(cache)
+                rule_analyzer.save_generation(report)
+    except Exception as e:
+        print(f"[rules_cache] skip rule cost analysis: {e}")
+        return cache, {}
+
+    costs: Dict[str, float] = {}
+    for entry in report["rules"]:
+        if entry["cost"] is not None:
+            costs[entry["rule_id"]] = entry["cost"]
+        if entry["flags"]:
+            print(f"[rules_cache] rule {entry['rule_id']}: {', '.join(entry['flags'])} (cost={entry['cost']})")
+
+    rejected = set(rule_analyzer.rejected_rule_ids(report))
+    if not rejected:
+        return cache, costs
+    print(f"[rules_cache] Rejected over-budget rules: {', '.join(sorted(rejected))}")
+    return {
+        target: [rule for rule in rules if rule[0] not in rejected]
+        for target, rules in cache.items()
+    }, costs
+
+
+# --------------------------
+# Snapshots
+# --------------------------
+
+def _snapshot_path() -> Optional[str]:
+    return getattr(settings, "FDS_RULE_SNAPSHOT_PATH", None)
+
+
+def write_snapshot(path: Optional[str] = None) -> str:
+    """
+    Write the active rule set to the snapshot file (atomic replace).
+    """
+    path = path or _snapshot_path()
+    if not path:
+        raise ValueError("FDS_RULE_SNAPSHOT_PATH is not set")
+    with _LOCK:
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "fingerprint": _STATE["fingerprint"],
+            "policy": _STATE["policy"],
+            "rules": {target: list(rules) for target, rules in _RULES.items()},
+            "costs": dict(_COSTS),
+            "written_at": time.time(),
+        }
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(JSON_CODEC.dumps(snapshot))
+    os.replace(tmp, path)
+    return path
+
+
+def load_snapshot(path: Optional[str] = None) -> bool:
+    """
+    Activate the rule set from the snapshot file without touching the
+    database. It stays unverified until ensure_rules_loaded checks it.
+    Returns False when there is no usable snapshot.
+    """
+    path = path or _snapshot_path()
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        with open(path, "rb") as f:
+            snapshot = JSON_CODEC.loads(f.read())
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            print(f"[rules_cache] ignore snapshot {path}: format {snapshot.get('format')}")
+            return False
+        cache = {
+            target: [(str(r[0]), r[1], r[2], bool(r[3])) for r in snapshot["rules"].get(target, [])]
+            for target in ("order", "purchase")
+        }
+        _activate(cache, snapshot.get("costs", {}), snapshot["fingerprint"], snapshot.get("policy"), source="snapshot")
+    except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+        print(f"[rules_cache] ignore snapshot {path}: {e}")
+        return False
+
+    print(f"[rules_cache] Loaded {len(cache['order'])} order rules, {len(cache['purchase'])} purchase rules from snapshot.")
+    return True
+
+
+def ensure_rules_loaded() -> None:
+    """
+    Load (or verify) the rule set on first use. Raises RulesUnavailable when
+    no rule set can be loaded. While a loaded snapshot is being verified,
+    other threads keep serving it instead of waiting.
+    """
+    if _STATE["verified"] and _STATE["loaded"]:
+        return
+    if _STATE["loaded"]:
+        if not _LOAD_LOCK.acquire(blocking=False):
+            return
+    else:
+        _LOAD_LOCK.acquire()
+    try:
+        if _STATE["verified"] and _STATE["loaded"]:
+            return
+        if time.monotonic() >= _STATE["retry_at"]:
+            if not _STATE["loaded"] and _STATE["source"] is None:
+                load_snapshot()
+            retry = getattr(settings, "FDS_RULE_LOAD_RETRY_SECONDS", 5)
+            try:
+                db_rules = read_rules_from_db()
+                if (
+                    _STATE["source"] == "snapshot"
+                    and _STATE["fingerprint"] == rule_analyzer.rules_fingerprint(db_rules)
+                    and _STATE["policy"] == rule_analyzer.cost_policy()
+                ):
+                    with _LOCK:
+                        _STATE["verified"] = True
+                    print("[rules_cache] Snapshot matches the rules table.")
+                else:
+                    _load_from_db(db_rules)
+            except Exception as e:
+                print(f"[rules_cache] rule load failed, retry in {retry}s: {e}")
+            if not (_STATE["loaded"] and _STATE["verified"]):
+                _STATE["retry_at"] = time.monotonic() + retry
+    finally:
+        _LOAD_LOCK.release()
+
+    if not _STATE["loaded"]:
+        raise RulesUnavailable("no rule set loaded")
+
+
+# --------------------------
+# Read access
+# --------------------------
 
 def get_rules(target: str) -> List[Tuple[str, str, str, bool]]:
     """
     Retrieve cached rules for a given target ("order" or "purchase").
+    Raises RulesUnavailable when no rule set is loaded.
     """
+    ensure_rules_loaded()
     with _LOCK:
         return list(_RULES.get(target, []))
 
 
+def get_rule_costs() -> Dict[str, float]:
+    """
+    Plan cost per rule_id from the active rule generation report
+    (empty when costs are unavailable, e.g. on SQLite).
+    """
+    ensure_rules_loaded()
+    with _LOCK:
+        return dict(_COSTS)
+
+
 def get_all_rules() -> Dict[str, List[Tuple[str, str, str, bool]]]:
     """
     Return all cached rules for both targets.
     """
+    ensure_rules_loaded()
     with _LOCK:
         return {
             "order": list(_RULES["order"]),
@@ -102,8 +346,10 @@ def clear_rules() -> None:
     Clear the in-memory rule cache.
     """
     with _LOCK:
-        _RULES["order"].clear()
-        _RULES["purchase"].clear()
+        _RULES["order"] = []
+        _RULES["purchase"] = []
+        _COSTS.clear()
+        _STATE.update(loaded=False, source=None, fingerprint=None, policy=None, verified=False, retry_at=0.0)
     print("[rules_cache] Cleared rule cache.")
 
 
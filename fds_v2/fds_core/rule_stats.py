@@ -0,0 +1,102 @@
+# fds_v2/fds_core/rule_stats.py
+"""
+Rule Effectiveness Rollups
+
+Per rule, case kind and hour (table fds_django_rulestathour):
+  - evaluations:       cases the rule was evaluated on
+  - hits:              cases it matched
+  - block_decisions:   hits in cases decided BLOCK
+  - review_decisions:  hits in cases decided REVIEW
+  - sole_hits:         hits that were the only hit at the final decision's
+                       severity (without the rule the decision is weaker)
+
+Counted when a final decision is logged (side_effects.log_decision ->
+fds_django.services.rule_stats), in the DetectionLog transaction.
+Provisional deadline-mode decisions are not counted; their final decision
+is. `manage.py rebuild_rule_stats` rebuilds the rollups from DetectionLog.
+
+Dashboards read the rollups only, never DetectionLog:
+
+    rule_summary(since, until)            totals per rule and kind
+    rule_timeseries("R001", since, until) one row per hour
+
+Times are epoch seconds; queries run on the bound read alias
+(fds_core.replica), so they can be served by a replica.
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .replica import read_connection
+
+HOUR = 3600
+
+COUNTS: Tuple[str, ...] = ("evaluations", "hits", "block_decisions", "review_decisions", "sole_hits")
+
+
+def hour_start(ts: float) -> int:
+    return int(ts) // HOUR * HOUR
+
+
+def _range(since: float, until: Optional[float], kind: Optional[str]) -> Tuple[str, List[Any]]:
+    until = time.time() if until is None else until
+    where = "hour_start >= %s AND hour_start < %s"
+    args: List[Any] = [hour_start(since), until]
+    if kind:
+        where += " AND case_kind = %s"
+        args.append(kind)
+    return where, args
+
+
+def _with_rates(row: Dict[str, Any]) -> Dict[str, Any]:
+    row["hit_rate"] = row["hits"] / row["evaluations"] if row["evaluations"] else None
+    return row
+
+
+def rule_summary(since: float, until: Optional[float] = None, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Totals per (rule_id, case_kind) for the hours in [since, until), most hits first.
+    """
+    where, args = _range(since, until, kind)
+    sums = ", ".join(f"SUM({c})" for c in COUNTS)
+    sql = f"""
+        SELECT rule_id, case_kind, {sums}
+        FROM fds_django_rulestathour
+        WHERE {where}
+        GROUP BY rule_id, case_kind
+        ORDER BY SUM(hits) DESC, rule_id
+    """
+    with read_connection().cursor() as cur:
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+    return [
+        _with_rates({"rule_id": r[0], "case_kind": r[1], **{c: int(v or 0) for c, v in zip(COUNTS, r[2:])}})
+        for r in rows
+    ]
+
+
+def rule_timeseries(
+    rule_id: str,
+    since: float,
+    until: Optional[float] = None,
+    kind: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Hourly counts of one rule (both kinds summed unless `kind` is given).
+    """
+    where, args = _range(since, until, kind)
+    sums = ", ".join(f"SUM({c})" for c in COUNTS)
+    sql = f"""
+        SELECT hour_start, {sums}
+        FROM fds_django_rulestathour
+        WHERE rule_id = %s AND {where}
+        GROUP BY hour_start
+        ORDER BY hour_start
+    """
+    with read_connection().cursor() as cur:
+        cur.execute(sql, [rule_id] + args)
+        rows = cur.fetchall()
+    return [
+        _with_rates({"hour_start": int(r[0]), **{c: int(v or 0) for c, v in zip(COUNTS, r[1:])}})
+        for r in rows
+    ]
@@ -1,12 +1,15 @@
-from typing import Dict, List, Tuple, Any
+import time
+from typing import Any, Collection, Dict, List, Optional, Tuple
 
-from django.db import connection
+from django.db import transaction
 
+from . import tracing
 from .enums import Decision
 from .hit import Hit
-
-# structure: target -> list of (rule_id, rule_sql, action, register_blocklist)
-RULES: Dict[str, List[Tuple[str, str, str, bool]]] = {"order": [], "purchase": []}
+from .entity_links import is_link_rule, run_link_rule
+from .replica import read_alias, read_connection
+from .rule_cache import get_rule_costs, get_rules
+from .velocity import is_velocity_rule, run_velocity_rule
 
 def resolve_p0(hits: List[Hit]) -> Decision:
     """
@@ -22,14 +25,34 @@ def resolve_p0(hits: List[Hit]) -> Decision:
     return Decision.ALLOW
 
 
-def _run_one_rule(rule_sql: str, params: Dict[str, Any], target: str) -> bool:
+def _run_one_rule(rule_sql: str, params: Dict[str, Any], target: str, timeout_ms: Optional[int] = None) -> bool:
     """
     Execute a single rule.
 
     The rule SQL should use %s placeholders instead of named ones.
     Example:
         SELECT 1 FROM orders WHERE id = %s
+
+    Velocity rules ("VELOCITY <window> > N") are served from the
+    bucketed counters in fds_core.velocity instead of SQL, link rules
+    ("LINK accounts card > N") from fds_core.entity_links.
+
+    Queries run on the bound read alias (fds_core.replica), the primary
+    unless a worker evaluates the case on a replica.
+
+    `timeout_ms` caps the rule's statements on PostgreSQL (statement_timeout),
+    so one slow rule cannot overrun a detection deadline.
     """
+    connection = read_connection()
+    if timeout_ms is not None and connection.vendor == "postgresql":
+        with transaction.atomic(using=read_alias()):
+            with connection.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = %s", [max(1, int(timeout_ms))])
+            matched = _run_one_rule(rule_sql, params, target)
+            # SET LOCAL outlives a released savepoint: restore it for the caller
+            with connection.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout TO DEFAULT")
+            return matched
 
     # Safety guard: ensure target consistency
     if target == "order" and "order_id" not in params:
@@ -43,41 +66,118 @@ def _run_one_rule(rule_sql: str, params: Dict[str, Any], target: str) -> bool:
     else:
         args = [params["purchase_id"]]
 
+    if connection.in_atomic_block:
+        # e.g. the worker's detection transaction: a failing rule of any
+        # kind must not abort it (PostgreSQL), so the rule runs in a savepoint
+        with transaction.atomic(using=read_alias()):
+            return _match(connection, rule_sql, args[0], target)
+    return _match(connection, rule_sql, args[0], target)
+
+
+def _match(connection, rule_sql: str, case_id: str, target: str) -> bool:
+    """Run one rule of any kind (velocity, link, SQL) for a case id."""
+    if is_velocity_rule(rule_sql):
+        return run_velocity_rule(rule_sql, case_id, target)
+    if is_link_rule(rule_sql):
+        return run_link_rule(rule_sql, case_id, target)
+
     with connection.cursor() as cur:
-        cur.execute(rule_sql, args)
+        cur.execute(rule_sql, [case_id])
         row = cur.fetchone()
-
     return bool(row)
 
 
 def _evaluate_target_rules(target: str, params: Dict[str, Any]) -> List[Hit]:
     """
-    Evaluate all rules for the given target.
+    Evaluate all rules for the given target (rules from rule_cache).
     """
     hits: List[Hit] = []
-    for rule_id, rule_sql, action, register_bl in RULES.get(target, []):
+    for rule_id, rule_sql, action, register_bl in get_rules(target):
         try:
-            if _run_one_rule(rule_sql, params, target):
+            with tracing.span("rule", rule_id=str(rule_id)):
+                matched = _run_one_rule(rule_sql, params, target)
+            if matched:
                 hits.append(
-                    Hit(rule_id=str(rule_id), decision=action, register_blocklist=register_bl)
+                    Hit(rule_id=str(rule_id), decision=Decision(action.lower()), register_blocklist=register_bl)
                 )
         except Exception:
             continue
     return hits
 
 
+_SEV = {Decision.BLOCK: 0, Decision.REVIEW: 1,}
+
+
+def prioritized_rules(target: str) -> List[Tuple[str, str, str, bool]]:
+    """
+    Rules in evaluation order for deadline-bound detection: BLOCK rules
+    first, then cheapest first by plan cost (rule_cache.get_rule_costs).
+    """
+    costs = get_rule_costs()
+    return sorted(
+        get_rules(target),
+        key=lambda r: (0 if r[2] == "BLOCK" else 1, costs.get(r[0], 0.0), r[0]),
+    )
+
+
+def evaluate_rules_until(
+    target: str,
+    params: Dict[str, Any],
+    deadline: Optional[float] = None,
+    exclude: Collection[str] = (),
+) -> Tuple[List[Hit], List[str], List[str]]:
+    """
+    Evaluate rules in prioritized order until `deadline` (time.monotonic()).
+
+    Returns (hits, evaluated rule_ids, pending rule_ids). Rules in `exclude`
+    are skipped (already evaluated). A rule cut off by the deadline is
+    reported as pending; other rule errors count as evaluated without a
+    hit, as in _evaluate_target_rules.
+    """
+    hits: List[Hit] = []
+    evaluated: List[str] = []
+    pending: List[str] = []
+    for rule_id, rule_sql, action, register_bl in prioritized_rules(target):
+        rule_id = str(rule_id)
+        if rule_id in exclude:
+            continue
+        timeout_ms = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                pending.append(rule_id)
+                continue
+            timeout_ms = int(remaining * 1000)
+        try:
+            with tracing.span("rule", rule_id=rule_id):
+                matched = _run_one_rule(rule_sql, params, target, timeout_ms=timeout_ms)
+            if matched:
+                hits.append(
+                    Hit(rule_id=rule_id, decision=Decision(action.lower()), register_blocklist=register_bl)
+                )
+        except Exception:
+            if deadline is not None and time.monotonic() >= deadline:
+                pending.append(rule_id)  # cancelled by statement_timeout
+                continue
+        evaluated.append(rule_id)
+    return hits, evaluated, pending
+
+
+def finalize_hits(hits: List[Hit]) -> Tuple[Decision, List[Hit]]:
+    """
+    Sort hits by severity and resolve the final decision.
+    """
+    hits_sorted = sorted(hits, key=lambda h: (_SEV.get(h.decision, 9), h.rule_id))
+    return resolve_p0(hits_sorted), hits_sorted
+
+
 def detect_order_core(order_id: Any) -> Tuple[Decision, List[Hit]]:
     """
     Core detection for an order_id using in-memory rules.
     """
     params = {"order_id": order_id}
     hits = _evaluate_target_rules("order", params)
-
-    _SEV = {Decision.BLOCK: 0, Decision.REVIEW: 1,}
-    hits_sorted = sorted(hits, key=lambda h: (_SEV.get(h.decision, 9), h.rule_id))
-    final = resolve_p0(hits_sorted)
-
-    return final, hits_sorted
+    return finalize_hits(hits)
 
 
 def detect_purchase_core(purchase_id: Any) -> Tuple[Decision, List[Hit]]:
@@ -86,9 +186,4 @@ def detect_purchase_core(purchase_id: Any) -> Tuple[Decision, List[Hit]]:
     """
     params = {"purchase_id": purchase_id}
     hits = _evaluate_target_rules("purchase", params)
-
-    sev = {"BLOCK": 0, "REVIEW": 1}
-    hits_sorted = sorted(hits, key=lambda h: (sev.get(h.decision, 9), h.rule_id))
-    final = resolve_p0(hits_sorted)
-
-    return final, hits_sorted
\ No newline at end of file
+    return finalize_hits(hits)
\ No newline at end of file
@@ -0,0 +1,333 @@
+# fds_v2/fds_core/schemas.py
+"""
+Fast-path Request Schemas
+
+Pydantic v2 counterparts of the DRF serializers in fds_django/serializers.py.
+The DRF serializers remain the reference implementation; the models here
+apply the same field rules and report errors in the same shape, so the
+ingestion views can validate without DRF's per-field overhead.
+
+Field rules mirrored from DRF:
+  - CharField: numbers coerced to str, whitespace trimmed, blank rejected,
+    max_length / null-character / surrogate checks
+  - DecimalField: max_digits / decimal_places checks, quantized result
+  - IntegerField: "1.0" style input accepted, min_value check
+  - JSONField: value must be JSON-serializable, default {}
+  - Nested list serializer: list required, per-item errors keyed by index
+
+Order items are validated in a single pass by _items() rather than as a nested
+model per item; item count dominates validation cost for large orders.
+"""
+
+import decimal
+import json
+import re
+from collections.abc import Mapping
+from decimal import Decimal
+from typing import Annotated, Any, Callable, ClassVar, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, PlainValidator, ValidationError, model_validator
+from pydantic_core import PydanticCustomError
+
+NON_FIELD_ERRORS = "non_field_errors"
+
+_REQUIRED = "This field is required."
+_NULL = "This field may not be null."
+_BLANK = "This field may not be blank."
+_INVALID_STRING = "Not a valid string."
+_INVALID_NUMBER = "A valid number is required."
+_INVALID_INTEGER = "A valid integer is required."
+_INVALID_JSON = "Value must be valid JSON."
+_STRING_TOO_LARGE = "String value too large."
+_NULL_CHARACTERS = "Null characters are not allowed."
+_NO_DATA = "No data provided"
+_MAX_STRING_LENGTH = 1000  # same guard as DRF numeric fields
+
+
+def _fail(detail: Any) -> PydanticCustomError:
+    """Wrap a DRF-shaped error detail (list or dict) into a pydantic error."""
+    return PydanticCustomError("drf", "{detail}", {"detail": detail})
+
+
+def _char(max_length: int, allow_null: bool = False) -> Callable[[Any], Optional[str]]:
+    """serializers.CharField(max_length=..., allow_null=...)"""
+    def validate(value: Any) -> Optional[str]:
+        if value is None:
+            if allow_null:
+                return None
+            raise _fail([_NULL])
+        if type(value) is str:
+            value = value.strip()
+            if not value:
+                raise _fail([_BLANK])
+        else:
+            if value == "" or str(value).strip() == "":
+                raise _fail([_BLANK])
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise _fail([_INVALID_STRING])
+            value = str(value).strip()
+
+        errors: List[str] = []
+        if len(value) > max_length:
+            errors.append(f"Ensure this field has no more than {max_length} characters.")
+        if "\x00" in value:
+            errors.append(_NULL_CHARACTERS)
+        if not value.isascii():
+            for ch in value:
+                if 0xD800 <= ord(ch) <= 0xDFFF:
+                    errors.append(f"Surrogate characters are not allowed: U+{ord(ch):X}.")
+                    break
+        if errors:
+            raise _fail(errors)
+        return value
+
+    return validate
+
+
+def _decimal(max_digits: int, decimal_places: int) -> Callable[[Any], Decimal]:
+    """serializers.DecimalField(max_digits=..., decimal_places=...)"""
+    max_whole_digits = max_digits - decimal_places
+    quantum = Decimal(".1") ** decimal_places
+    context = decimal.getcontext().copy()
+    context.prec = max_digits
+    # plain "123.45" style input that cannot exceed either limit
+    plain = re.compile(rf"-?[0-9]{{1,{max_whole_digits}}}(?:\.[0-9]{{0,{decimal_places}}})?")
+
+    def validate(value: Any) -> Decimal:
+        if value is None:
+            raise _fail([_NULL])
+
+        data = (value.decode() if isinstance(value, bytes) else str(value)).strip()
+        if plain.fullmatch(data):
+            # within max_digits by construction, so no rounding context needed
+            return Decimal(data).quantize(quantum)
+
+        if len(data) > _MAX_STRING_LENGTH:
+            raise _fail([_STRING_TOO_LARGE])
+        try:
+            number = Decimal(data)
+        except decimal.DecimalException:
+            raise _fail([_INVALID_NUMBER])
+        if not number.is_finite():
+            raise _fail([_INVALID_NUMBER])
+
+        _, digits, exponent = number.as_tuple()
+        if exponent >= 0:
+            total = whole = len(digits) + exponent
+            places = 0
+        elif len(digits) > -exponent:
+            total, whole, places = len(digits), len(digits) + exponent, -exponent
+        else:
+            total, whole, places = -exponent, 0, -exponent
+
+        if total > max_digits:
+            raise _fail([f"Ensure that there are no more than {max_digits} digits in total."])
+        if places > decimal_places:
+            raise _fail([f"Ensure that there are no more than {decimal_places} decimal places."])
+        if whole > max_whole_digits:
+            raise _fail([f"Ensure that there are no more than {max_whole_digits} digits before the decimal point."])
+
+        return number.quantize(quantum, context=context)
+
+    return validate
+
+
+def _integer(min_value: int) -> Callable[[Any], int]:
+    """serializers.IntegerField(min_value=...)"""
+    def validate(value: Any) -> int:
+        if value is None:
+            raise _fail([_NULL])
+        if isinstance(value, str) and len(value) > _MAX_STRING_LENGTH:
+            raise _fail([_STRING_TOO_LARGE])
+        if type(value) is int:
+            number = value
+        else:
+            text = str(value)
+            # allow e.g. "1.0" as an int, but not "1.2" (DRF re_decimal)
+            head, dot, zeros = text.rstrip().rpartition(".")
+            if dot and not zeros.strip("0"):
+                text = head
+            try:
+                number = int(text)
+            except (ValueError, TypeError):
+                raise _fail([_INVALID_INTEGER])
+        if number < min_value:
+            raise _fail([f"Ensure this value is greater than or equal to {min_value}."])
+        return number
+
+    return validate
+
+
+def _json(value: Any) -> Any:
+    """serializers.JSONField()"""
+    if value is None:
+        raise _fail([_NULL])
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        raise _fail([_INVALID_JSON])
+    return value
+
+
+def _not_a_mapping(value: Any) -> Dict[str, List[str]]:
+    return {NON_FIELD_ERRORS: [f"Invalid data. Expected a dictionary, but got {type(value).__name__}."]}
+
+
+# Structure: (field_name, validator) in DetectOrderItemSerializer order
+_ITEM_FIELDS: Tuple[Tuple[str, Callable[[Any], Any]], ...] = (
+    ("product_id", _char(64)),
+    ("unit_price", _decimal(max_digits=12, decimal_places=2)),
+    ("quantity", _integer(min_value=1)),
+)
+
+
+def _items(value: Any) -> List[Dict[str, Any]]:
+    """
+    DetectOrderItemSerializer(many=True)
+
+    Errors are raised as {index: detail} for failing items only;
+    drf_errors() expands them into DRF's list format when required.
+    """
+    if value is None:
+        raise _fail([_NULL])
+    if not isinstance(value, list):
+        raise _fail({NON_FIELD_ERRORS: [f'Expected a list of items but got type "{type(value).__name__}".']})
+
+    items: List[Dict[str, Any]] = []
+    errors: Dict[int, Any] = {}
+    for index, item in enumerate(value):
+        if item is None:
+            errors[index] = [_NULL]
+            continue
+        if not isinstance(item, Mapping):
+            errors[index] = _not_a_mapping(item)
+            continue
+
+        validated: Dict[str, Any] = {}
+        item_errors: Dict[str, Any] = {}
+        for name, validate in _ITEM_FIELDS:
+            if name not in item:
+                item_errors[name] = [_REQUIRED]
+                continue
+            try:
+                validated[name] = validate(item[name])
+            except PydanticCustomError as e:
+                item_errors[name] = e.context["detail"]
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            items.append(validated)
+
+    if errors:
+        raise _fail(errors)
+    return items
+
+
+class _DetectSchema(BaseModel):
+    """
+    Base for the fast-path schemas.
+
+    Fields listed in _OMIT_UNSET behave like DRF fields with required=False and
+    no default: they are left out of validated data when absent from the input.
+    """
+    _OMIT_UNSET: ClassVar[Tuple[str, ...]] = ()
+
+    @model_validator(mode="before")
+    @classmethod
+    def _require_mapping(cls, data: Any) -> Any:
+        if data is None:
+            raise _fail([_NULL])
+        if not isinstance(data, Mapping):
+            raise _fail(_not_a_mapping(data))
+        return data
+
+    def validated_data(self) -> Dict[str, Any]:
+        """
+        Return the equivalent of serializer.validated_data.
+        """
+        data = self.__dict__.copy()
+        for name in self._OMIT_UNSET:
+            if name not in self.model_fields_set:
+                del data[name]
+        return data
+
+
+Char64 = Annotated[str, PlainValidator(_char(64))]
+Price = Annotated[Decimal, PlainValidator(_decimal(max_digits=12, decimal_places=2))]
+JsonObject = Annotated[Any, PlainValidator(_json)]
+
+
+# -------------------------
+#  Order Detect Schema
+# -------------------------
+
+class DetectOrderSchema(_DetectSchema):
+    order_id: Char64
+    account_id: Char64
+    device_id: Char64
+    order_country: Annotated[str, PlainValidator(_char(16))]
+    total_price: Price
+    currency: Annotated[str, PlainValidator(_char(8))]
+    order_status: Annotated[str, PlainValidator(_char(32))]
+
+    items: Annotated[List[Dict[str, Any]], PlainValidator(_items)]
+
+    metadata: JsonObject = Field(default_factory=dict)
+
+
+# -------------------------
+#  Purchase Detect Schema
+# -------------------------
+
+class DetectPurchaseSchema(_DetectSchema):
+    _OMIT_UNSET: ClassVar[Tuple[str, ...]] = ("card_brand", "bin", "card_id", "failure_reason")
+
+    purchase_id: Char64
+    order_id: Char64
+
+    method_type: Annotated[str, PlainValidator(_char(32))]
+    card_brand: Annotated[Optional[str], PlainValidator(_char(32, allow_null=True))] = None
+    bin: Annotated[Optional[str], PlainValidator(_char(16, allow_null=True))] = None
+    card_id: Annotated[Optional[str], PlainValidator(_char(64, allow_null=True))] = None
+
+    payment_country: Annotated[str, PlainValidator(_char(16))]
+    payment_status: Annotated[str, PlainValidator(_char(32))]
+    failure_reason: Annotated[Optional[str], PlainValidator(_char(255, allow_null=True))] = None
+
+    price: Price
+    currency: Annotated[str, PlainValidator(_char(8))]
+    metadata: JsonObject = Field(default_factory=dict)
+
+
+# -------------------------
+#  Error shape
+# -------------------------
+
+def drf_errors(exc: ValidationError, data: Any, list_errors_as_dict: bool = False) -> Dict[str, Any]:
+    """
+    Convert a schema ValidationError into the `serializer.errors` shape.
+
+    `list_errors_as_dict` mirrors DRF's LIST_SERIALIZER_ERRORS_AS_DICT setting;
+    when False, item errors become a list with {} for valid items.
+    """
+    if data is None:
+        return {NON_FIELD_ERRORS: [_NO_DATA]}
+
+    errors: Dict[str, Any] = {}
+    for err in exc.errors(include_url=False):
+        if err["type"] == "drf":
+            detail = err["ctx"]["detail"]
+        elif err["type"] == "missing":
+            detail = [_REQUIRED]
+        else:
+            detail = [err["msg"]]
+
+        if not err["loc"]:
+            # model-level error: payload is not a dictionary
+            return detail
+
+        field = err["loc"][0]
+        if isinstance(detail, dict) and not list_errors_as_dict and all(isinstance(k, int) for k in detail):
+            detail = [detail.get(i, {}) for i in range(len(data[field]))]
+        errors[field] = detail
+    return errors
@@ -1,5 +1,4 @@
-from dataclasses import asdict
-from typing import Any, List, Dict
+from typing import Any, Dict, List, Optional
 
 from django.db import transaction
 
@@ -7,6 +6,8 @@ from .hit import Hit
 from .models import RegisterParams
 from .rules_engine import Decision
 from fds_django.models import UserBlock, DeviceBlock, CardBlock, DetectionLog
+from fds_django.services import rule_stats
+from fds_django.services.entity_links import mark_blocked
 
 
 def register_blocklist(db: Any, rp: RegisterParams) -> None:
@@ -15,6 +16,7 @@ def register_blocklist(db: Any, rp: RegisterParams) -> None:
 
     - Executes all operations within a single transaction
     - Ensures idempotency using get_or_create
+    - Counts new entries in the entity link index (cluster blocked counts)
     - The `db` argument is currently unused but kept for signature compatibility
     """
     if rp.is_empty():
@@ -22,16 +24,33 @@ def register_blocklist(db: Any, rp: RegisterParams) -> None:
 
     with transaction.atomic():
         if rp.user:
-            UserBlock.objects.get_or_create(user_id=rp.user)
+            _, created = UserBlock.objects.get_or_create(user_id=rp.user)
+            if created:
+                mark_blocked(("account", rp.user))
         if rp.device:
-            DeviceBlock.objects.get_or_create(device_id=rp.device)
+            _, created = DeviceBlock.objects.get_or_create(device_id=rp.device)
+            if created:
+                mark_blocked(("device", rp.device))
         if rp.card:
-            CardBlock.objects.get_or_create(card_id=rp.card)
+            _, created = CardBlock.objects.get_or_create(card_id=rp.card)
+            if created:
+                mark_blocked(("card", rp.card))
 
 
-def log_decision(kind: str, ref_id: Any, final: Decision, hits: List[Hit]) -> None:
+def log_decision(
+    kind: str,
+    ref_id: Any,
+    final: Decision,
+    hits: List[Hit],
+    evaluated: Optional[List[str]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+    using: str = "default",
+) -> DetectionLog:
     """
     Persist detection result into DetectionLog.
+
+    Final decisions (extra["stage"] absent or "final") are also counted in
+    the per-rule hourly rollups (fds_core.rule_stats), in the same transaction.
     """
     ref_str = str(ref_id)
 
@@ -40,16 +59,23 @@ def log_decision(kind: str, ref_id: Any, final: Decision, hits: List[Hit]) -> No
         if h.reason:
             reasons.append(h.reason)
         else:
-            reasons.append(f"rule={h.rule_id}, decision={h.decision}")
+            reasons.append(f"rule={h.rule_id}, decision={h.decision.value}")
 
-    extra: Dict[str, Any] = {
-        "hits": [asdict(h) for h in hits],
+    # Hit dataclasses are encoded by the field's codec (fds_core.codec)
+    extra = {
+        "hits": hits,
+        "evaluated_rules": list(evaluated or []),
+        **(extra or {}),
     }
 
-    DetectionLog.objects.create(
-        case_kind=kind,
-        case_id=ref_str,
-        decision=str(final),
-        reasons=reasons,
-        extra=extra,
-    )
\ No newline at end of file
+    with transaction.atomic(using=using):
+        log = DetectionLog.objects.using(using).create(
+            case_kind=kind,
+            case_id=ref_str,
+            decision=final.value,
+            reasons=reasons,
+            extra=extra,
+        )
+        if extra.get("stage", "final") == "final":
+            rule_stats.record_detection(kind, final, hits, extra["evaluated_rules"], using=using)
+    return log
@@ -0,0 +1,333 @@
+# fds_v2/fds_core/tracing.py
+"""
+Pipeline Tracing
+
+Follows one event from ingestion to its final decision. A trace context is
+created by upsert_*_and_emit, stored with the event (Outbox.trace), copied
+into the task message by the dispatcher and closed by the worker.
+
+Stages (one span each, in pipeline order):
+  - ingest:           upsert transaction, until commit
+  - outbox_ready:     READY in the outbox (Outbox.created_at -> claimed
+                      by the dispatcher)
+  - dispatch:         claimed -> task message handed to the broker
+  - queue:            publish and broker queue, until the worker starts the
+                      event (in claim-check mode this includes the events
+                      ahead of it in the same chunk)
+  - processed_check:  Processed idempotency guard
+  - rules:            rule evaluation, with one "rule" span per rule
+  - blocklist:        blocklist writes (detector and worker)
+  - decision_log:     DetectionLog + rule rollups
+  - processed_mark:   Processed insert
+plus "end_to_end" (ingest start -> processed) to show unaccounted time.
+
+Spans are dicts: trace_id, aggregate_id, event_type, name, start (epoch
+seconds), ms, and attributes (rule_id, error, ...). Stages run in different
+processes, so times are wall clock: hosts must share a synchronized clock.
+
+Sampling is decided once, at ingestion: unsampled events carry no context
+(Outbox.trace is NULL) and every span call is a no-op.
+
+Settings:
+  - FDS_TRACE_SAMPLE_RATE: fraction of events traced (default 0.0, off)
+  - FDS_TRACE_EXPORTER: "memory" (default; bounded, per process) or "file"
+  - FDS_TRACE_FILE: JSON lines file of the file exporter, shared by web and
+    workers (default "fds_traces.jsonl")
+  - FDS_TRACE_MEMORY_SPANS: spans kept by the memory exporter (default 10000)
+
+Query: spans_for(aggregate_id), stage_timings(aggregate_id), breakdown(spans);
+`manage.py trace_report` prints both from the exporter.
+"""
+
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+from .codec import JSON_CODEC
+
+STAGES = (
+    "ingest",
+    "outbox_ready",
+    "dispatch",
+    "queue",
+    "processed_check",
+    "rules",
+    "blocklist",
+    "decision_log",
+    "processed_mark",
+)
+
+_CURRENT: ContextVar[Optional[Dict[str, Any]]] = ContextVar("fds_trace", default=None)
+_NOOP = nullcontext()
+
+
+# --------------------------
+# Exporters
+# --------------------------
+
+class MemoryExporter:
+    """Last N spans of this process (benchmarks, shells)."""
+
+    def __init__(self, size: int) -> None:
+        self._spans: Deque[Dict[str, Any]] = deque(maxlen=size)
+
+    def export(self, span: Dict[str, Any]) -> None:
+        self._spans.append(span)  # deque.append is thread-safe
+
+    def spans(self) -> List[Dict[str, Any]]:
+        return list(self._spans)
+
+    def clear(self) -> None:
+        self._spans.clear()
+
+
+class FileExporter:
+    """
+    One JSON line per span, appended (O_APPEND) so web and worker
+    processes can share the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        line = JSON_CODEC.dumps(span) + b"\n"
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def spans(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        out: List[Dict[str, Any]] = []
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    out.append(JSON_CODEC.loads(line))
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+_EXPORTER = None
+_EXPORTER_LOCK = Lock()
+
+
+def exporter():
+    global _EXPORTER
+    if _EXPORTER is None:
+        with _EXPORTER_LOCK:
+            if _EXPORTER is None:
+                if getattr(settings, "FDS_TRACE_EXPORTER", "memory") == "file":
+                    _EXPORTER = FileExporter(getattr(settings, "FDS_TRACE_FILE", "fds_traces.jsonl"))
+                else:
+                    _EXPORTER = MemoryExporter(getattr(settings, "FDS_TRACE_MEMORY_SPANS", 10000))
+    return _EXPORTER
+
+
+# --------------------------
+# Context and spans
+# --------------------------
+
+def new_context(event_type: str, aggregate_id: Any) -> Optional[Dict[str, Any]]:
+    """
+    Trace context for a new event, or None when the event is not sampled.
+    """
+    rate = getattr(settings, "FDS_TRACE_SAMPLE_RATE", 0.0)
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    return {
+        "trace_id": uuid.uuid4().hex,
+        "event_type": event_type,
+        "aggregate_id": str(aggregate_id),
+        "started": time.time(),
+    }
+
+
+def record(ctx: Optional[Dict[str, Any]], name: str, start: float, end: float, **attrs: Any) -> None:
+    """
+    Export one span of `ctx` (no-op without a context). Times are epoch seconds.
+    """
+    if ctx is None:
+        return
+    span = {
+        "trace_id": ctx["trace_id"],
+        "aggregate_id": ctx["aggregate_id"],
+        "event_type": ctx["event_type"],
+        "name": name,
+        "start": start,
+        "ms": max(0.0, (end - start) * 1000.0),
+        **attrs,
+    }
+    try:
+        exporter().export(span)
+    except Exception as e:
+        print(f"[tracing] export failed: {e}")
+
+
+@contextmanager
+def active(ctx: Optional[Dict[str, Any]]) -> Iterator[Optional[Dict[str, Any]]]:
+    """Bind `ctx` as the current trace for span()."""
+    token = _CURRENT.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _CURRENT.reset(token)
+
+
+def current() -> Optional[Dict[str, Any]]:
+    return _CURRENT.get()
+
+
+class _Span:
+    __slots__ = ("ctx", "name", "attrs", "start")
+
+    def __init__(self, ctx: Dict[str, Any], name: str, attrs: Dict[str, Any]) -> None:
+        self.ctx = ctx
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "_Span":
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record(self.ctx, self.name, self.start, time.time(), **self.attrs)
+        return False
+
+
+def span(name: str, **attrs: Any):
+    """
+    Time a block as a span of the current trace; a shared no-op context
+    when no trace is active (unsampled events pay one ContextVar lookup).
+    """
+    ctx = _CURRENT.get()
+    if ctx is None:
+        return _NOOP
+    return _Span(ctx, name, attrs)
+
+
+# --------------------------
+# Queries
+# --------------------------
+
+def spans_for(aggregate_id: Any, spans: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Spans of every trace of one aggregate (an event may be ingested more
+    than once), in start order.
+    """
+    aggregate_id = str(aggregate_id)
+    if spans is None:
+        spans = exporter().spans()
+    return sorted((s for s in spans if s["aggregate_id"] == aggregate_id), key=lambda s: s["start"])
+
+
+def stage_timings(aggregate_id: Any, spans: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Per trace of one aggregate: ms per stage (repeated stages summed),
+    per-rule ms, and end-to-end ms.
+    """
+    # Structure: trace_id -> {"trace_id", "event_type", "stages", "rules", "end_to_end_ms"}
+    traces: Dict[str, Dict[str, Any]] = {}
+    for s in spans_for(aggregate_id, spans):
+        t = traces.setdefault(s["trace_id"], {
+            "trace_id": s["trace_id"],
+            "event_type": s["event_type"],
+            "started": s["start"],
+            "stages": {},
+            "rules": {},
+            "end_to_end_ms": None,
+        })
+        if s["name"] == "end_to_end":
+            t["end_to_end_ms"] = s["ms"]
+        elif s["name"] == "rule":
+            t["rules"][s["rule_id"]] = t["rules"].get(s["rule_id"], 0.0) + s["ms"]
+        else:
+            t["stages"][s["name"]] = t["stages"].get(s["name"], 0.0) + s["ms"]
+    return sorted(traces.values(), key=lambda t: t["started"])
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def breakdown(spans: Optional[List[Dict[str, Any]]] = None, top_rules: int = 10) -> Dict[str, Any]:
+    """
+    Where the time goes, over all traces: per stage p50 / p95 / mean ms and
+    share of the summed stage time, the slowest rules by total ms, and the
+    end-to-end time not covered by any stage (e.g. worker prefetch, Celery
+    overhead, clock skew).
+    """
+    if spans is None:
+        spans = exporter().spans()
+
+    # Structure: trace_id -> stage -> ms (repeated stages summed per trace)
+    per_trace: Dict[str, Dict[str, float]] = {}
+    rules: Dict[str, List[float]] = {}
+    end_to_end: Dict[str, float] = {}
+    for s in spans:
+        if s["name"] == "end_to_end":
+            end_to_end[s["trace_id"]] = s["ms"]
+        elif s["name"] == "rule":
+            rules.setdefault(s["rule_id"], []).append(s["ms"])
+        else:
+            stages = per_trace.setdefault(s["trace_id"], {})
+            stages[s["name"]] = stages.get(s["name"], 0.0) + s["ms"]
+
+    totals = {name: [t[name] for t in per_trace.values() if name in t] for name in STAGES}
+    grand = sum(sum(v) for v in totals.values()) or 1.0
+
+    stages_out = {}
+    for name in STAGES:
+        values = totals[name]
+        if not values:
+            continue
+        stages_out[name] = {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "share": sum(values) / grand,
+        }
+
+    unaccounted = [
+        ms - sum(per_trace.get(trace_id, {}).values())
+        for trace_id, ms in end_to_end.items()
+    ]
+    slowest = sorted(rules.items(), key=lambda kv: -sum(kv[1]))[:top_rules]
+    return {
+        "traces": len(per_trace),
+        "stages": stages_out,
+        "rules": [
+            {"rule_id": rule_id, "count": len(v), "total_ms": sum(v), "p95_ms": _percentile(v, 95)}
+            for rule_id, v in slowest
+        ],
+        "end_to_end_ms": {
+            "p50": _percentile(list(end_to_end.values()), 50),
+            "p95": _percentile(list(end_to_end.values()), 95),
+        },
+        "unaccounted_ms": {
+            "p50": _percentile(unaccounted, 50),
+            "p95": _percentile(unaccounted, 95),
+        },
+    }
@@ -0,0 +1,203 @@
+# fds_v2/fds_core/velocity.py
+"""
+Velocity Windows
+
+Sliding-window event counts per entity (account / device / card / BIN),
+served from pre-aggregated time buckets instead of COUNT(*) range scans over
+Order / Purchase. A lookup sums at most seconds / bucket_seconds bucket rows,
+so its cost does not grow with history.
+
+Buckets (table fds_django_velocitybucket):
+  (metric, entity_type, entity_id, bucket_seconds, bucket_start) -> count
+  - bucket_start is epoch seconds aligned to bucket_seconds
+  - windows sharing a bucket size share bucket rows
+  - incremented at ingestion (fds_django.services.velocity), rebuildable
+    from Order / Purchase with `manage.py rebuild_velocity`
+
+Metrics and their entities:
+  - "order":          new orders         (account, device)
+  - "purchase":       new purchases      (card, bin)
+  - "purchase_fail":  purchases entering a failed payment_status (card, bin)
+
+Rules reference a window by name instead of SQL:
+
+    VELOCITY device_orders_10m > 5
+    VELOCITY card_fails_1h >= 3
+
+A window covers the current bucket and the preceding ones up to `seconds`,
+i.e. its resolution is bucket_seconds. Counts include the event under
+detection (counted at ingestion, before dispatch).
+
+Settings:
+  - FDS_VELOCITY_WINDOWS: extra windows as (name, metric, entity, seconds,
+    bucket_seconds) tuples. Run rebuild_velocity after adding one with a new
+    bucket size or a longer span than the existing windows.
+"""
+
+import operator
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .replica import read_connection
+
+
+class Window(NamedTuple):
+    name: str
+    metric: str          # order | purchase | purchase_fail
+    entity: str          # account | device | card | bin
+    seconds: int         # window length
+    bucket_seconds: int  # resolution
+
+
+# Structure: metric -> entities counted for it
+METRIC_ENTITIES: Dict[str, Tuple[str, ...]] = {
+    "order": ("account", "device"),
+    "purchase": ("card", "bin"),
+    "purchase_fail": ("card", "bin"),
+}
+
+DEFAULT_WINDOWS: Tuple[Window, ...] = (
+    Window("device_orders_10m", "order", "device", 600, 60),
+    Window("account_orders_1h", "order", "account", 3600, 300),
+    Window("account_orders_24h", "order", "account", 86400, 3600),
+    Window("card_purchases_1h", "purchase", "card", 3600, 300),
+    Window("card_fails_1h", "purchase_fail", "card", 3600, 300),
+    Window("bin_fails_1h", "purchase_fail", "bin", 3600, 300),
+)
+
+# payment_status values counted by "purchase_fail"
+FAILED_PAYMENT_STATUSES: Tuple[str, ...] = ("FAIL", "FAILED")
+
+# Structure: (case target, entity) -> SQL joining the case row to the entity value
+ENTITY_SOURCES: Dict[Tuple[str, str], str] = {
+    ("order", "account"): "SELECT account_id FROM fds_django_order WHERE order_id = %s",
+    ("order", "device"): "SELECT device_id FROM fds_django_order WHERE order_id = %s",
+    ("purchase", "card"): "SELECT card_id FROM fds_django_purchase WHERE purchase_id = %s",
+    ("purchase", "bin"): "SELECT bin FROM fds_django_purchase WHERE purchase_id = %s",
+    ("purchase", "account"): (
+        "SELECT o.account_id FROM fds_django_purchase p "
+        "JOIN fds_django_order o ON o.order_id = p.order_id WHERE p.purchase_id = %s"
+    ),
+    ("purchase", "device"): (
+        "SELECT o.device_id FROM fds_django_purchase p "
+        "JOIN fds_django_order o ON o.order_id = p.order_id WHERE p.purchase_id = %s"
+    ),
+}
+
+OPS: Dict[str, Callable[[int, int], bool]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+}
+
+_RULE_RE = re.compile(r"\s*VELOCITY\s+(\w+)\s*(>=|<=|>|<|=)\s*(\d+)\s*;?\s*", re.IGNORECASE)
+
+
+def _validate(window: Window) -> Window:
+    if window.metric not in METRIC_ENTITIES:
+        raise ValueError(f"Unsupported velocity metric: {window.metric}")
+    if window.entity not in METRIC_ENTITIES[window.metric]:
+        raise ValueError(f"Metric {window.metric} is not counted per {window.entity}")
+    if window.bucket_seconds <= 0 or window.seconds < window.bucket_seconds:
+        raise ValueError(f"Invalid velocity window span: {window.name}")
+    return window
+
+
+@lru_cache(maxsize=1)
+def get_windows() -> Dict[str, Window]:
+    """
+    Return all windows by name: DEFAULT_WINDOWS plus settings.FDS_VELOCITY_WINDOWS.
+    """
+    windows = list(DEFAULT_WINDOWS)
+    try:
+        from django.conf import settings
+        windows += [Window(*w) for w in getattr(settings, "FDS_VELOCITY_WINDOWS", ())]
+    except Exception:
+        pass
+    return {w.name: _validate(w) for w in windows}
+
+
+def bucket_sizes(metric: str, entity: str) -> List[int]:
+    """
+    Bucket sizes maintained for (metric, entity): one per distinct window resolution.
+    """
+    return sorted({
+        w.bucket_seconds for w in get_windows().values()
+        if w.metric == metric and w.entity == entity
+    })
+
+
+def bucket_start(ts: float, bucket_seconds: int) -> int:
+    return int(ts) // bucket_seconds * bucket_seconds
+
+
+def window_start(window: Window, now: Optional[float] = None) -> int:
+    """
+    Oldest bucket_start included in the window at `now`.
+    """
+    now = time.time() if now is None else now
+    return bucket_start(now, window.bucket_seconds) - window.seconds + window.bucket_seconds
+
+
+def velocity_count(window: Window, entity_id: Optional[str], now: Optional[float] = None) -> int:
+    """
+    Events of `window.metric` for one entity within the window.
+    """
+    if not entity_id:
+        return 0
+    sql = """
+        SELECT COALESCE(SUM(count), 0)
+        FROM fds_django_velocitybucket
+        WHERE metric = %s AND entity_type = %s AND entity_id = %s
+          AND bucket_seconds = %s AND bucket_start >= %s
+    """
+    args = [window.metric, window.entity, entity_id, window.bucket_seconds, window_start(window, now)]
+    with read_connection().cursor() as cur:
+        cur.execute(sql, args)
+        row = cur.fetchone()
+    return int(row[0] or 0)
+
+
+# --------------------------
+# Velocity rules
+# --------------------------
+
+def is_velocity_rule(rule_sql: str) -> bool:
+    return rule_sql.lstrip()[:8].upper() == "VELOCITY"
+
+
+@lru_cache(maxsize=256)
+def parse_velocity_rule(rule_sql: str) -> Tuple[Window, str, int]:
+    """
+    Parse "VELOCITY <window> <op> <threshold>" into (window, op, threshold).
+    """
+    m = _RULE_RE.fullmatch(rule_sql)
+    if not m:
+        raise ValueError(f"Invalid velocity rule: {rule_sql!r}")
+    name, op, threshold = m.group(1), m.group(2), int(m.group(3))
+    window = get_windows().get(name)
+    if window is None:
+        raise ValueError(f"Unknown velocity window: {name}")
+    return window, op, threshold
+
+
+def run_velocity_rule(rule_sql: str, case_id: str, target: str) -> bool:
+    """
+    Evaluate a velocity rule for a case: two indexed lookups, independent of
+    Order / Purchase history size.
+    """
+    window, op, threshold = parse_velocity_rule(rule_sql)
+    source = ENTITY_SOURCES.get((target, window.entity))
+    if source is None:
+        raise ValueError(f"Window {window.name} is not available for {target} rules")
+
+    with read_connection().cursor() as cur:
+        cur.execute(source, [case_id])
+        row = cur.fetchone()
+    if not row:
+        return False
+    return OPS[op](velocity_count(window, row[0]), threshold)
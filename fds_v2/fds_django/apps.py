@@ -5,8 +5,10 @@ class FdsDjangoConfig(AppConfig):
     name = "fds_django"
 
     def ready(self):
+        # Rules load lazily on first detection (fds_core.rule_cache); only the
+        # snapshot file is read here, so startup never waits on the database.
         try:
-            from fds_core.rule_cache import load_rules_from_db
-            load_rules_from_db()
+            from fds_core.rule_cache import load_snapshot
+            load_snapshot()
         except Exception as e:
-            print(f"[rules] skip preload: {e}")
\ No newline at end of file
+            print(f"[rules] skip snapshot preload: {e}")
@@ -0,0 +1,35 @@
+# fds_django/db_router.py
+"""
+Database router for replica reads.
+
+    DATABASE_ROUTERS = ["fds_django.db_router.ReplicaRouter"]
+
+ORM reads inside fds_core.replica.reading_from(alias) (rule evaluation,
+replay, backtests) go to that alias. Everything else stays on the primary:
+  - all writes, including saves of instances read from a replica
+  - reads of Outbox, Processed and the blocklists, which decide writes
+  - migrations (replicas are never migrated)
+Queries with an explicit .using() bypass routers.
+"""
+from fds_core.replica import read_alias
+from fds_django.services.replicas import replica_aliases
+
+# Model names always read from the primary
+PRIMARY_ONLY = frozenset({"outbox", "processed", "userblock", "deviceblock", "cardblock"})
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name in PRIMARY_ONLY:
+            return "default"
+        alias = read_alias()
+        return alias if alias != "default" else None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
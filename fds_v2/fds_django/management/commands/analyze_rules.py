@@ -0,0 +1,35 @@
+# fds_django/management/commands/analyze_rules.py
+import sys
+
+from django.core.management.base import BaseCommand
+
+from fds_core import rule_analyzer
+from fds_core.rule_cache import read_rules_from_db
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN every rule in fds_django_rules and report plan cost, seq scans and missing indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget", type=float, default=None, help="Plan cost budget (default: FDS_RULE_COST_BUDGET).")
+        parser.add_argument("--save", action="store_true", help="Store the report with the current rule generation.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+        parser.add_argument("--fail-over-budget", action="store_true", help="Exit with status 1 if any rule is over budget.")
+
+    def handle(self, *args, **options):
+        # all stored rules, including ones the loader would reject
+        rules = read_rules_from_db()
+        report = rule_analyzer.analyze_rules(rules, budget=options["budget"])
+
+        if options["json"]:
+            self.stdout.write(rule_analyzer.JSON_CODEC.dumps(report).decode("utf-8"))
+        else:
+            self.stdout.write(rule_analyzer.format_report(report))
+
+        if options["save"]:
+            generation = rule_analyzer.save_generation(report)
+            self.stdout.write(f"saved report to rule generation {generation}")
+
+        if options["fail_over_budget"] and any("over_budget" in e["flags"] for e in report["rules"]):
+            sys.exit(1)
+
@@ -0,0 +1,73 @@
+# fds_django/management/commands/partitions.py
+from django.core.management.base import BaseCommand, CommandError
+
+from fds_django.models import Outbox, Processed
+from fds_django.services import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Partition maintenance for outbox, Processed and DetectionLog (services.partitions): "
+        "create upcoming partitions, archive and drop expired ones. Run regularly (e.g. hourly)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--convert", action="store_true",
+                            help="One-time: convert the tables to partitioned tables (locks each table while it runs).")
+        parser.add_argument("--revert", action="store_true",
+                            help="Convert the tables back to plain tables (stop workers first; locks each table).")
+        parser.add_argument("--list", action="store_true", help="Only list partitions.")
+        parser.add_argument("--archive-dir", default=None, help="Default: FDS_PARTITION_ARCHIVE_DIR.")
+        parser.add_argument("--detach-only", action="store_true",
+                            help="Detach expired partitions and keep them as tables, without archiving.")
+        parser.add_argument("--dry-run", action="store_true", help="Show what would expire; create nothing.")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        specs = {spec.model: spec for spec in partitions.PARTITIONED}
+        if partitions.retention_days(specs[Processed]) < partitions.retention_days(specs[Outbox]):
+            raise CommandError(
+                "FDS_PROCESSED_RETENTION_DAYS must be >= FDS_OUTBOX_RETENTION_DAYS: "
+                "idempotency keys have to outlive the events they guard"
+            )
+
+        if options["revert"]:
+            for spec in partitions.PARTITIONED:
+                try:
+                    reverted = partitions.revert_partitioned(spec.model, using=using)
+                except RuntimeError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(f"{spec.model._meta.db_table}: {'reverted' if reverted else 'not partitioned'}")
+            return
+
+        for spec in partitions.PARTITIONED:
+            table = spec.model._meta.db_table
+            if options["convert"] and not options["dry_run"]:
+                try:
+                    partitions.convert_to_partitioned(spec.model, using=using)
+                except RuntimeError as e:
+                    raise CommandError(str(e))
+            if not partitions.is_partitioned(spec.model, using=using):
+                self.stdout.write(f"{table}: not partitioned (run with --convert)")
+                continue
+
+            if options["list"]:
+                for p in partitions.partitions(spec.model, using=using):
+                    bounds = "DEFAULT" if p.default else f"{p.start or 'MINVALUE'} .. {p.end or 'MAXVALUE'}"
+                    self.stdout.write(f"{table}: {p.name}  {bounds}")
+                continue
+
+            if not options["dry_run"]:
+                created = partitions.ensure_partitions(spec.model, using=using)
+                if created:
+                    self.stdout.write(f"{table}: created {', '.join(created)}")
+            for done in partitions.expire_partitions(
+                spec,
+                archive_dir=options["archive_dir"],
+                detach_only=options["detach_only"],
+                dry_run=options["dry_run"],
+                using=using,
+            ):
+                path = f" -> {done['path']}" if done.get("path") else ""
+                self.stdout.write(f"{table}: {done['partition']} {done['action']}{path}")
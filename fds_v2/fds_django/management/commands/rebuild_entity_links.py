@@ -0,0 +1,15 @@
+# fds_django/management/commands/rebuild_entity_links.py
+from django.core.management.base import BaseCommand
+
+from fds_django.services.entity_links import rebuild_entity_links
+
+
+class Command(BaseCommand):
+    help = "Rebuild the entity link index (links, nodes, clusters) from Order / Purchase history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        stats = rebuild_entity_links(using=options["database"])
+        self.stdout.write(", ".join(f"{k}={v}" for k, v in stats.items()))
@@ -0,0 +1,19 @@
+# fds_django/management/commands/rebuild_rule_stats.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from fds_django.services.rule_stats import rebuild_rule_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-rule hourly rollups (fds_core.rule_stats) from DetectionLog."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=None, help="Only rebuild the last N hours. Default: all history.")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        since = time.time() - options["hours"] * 3600 if options["hours"] is not None else None
+        stats = rebuild_rule_stats(since=since, using=options["database"])
+        self.stdout.write(f"{stats['detections']} detections -> {stats['rows']} rollup rows")
@@ -0,0 +1,30 @@
+# fds_django/management/commands/rebuild_velocity.py
+from django.core.management.base import BaseCommand, CommandError
+
+from fds_django.services.velocity import purge_velocity, rebuild_velocity
+
+
+class Command(BaseCommand):
+    help = "Rebuild velocity buckets from Order / Purchase history (fds_core.velocity windows)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window",
+            action="append",
+            dest="windows",
+            help="Window name to rebuild (repeatable). Default: all windows.",
+        )
+        parser.add_argument("--purge", action="store_true", help="Also delete buckets no window can read.")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            written = rebuild_velocity(options["windows"], using=options["database"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for series, buckets in sorted(written.items()):
+            self.stdout.write(f"{series}: {buckets} buckets")
+        if options["purge"]:
+            deleted = purge_velocity(using=options["database"])
+            self.stdout.write(f"purged {deleted} buckets")
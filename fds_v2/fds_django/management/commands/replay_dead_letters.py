@@ -0,0 +1,67 @@
+# fds_django/management/commands/replay_dead_letters.py
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from fds_django.models import Outbox
+from fds_django.services.dead_letter import replay_archived, replay_dead_letters
+from fds_django.services.lanes import LANES
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-drive dead-lettered (ERROR) outbox events: put them back to READY for the dispatcher. "
+        "Use --list first to see what failed and why; --archive replays from an expired outbox partition's archive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--list", action="store_true", help="Only list dead letters per error class.")
+        parser.add_argument("--archive", default=None, help="Outbox partition archive (.jsonl.gz) to replay from.")
+        parser.add_argument("--shard", default=None)
+        parser.add_argument("--id", type=int, action="append", dest="ids", help="Outbox id (repeatable).")
+        parser.add_argument("--event-type", default=None)
+        parser.add_argument("--error-class", default=None, help="e.g. builtins.KeyError")
+        parser.add_argument("--lane", choices=[lane.name for lane in LANES], default=None,
+                            help="Replay on this lane instead of the rows' own (e.g. bulk).")
+        parser.add_argument("--limit", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        if options["list"]:
+            rows = (
+                Outbox.objects.using(using)
+                .filter(status=Outbox.Status.ERROR)
+                .values("shard_id", "event_type", "error_class")
+                .annotate(n=Count("id"))
+                .order_by("-n")
+            )
+            for r in rows:
+                self.stdout.write(f"{r['n']:>8}  {r['shard_id']}  {r['event_type']}  {r['error_class']}")
+            return
+
+        if options["archive"]:
+            ids = replay_archived(
+                options["archive"],
+                shard_id=options["shard"],
+                ids=options["ids"],
+                event_type=options["event_type"],
+                error_class=options["error_class"],
+                lane=options["lane"],
+                limit=options["limit"],
+                dry_run=options["dry_run"],
+                using=using,
+            )
+        else:
+            ids = replay_dead_letters(
+                shard_id=options["shard"],
+                ids=options["ids"],
+                event_type=options["event_type"],
+                error_class=options["error_class"],
+                lane=options["lane"],
+                limit=options["limit"],
+                dry_run=options["dry_run"],
+                using=using,
+            )
+        verb = "would replay" if options["dry_run"] else "replayed"
+        self.stdout.write(f"{verb} {len(ids)} dead-lettered events" + (f": {ids}" if len(ids) <= 20 else ""))
@@ -0,0 +1,37 @@
+# fds_django/management/commands/rule_stats.py
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from fds_core import rule_stats
+
+
+class Command(BaseCommand):
+    help = "Per-rule effectiveness over the last N hours, from the hourly rollups (no DetectionLog scan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24)
+        parser.add_argument("--kind", choices=["order", "purchase"], default=None)
+        parser.add_argument("--rule", default=None, help="Hourly series of one rule instead of totals.")
+        parser.add_argument("--json", action="store_true", help="Print rows as JSON.")
+
+    def handle(self, *args, **options):
+        since = time.time() - options["hours"] * 3600
+        if options["rule"]:
+            rows = rule_stats.rule_timeseries(options["rule"], since, kind=options["kind"])
+            keys = ("hour_start",)
+        else:
+            rows = rule_stats.rule_summary(since, kind=options["kind"])
+            keys = ("rule_id", "case_kind")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+
+        columns = keys + rule_stats.COUNTS + ("hit_rate",)
+        self.stdout.write("  ".join(f"{c:>16}" for c in columns))
+        for row in rows:
+            rate = row["hit_rate"]
+            values = [row[c] for c in keys + rule_stats.COUNTS] + ["-" if rate is None else f"{rate:.4f}"]
+            self.stdout.write("  ".join(f"{v!s:>16}" for v in values))
@@ -0,0 +1,24 @@
+# fds_django/management/commands/snapshot_rules.py
+from django.core.management.base import BaseCommand, CommandError
+
+from fds_core import rule_cache
+
+
+class Command(BaseCommand):
+    help = "Load rules from fds_django_rules (with cost checks) and write the rule snapshot new workers start from."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=None, help="Snapshot file (default: FDS_RULE_SNAPSHOT_PATH).")
+
+    def handle(self, *args, **options):
+        rule_cache.clear_rules()
+        rule_cache.load_rules_from_db()
+        try:
+            rules = rule_cache.get_all_rules()
+            path = rule_cache.write_snapshot(options["path"])
+        except (rule_cache.RulesUnavailable, ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"wrote {len(rules['order'])} order / {len(rules['purchase'])} purchase rules to {path}"
+        )
@@ -0,0 +1,66 @@
+# fds_django/management/commands/trace_report.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from fds_core import tracing
+
+
+class Command(BaseCommand):
+    help = (
+        "Pipeline trace report from the trace exporter (FDS_TRACE_EXPORTER=\"file\" to see spans "
+        "of web and worker processes): where the time goes, or the stage timings of one aggregate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--aggregate", default=None, help="Stage timings of one aggregate_id.")
+        parser.add_argument("--top-rules", type=int, default=10)
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        spans = tracing.exporter().spans()
+        if options["aggregate"]:
+            report = tracing.stage_timings(options["aggregate"], spans)
+        else:
+            report = tracing.breakdown(spans, top_rules=options["top_rules"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        if options["aggregate"]:
+            if not report:
+                self.stdout.write(f"no traces for {options['aggregate']}")
+            for trace in report:
+                self._trace(trace)
+        else:
+            self._breakdown(report)
+
+    def _trace(self, trace):
+        total = trace["end_to_end_ms"]
+        self.stdout.write(
+            f"trace {trace['trace_id']} {trace['event_type']}  end_to_end="
+            + ("-" if total is None else f"{total:.2f}ms")
+        )
+        for name in tracing.STAGES:
+            if name in trace["stages"]:
+                self.stdout.write(f"  {name:>16}  {trace['stages'][name]:>10.2f}ms")
+        for rule_id, ms in sorted(trace["rules"].items(), key=lambda kv: -kv[1]):
+            self.stdout.write(f"  {'rule ' + rule_id:>16}  {ms:>10.2f}ms")
+
+    def _breakdown(self, report):
+        self.stdout.write(f"traces: {report['traces']}")
+        self.stdout.write("  ".join(f"{c:>16}" for c in ("stage", "count", "mean_ms", "p50_ms", "p95_ms", "share")))
+        for name, s in report["stages"].items():
+            values = [name, s["count"], f"{s['mean_ms']:.2f}", f"{s['p50_ms']:.2f}", f"{s['p95_ms']:.2f}", f"{s['share']:.1%}"]
+            self.stdout.write("  ".join(f"{v!s:>16}" for v in values))
+
+        e2e, rest = report["end_to_end_ms"], report["unaccounted_ms"]
+        if e2e["p50"] is not None:
+            self.stdout.write(f"end_to_end p50={e2e['p50']:.2f}ms p95={e2e['p95']:.2f}ms")
+            self.stdout.write(f"unaccounted p50={rest['p50']:.2f}ms p95={rest['p95']:.2f}ms")
+
+        if report["rules"]:
+            self.stdout.write("slowest rules:")
+            for r in report["rules"]:
+                self.stdout.write(f"  {r['rule_id']:>16}  count={r['count']}  total={r['total_ms']:.2f}ms  p95={r['p95_ms']:.2f}ms")
@@ -1,6 +1,8 @@
 import uuid
 from django.db import models
 
+from fds_core.codec import CodecJSONEncoder, CodecJSONDecoder
+
 
 class TimestampedModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -74,6 +76,19 @@ class Rules(TimestampedModel):
         return f"Rule({self.rule_id})"
 
 
+class RuleGeneration(TimestampedModel):
+    """
+    One distinct rule set (by fingerprint) and its EXPLAIN cost report
+    (see fds_core.rule_analyzer).
+    """
+    fingerprint = models.CharField(max_length=64, unique=True)
+    rule_count = models.IntegerField(default=0)
+    report = models.JSONField(default=dict, encoder=CodecJSONEncoder, decoder=CodecJSONDecoder)
+
+    def __str__(self):
+        return f"RuleGeneration({self.id}, {self.fingerprint[:12]})"
+
+
 class UserBlock(TimestampedModel):
     user_id = models.CharField(max_length=64, unique=True)
 
@@ -107,12 +122,131 @@ class DetectionLog(TimestampedModel):
 
     decision = models.CharField(max_length=16)    # BLOCK | REVIEW | ALLOW
     reasons = models.JSONField(default=list)      # list[str]
-    extra = models.JSONField(default=dict)        # dict
+    extra = models.JSONField(default=dict, encoder=CodecJSONEncoder, decoder=CodecJSONDecoder)  # dict
 
     def __str__(self):
         return f"DetectionLog({self.id}, {self.case_kind}, {self.case_id})"
 
 
+# --------------------------
+# Rule effectiveness rollups
+# --------------------------
+
+class RuleStatHour(models.Model):
+    """
+    Per-rule detection counts for one case kind and hour (see fds_core.rule_stats).
+    """
+    rule_id = models.CharField(max_length=64)
+    case_kind = models.CharField(max_length=16)         # order | purchase
+    hour_start = models.BigIntegerField()               # epoch seconds, aligned to 3600
+    evaluations = models.IntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    block_decisions = models.IntegerField(default=0)    # hits in cases decided BLOCK
+    review_decisions = models.IntegerField(default=0)   # hits in cases decided REVIEW
+    sole_hits = models.IntegerField(default=0)          # only hit at the decision's severity
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["rule_id", "case_kind", "hour_start"],
+                name="uq_rule_stat_hour",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["hour_start", "case_kind"]),
+        ]
+
+    def __str__(self):
+        return f"RuleStatHour({self.rule_id}, {self.case_kind}, {self.hour_start})"
+
+
+# --------------------------
+# Velocity counters
+# --------------------------
+
+class VelocityBucket(models.Model):
+    """
+    Event count of one entity within one time bucket (see fds_core.velocity).
+    """
+    metric = models.CharField(max_length=32)        # order | purchase | purchase_fail
+    entity_type = models.CharField(max_length=16)   # account | device | card | bin
+    entity_id = models.CharField(max_length=64)
+    bucket_seconds = models.IntegerField()
+    bucket_start = models.BigIntegerField()         # epoch seconds, aligned to bucket_seconds
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["metric", "entity_type", "entity_id", "bucket_seconds", "bucket_start"],
+                name="uq_velocity_bucket",
+            )
+        ]
+
+    def __str__(self):
+        return f"VelocityBucket({self.metric}, {self.entity_type}={self.entity_id}, {self.bucket_start})"
+
+
+# --------------------------
+# Entity link index
+# --------------------------
+
+class EntityLink(models.Model):
+    """
+    Adjacency between two entities seen together (see fds_core.entity_links).
+    Stored once per direction so lookups start from either side.
+    """
+    src_type = models.CharField(max_length=16)   # account | device | card
+    src_id = models.CharField(max_length=64)
+    dst_type = models.CharField(max_length=16)
+    dst_id = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["src_type", "src_id", "dst_type", "dst_id"],
+                name="uq_entity_link",
+            )
+        ]
+
+    def __str__(self):
+        return f"EntityLink({self.src_type}={self.src_id} -> {self.dst_type}={self.dst_id})"
+
+
+class EntityCluster(models.Model):
+    """
+    Connected component of the entity link graph.
+    """
+    size = models.IntegerField(default=1)
+    blocked = models.IntegerField(default=0)   # blocklisted members
+
+    def __str__(self):
+        return f"EntityCluster({self.id}, size={self.size})"
+
+
+class EntityNode(models.Model):
+    """
+    Entity -> cluster. Merges relabel the smaller cluster, so cluster_id is
+    always the root (no parent chains).
+    """
+    entity_type = models.CharField(max_length=16)
+    entity_id = models.CharField(max_length=64)
+    cluster_id = models.BigIntegerField(db_index=True)
+    blocked = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["entity_type", "entity_id"],
+                name="uq_entity_node",
+            )
+        ]
+
+    def __str__(self):
+        return f"EntityNode({self.entity_type}={self.entity_id}, cluster={self.cluster_id})"
+
+
 # --------------------------
 # Outbox / Processed
 # --------------------------
@@ -122,6 +256,10 @@ class Outbox(TimestampedModel):
     Durable outbox for detection events.
 
     Each row represents one detection job to be dispatched to workers.
+    `trace` is the event's trace context (fds_core.tracing), NULL unless sampled.
+
+    ERROR is the dead-letter state (services.dead_letter): `attempts` holds
+    the failed attempts, `error_class` / `last_error` the final failure.
     """
     class Status(models.TextChoices):
         READY = "READY", "Ready"
@@ -129,19 +267,30 @@ class Outbox(TimestampedModel):
         ERROR = "ERROR", "Error"
 
     shard_id = models.CharField(max_length=64, default="default")
+    lane = models.CharField(max_length=16, default="order")  # purchase | order | bulk
     event_type = models.CharField(max_length=64)
     aggregate_id = models.CharField(max_length=128)
-    payload = models.JSONField()
+    payload = models.JSONField(encoder=CodecJSONEncoder, decoder=CodecJSONDecoder)
     status = models.CharField(
         max_length=16,
         choices=Status.choices,
         default=Status.READY,
     )
+    trace = models.JSONField(null=True, blank=True)
+    attempts = models.JSONField(default=list, blank=True)
+    error_class = models.CharField(max_length=255, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
 
     class Meta:
         db_table = "outbox"
         indexes = [
             models.Index(fields=["shard_id", "status", "id"]),
+            # READY rows only: dispatcher / lane lag scans, small whatever the history
+            models.Index(
+                fields=["shard_id", "lane", "id"],
+                condition=models.Q(status="READY"),
+                name="outbox_ready_lane_idx",
+            ),
         ]
 
     def __str__(self):
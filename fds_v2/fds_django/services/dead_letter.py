@@ -0,0 +1,234 @@
+# fds_django/services/dead_letter.py
+"""
+Detection failure handling: retry or dead-letter.
+
+Worker failures are classified per event (classify):
+  - retryable: the database or rule set is temporarily unavailable
+    (OperationalError / InterfaceError, deadlocks and serialization
+    failures, RulesUnavailable). The task is retried with exponential
+    backoff, up to the task's max_retries.
+  - permanent: anything else, e.g. a malformed payload (KeyError,
+    ValueError), a missing foreign key (IntegrityError). Retrying cannot
+    help: the outbox row is dead-lettered at once.
+
+Every failed attempt is appended to the row's attempt history
+(Outbox.attempts, last MAX_HISTORY entries) with the error class and
+message; a dead-lettered row gets status ERROR, its error class and the
+full traceback (Outbox.last_error). Retryable failures that exhaust the
+retries are dead-lettered the same way.
+
+`manage.py replay_dead_letters` puts ERROR rows back to READY once the cause
+is fixed; the dispatcher re-drives them like new events. Dead letters of
+expired outbox partitions are replayed from their archive (--archive).
+
+Counters (services.metrics):
+  - fds_detection_failures_total{error_class, retryable, outcome}
+  - fds_detection_failure_seconds_total{error_class}: worker time spent on
+    failed attempts, i.e. the capacity retries consume
+"""
+import socket
+import traceback
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import DatabaseError, IntegrityError, InterfaceError, OperationalError, connections, transaction
+from django.utils import timezone
+
+from fds_core.rule_cache import RulesUnavailable
+from fds_django.models import Outbox
+from fds_django.services import metrics
+from fds_django.services.partitions import read_archive
+
+MAX_HISTORY = 20
+
+# Retryable: the same event can succeed once the database / rules are back.
+# DatabaseError subclasses not listed (IntegrityError, DataError,
+# ProgrammingError) are deterministic for a given payload.
+RETRYABLE: Tuple[type, ...] = (OperationalError, InterfaceError, RulesUnavailable)
+
+# PostgreSQL SQLSTATEs worth retrying even when raised as another
+# DatabaseError subclass (serialization_failure, deadlock_detected,
+# lock_not_available, query_canceled)
+_RETRYABLE_SQLSTATES = {"40001", "40P01", "55P03", "57014"}
+
+
+def classify(exc: BaseException) -> Tuple[str, bool]:
+    """
+    (error class, retryable) for a detection failure.
+    """
+    error_class = f"{type(exc).__module__}.{type(exc).__qualname__}"
+    if isinstance(exc, IntegrityError):
+        return error_class, False
+    if isinstance(exc, RETRYABLE):
+        return error_class, True
+    if isinstance(exc, DatabaseError):
+        sqlstate = getattr(exc.__cause__, "sqlstate", None) or getattr(exc.__cause__, "pgcode", None)
+        return error_class, sqlstate in _RETRYABLE_SQLSTATES
+    return error_class, False
+
+
+def _attempt(exc: BaseException, error_class: str, retryable: bool, attempt: int) -> Dict[str, Any]:
+    return {
+        "at": timezone.now().isoformat(),
+        "attempt": attempt,
+        "error_class": error_class,
+        "error": str(exc)[:500],
+        "retryable": retryable,
+        "worker": socket.gethostname(),
+    }
+
+
+def record_failure(
+    outbox_ids: Iterable[int],
+    exc: BaseException,
+    attempt: int,
+    dead: bool,
+    seconds: float = 0.0,
+    using: str = "default",
+) -> bool:
+    """
+    Append a failed attempt to the rows' history and count it; `dead`
+    moves the rows to the dead-letter state (status ERROR).
+
+    Returns False when the rows could not be updated (e.g. the database
+    is down): the caller must retry rather than drop the event.
+    """
+    error_class, retryable = classify(exc)
+    entry = _attempt(exc, error_class, retryable, attempt)
+    trace_text = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))[-8000:]
+    outcome = "dead_letter" if dead else "retry"
+    metrics.incr_many({
+        metrics.series("fds_detection_failures_total", error_class=error_class, retryable=str(retryable).lower(), outcome=outcome): 1,
+        metrics.series("fds_detection_failure_seconds_total", error_class=error_class): seconds,
+    })
+
+    ids = list(outbox_ids)
+    try:
+        connection = connections[using]
+        if not connection.in_atomic_block:
+            # drop a broken connection; inside a caller's transaction
+            # (eager tasks) this would close it under them
+            connection.close_if_unusable_or_obsolete()
+        with transaction.atomic(using=using):
+            for row in Outbox.objects.using(using).select_for_update().filter(id__in=ids).order_by("id"):
+                row.attempts = (list(row.attempts or []) + [entry])[-MAX_HISTORY:]
+                fields = ["attempts", "updated_at"]
+                if dead:
+                    row.status = Outbox.Status.ERROR
+                    row.error_class = error_class
+                    row.last_error = trace_text
+                    fields += ["status", "error_class", "last_error"]
+                row.save(update_fields=fields)
+    except DatabaseError as e:
+        print(f"[dead_letter] could not record failure of outbox {ids}: {e}")
+        return False
+
+    if dead:
+        print(f"[dead_letter] outbox {ids} dead-lettered after attempt {attempt}: {error_class}: {entry['error']}")
+    return True
+
+
+def find_outbox_id(shard_id: str, event_type: str, aggregate_id: str, using: str = "default") -> Optional[int]:
+    """Latest SENT row of an event (payload-mode messages without an outbox id)."""
+    return (
+        Outbox.objects.using(using)
+        .filter(shard_id=shard_id, event_type=event_type, aggregate_id=aggregate_id, status=Outbox.Status.SENT)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def replay_dead_letters(
+    shard_id: Optional[str] = None,
+    ids: Optional[List[int]] = None,
+    event_type: Optional[str] = None,
+    error_class: Optional[str] = None,
+    lane: Optional[str] = None,
+    limit: int = 1000,
+    dry_run: bool = False,
+    using: str = "default",
+) -> List[int]:
+    """
+    Put dead-lettered rows back to READY so the dispatcher re-drives them.
+    Filters combine; `lane` overrides the rows' lane (e.g. "bulk").
+    The attempt history is kept, with a replay marker. Returns the row ids.
+    """
+    rows = Outbox.objects.using(using).filter(status=Outbox.Status.ERROR)
+    if shard_id:
+        rows = rows.filter(shard_id=shard_id)
+    if ids:
+        rows = rows.filter(id__in=ids)
+    if event_type:
+        rows = rows.filter(event_type=event_type)
+    if error_class:
+        rows = rows.filter(error_class=error_class)
+
+    replayed: List[int] = []
+    with transaction.atomic(using=using):
+        for row in rows.select_for_update(skip_locked=True).order_by("id")[:limit]:
+            replayed.append(row.id)
+            if dry_run:
+                continue
+            row.attempts = (list(row.attempts or []) + [{"at": timezone.now().isoformat(), "replayed": True}])[-MAX_HISTORY:]
+            row.status = Outbox.Status.READY
+            fields = ["attempts", "status", "updated_at"]
+            if lane:
+                row.lane = lane
+                fields.append("lane")
+            row.save(update_fields=fields)
+
+    if replayed and not dry_run:
+        metrics.incr("fds_dead_letter_replayed_total", len(replayed))
+    return replayed
+
+
+def replay_archived(
+    path: str,
+    shard_id: Optional[str] = None,
+    ids: Optional[List[int]] = None,
+    event_type: Optional[str] = None,
+    error_class: Optional[str] = None,
+    lane: Optional[str] = None,
+    limit: int = 1000,
+    dry_run: bool = False,
+    using: str = "default",
+) -> List[int]:
+    """
+    Re-drive dead letters from an outbox partition archive
+    (services.partitions): matching ERROR rows are inserted again as new
+    READY rows, their history noting the archived row id. Returns the
+    archived ids.
+    """
+    header, rows = read_archive(path)
+    if header.get("table") != Outbox._meta.db_table:
+        raise ValueError(f"{path}: archive of {header.get('table')!r}, not of the outbox")
+
+    replayed: List[int] = []
+    new_rows: List[Outbox] = []
+    for row in rows:
+        if len(replayed) >= limit:
+            break
+        if row["status"] != Outbox.Status.ERROR:
+            continue
+        if (shard_id and row["shard_id"] != shard_id) or (ids and row["id"] not in ids):
+            continue
+        if event_type and row["event_type"] != event_type:
+            continue
+        if error_class and row.get("error_class") != error_class:
+            continue
+        replayed.append(row["id"])
+        marker = {"at": timezone.now().isoformat(), "replayed": True, "archived_id": row["id"], "archive": header["partition"]}
+        new_rows.append(Outbox(
+            shard_id=row["shard_id"],
+            lane=lane or row["lane"],
+            event_type=row["event_type"],
+            aggregate_id=row["aggregate_id"],
+            payload=row["payload"],
+            status=Outbox.Status.READY,
+            attempts=(list(row.get("attempts") or []) + [marker])[-MAX_HISTORY:],
+        ))
+
+    if new_rows and not dry_run:
+        Outbox.objects.using(using).bulk_create(new_rows)
+        metrics.incr("fds_dead_letter_replayed_total", len(new_rows))
+    return replayed
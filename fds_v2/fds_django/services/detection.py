@@ -1,8 +1,16 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
-from fds_core.enums import CaseKind
-from fds_core.models import CaseParams, EntityRefs, RegisterParams, Result
-from fds_core.detector import detect_case
+from django.db import transaction
+
+from fds_core import tracing
+from fds_core.enums import CaseKind, Decision
+from fds_core.hit import Hit
+from fds_core.models import CaseParams, EntityRefs, PartialResult, Result
+from fds_core.detector import complete_case, detect_case, detect_case_within
+from fds_core.side_effects import log_decision
+from fds_django.models import Outbox
+from fds_django.services import metrics
+from fds_django.services.lanes import lane_for_event
 
 
 def build_case_params(kind: CaseKind, payload: Dict[str, Any]) -> CaseParams:
@@ -15,7 +23,7 @@ def build_case_params(kind: CaseKind, payload: Dict[str, Any]) -> CaseParams:
         case_id = payload["purchase_id"]
 
     refs = EntityRefs(
-        user=payload.get("user_id") or None,
+        user=payload.get("user_id") or payload.get("account_id") or None,
         device=payload.get("device_id") or None,
         card=payload.get("card_id") or None,
     )
@@ -28,4 +36,101 @@ def run_detection_sync(kind: CaseKind, payload: Dict[str, Any]) -> Result:
     """
     params = build_case_params(kind, payload)
 
-    return detect_case(kind, params)
\ No newline at end of file
+    return detect_case(kind, params)
+
+
+# --------------------------
+# Deadline mode
+# --------------------------
+
+# Structure: decision -> severity (higher is stricter)
+_SEVERITY: Dict[str, int] = {Decision.ALLOW.value: 0, Decision.REVIEW.value: 1, Decision.BLOCK.value: 2}
+
+
+def run_detection_within(
+    kind: CaseKind,
+    payload: Dict[str, Any],
+    deadline: float,
+    shard_id: str = "default",
+) -> Tuple[PartialResult, str]:
+    """
+    Deadline-bound detection (fds_core.detector.detect_case_within).
+
+    Logs the decision to DetectionLog and, when rules are still pending,
+    emits a "<kind>_detect_deferred" outbox event on the kind's lane so a
+    worker completes them (complete_deferred_detection); the event is
+    traced from there when sampled (fds_core.tracing).
+    Returns (result, DetectionLog id).
+    """
+    using = "default"
+    params = build_case_params(kind, payload)
+    acc = detect_case_within(kind, params, deadline)
+
+    with transaction.atomic(using=using):
+        log = log_decision(
+            kind.value,
+            params.case_id,
+            acc.decision,
+            acc.hits,
+            evaluated=acc.evaluated_rules,
+            extra={"stage": "provisional" if acc.provisional else "final", "pending_rules": acc.pending_rules},
+            using=using,
+        )
+        if acc.provisional:
+            Outbox.objects.using(using).create(
+                shard_id=shard_id,
+                lane=lane_for_event(kind.value),
+                event_type=f"{kind.value}_detect_deferred",
+                aggregate_id=str(log.id),
+                payload={
+                    "kind": kind.value,
+                    "deferred": True,
+                    "order_id": payload.get("order_id"),
+                    "purchase_id": payload.get("purchase_id"),
+                    "account_id": params.refs.user,
+                    "device_id": params.refs.device,
+                    "card_id": params.refs.card,
+                    "provisional_log_id": str(log.id),
+                    "provisional_decision": acc.decision.value,
+                    "evaluated_rules": acc.evaluated_rules,
+                    "hits": [
+                        {"rule_id": h.rule_id, "decision": h.decision.value, "register_blocklist": h.register_blocklist}
+                        for h in acc.hits
+                    ],
+                },
+                status="READY",
+                trace=tracing.new_context(f"{kind.value}_detect_deferred", log.id),
+            )
+    return acc, str(log.id)
+
+
+def complete_deferred_detection(params: CaseParams, payload: Dict[str, Any], using: str = "default") -> PartialResult:
+    """
+    Worker side of deadline mode: evaluate the rules the provisional pass did
+    not reach and log the final decision, linked to the provisional log.
+    A final decision stricter than the provisional one is an escalation
+    (extra["escalation"], e.g. "allow->block").
+    """
+    prior_hits = [
+        Hit(rule_id=h["rule_id"], decision=Decision(h["decision"]), register_blocklist=h.get("register_blocklist", False))
+        for h in payload.get("hits", [])
+    ]
+    acc = complete_case(params.kind, params, prior_hits, exclude=payload.get("evaluated_rules", []))
+
+    provisional = payload.get("provisional_decision", Decision.ALLOW.value)
+    final = acc.decision.value
+    escalated = _SEVERITY[final] > _SEVERITY.get(provisional, 0)
+
+    extra: Dict[str, Any] = {
+        "stage": "final",
+        "provisional_log_id": payload.get("provisional_log_id"),
+        "provisional_decision": provisional,
+        "escalated": escalated,
+    }
+    if escalated:
+        extra["escalation"] = f"{provisional}->{final}"
+        metrics.incr("fds_detection_escalations_total", kind=params.kind.value, provisional=provisional, final=final)
+
+    with tracing.span("decision_log"):
+        log_decision(params.kind.value, params.case_id, acc.decision, acc.hits, evaluated=acc.evaluated_rules, extra=extra, using=using)
+    return acc
@@ -0,0 +1,251 @@
+# fds_django/services/entity_links.py
+"""
+Entity link index maintenance (query side: fds_core.entity_links).
+
+  - record_order / record_purchase: link the entities of a snapshot, inside
+    the upsert transaction
+  - mark_blocked: keep cluster blocklist counts current on registration
+  - rebuild_entity_links: rebuild all three tables from Order / Purchase and
+    the blocklists (in-memory union-find, bulk insert)
+"""
+from typing import Any, Dict, List, Set, Tuple
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+
+from fds_django.models import (
+    CardBlock,
+    DeviceBlock,
+    EntityCluster,
+    EntityLink,
+    EntityNode,
+    Order,
+    Purchase,
+    UserBlock,
+)
+
+Entity = Tuple[str, str]  # (entity_type, entity_id)
+
+# Structure: entity_type -> (blocklist model, blocklist column)
+_BLOCKLISTS: Dict[str, Tuple[Any, str]] = {
+    "account": (UserBlock, "user_id"),
+    "device": (DeviceBlock, "device_id"),
+    "card": (CardBlock, "card_id"),
+}
+
+_MERGE_RETRIES = 3
+
+
+class MergeConflict(OperationalError):
+    """
+    Concurrent merges kept moving the clusters: the caller's transaction
+    rolls back (with the links it recorded) and has to be retried.
+    """
+
+
+def is_blocked(entity: Entity, using: str = "default") -> bool:
+    model, column = _BLOCKLISTS[entity[0]]
+    return model.objects.using(using).filter(**{column: entity[1]}).exists()
+
+
+def _node(entity: Entity, using: str) -> EntityNode:
+    """
+    Return the entity's node, creating it in a new singleton cluster.
+    """
+    node = EntityNode.objects.using(using).filter(entity_type=entity[0], entity_id=entity[1]).first()
+    if node is not None:
+        return node
+
+    blocked = is_blocked(entity, using=using)
+    try:
+        with transaction.atomic(using=using):
+            cluster = EntityCluster.objects.using(using).create(size=1, blocked=int(blocked))
+            return EntityNode.objects.using(using).create(
+                entity_type=entity[0], entity_id=entity[1], cluster_id=cluster.id, blocked=blocked,
+            )
+    except IntegrityError:
+        # created concurrently
+        return EntityNode.objects.using(using).get(entity_type=entity[0], entity_id=entity[1])
+
+
+def _union(a: Entity, b: Entity, using: str) -> None:
+    """
+    Merge the clusters of two entities: relabel the smaller into the larger.
+    Cluster rows are locked in id order; retried when a concurrent merge
+    moved either entity in between. Raises MergeConflict after
+    _MERGE_RETRIES attempts, so the link rows are never committed while the
+    clusters stay split.
+    """
+    for _ in range(_MERGE_RETRIES):
+        ca, cb = (
+            EntityNode.objects.using(using)
+            .filter(entity_type=e[0], entity_id=e[1])
+            .values_list("cluster_id", flat=True)
+            .first()
+            for e in (a, b)
+        )
+        if ca is None or cb is None or ca == cb:
+            return
+
+        clusters = list(
+            EntityCluster.objects.using(using).select_for_update().filter(id__in=[ca, cb]).order_by("id")
+        )
+        if len(clusters) != 2:
+            continue  # merged concurrently, re-read
+
+        big, small = sorted(clusters, key=lambda c: (-c.size, c.id))
+        moved = EntityNode.objects.using(using).filter(cluster_id=small.id).update(cluster_id=big.id)
+        EntityCluster.objects.using(using).filter(id=big.id).update(
+            size=F("size") + moved, blocked=F("blocked") + small.blocked,
+        )
+        small.delete(using=using)
+        return
+    raise MergeConflict(f"could not merge the clusters of {a} and {b} after {_MERGE_RETRIES} attempts")
+
+
+def link(a: Entity, b: Entity, using: str = "default") -> None:
+    """
+    Record that two entities were seen together.
+    """
+    if not a[1] or not b[1] or a == b:
+        return
+    if EntityLink.objects.using(using).filter(src_type=a[0], src_id=a[1], dst_type=b[0], dst_id=b[1]).exists():
+        return
+
+    EntityLink.objects.using(using).bulk_create(
+        [
+            EntityLink(src_type=a[0], src_id=a[1], dst_type=b[0], dst_id=b[1]),
+            EntityLink(src_type=b[0], src_id=b[1], dst_type=a[0], dst_id=a[1]),
+        ],
+        ignore_conflicts=True,
+    )
+    na, nb = _node(a, using), _node(b, using)
+    if na.cluster_id != nb.cluster_id:
+        _union(a, b, using)
+
+
+def record_order(order_data: Dict[str, Any], using: str = "default") -> None:
+    link(("account", order_data.get("account_id")), ("device", order_data.get("device_id")), using=using)
+
+
+def record_purchase(purchase_data: Dict[str, Any], using: str = "default") -> None:
+    card = purchase_data.get("card_id")
+    if not card:
+        return
+    owner = (
+        Order.objects.using(using)
+        .filter(order_id=purchase_data.get("order_id"))
+        .values_list("account_id", "device_id")
+        .first()
+    )
+    if owner is None:
+        return
+    link(("card", card), ("account", owner[0]), using=using)
+    link(("card", card), ("device", owner[1]), using=using)
+
+
+def mark_blocked(entity: Entity, using: str = "default") -> None:
+    """
+    Count a newly blocklisted entity in its cluster. Entities not yet in the
+    graph pick up their blocklist state when their node is created.
+    """
+    updated = (
+        EntityNode.objects.using(using)
+        .filter(entity_type=entity[0], entity_id=entity[1], blocked=False)
+        .update(blocked=True)
+    )
+    if updated:
+        cluster_id = (
+            EntityNode.objects.using(using)
+            .filter(entity_type=entity[0], entity_id=entity[1])
+            .values_list("cluster_id", flat=True)
+            .first()
+        )
+        EntityCluster.objects.using(using).filter(id=cluster_id).update(blocked=F("blocked") + 1)
+
+
+# --------------------------
+# Rebuild
+# --------------------------
+
+def _find(parent: Dict[Entity, Entity], x: Entity) -> Entity:
+    root = x
+    while parent[root] != root:
+        root = parent[root]
+    while parent[x] != root:
+        parent[x], x = root, parent[x]
+    return root
+
+
+def rebuild_entity_links(using: str = "default", batch: int = 1000) -> Dict[str, int]:
+    """
+    Rebuild links, nodes and clusters from Order / Purchase history.
+    Run while ingestion is quiet; links recorded during the rebuild may be lost.
+    """
+    edges: Set[Tuple[Entity, Entity]] = set()
+    for account, device in Order.objects.using(using).values_list("account_id", "device_id").distinct().iterator():
+        if account and device:
+            edges.add((("account", account), ("device", device)))
+    purchases = (
+        Purchase.objects.using(using)
+        .exclude(card_id__isnull=True)
+        .values_list("card_id", "order__account_id", "order__device_id")
+        .distinct()
+    )
+    for card, account, device in purchases.iterator():
+        if not card:
+            continue
+        if account:
+            edges.add((("card", card), ("account", account)))
+        if device:
+            edges.add((("card", card), ("device", device)))
+
+    parent: Dict[Entity, Entity] = {}
+    for a, b in edges:
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        ra, rb = _find(parent, a), _find(parent, b)
+        if ra != rb:
+            parent[rb] = ra
+
+    blocked: Set[Entity] = set()
+    for entity_type, (model, column) in _BLOCKLISTS.items():
+        blocked.update((entity_type, v) for v in model.objects.using(using).values_list(column, flat=True))
+
+    # Structure: root -> member entities
+    members: Dict[Entity, List[Entity]] = {}
+    for entity in parent:
+        members.setdefault(_find(parent, entity), []).append(entity)
+
+    with transaction.atomic(using=using):
+        EntityLink.objects.using(using).all().delete()
+        EntityNode.objects.using(using).all().delete()
+        EntityCluster.objects.using(using).all().delete()
+
+        EntityLink.objects.using(using).bulk_create(
+            [
+                EntityLink(src_type=s[0], src_id=s[1], dst_type=d[0], dst_id=d[1])
+                for a, b in edges
+                for s, d in ((a, b), (b, a))
+            ],
+            batch_size=batch,
+        )
+        groups = list(members.values())
+        # bulk_create sets primary keys on PostgreSQL and SQLite 3.35+
+        clusters = EntityCluster.objects.using(using).bulk_create(
+            [EntityCluster(size=len(g), blocked=sum(1 for e in g if e in blocked)) for g in groups],
+            batch_size=batch,
+        )
+        EntityNode.objects.using(using).bulk_create(
+            [
+                EntityNode(entity_type=e[0], entity_id=e[1], cluster_id=cluster.id, blocked=e in blocked)
+                for cluster, group in zip(clusters, groups)
+                for e in group
+            ],
+            batch_size=batch,
+        )
+
+    stats = {"links": len(edges), "nodes": len(parent), "clusters": len(members)}
+    print(f"[entity_links] rebuilt: {stats}")
+    return stats
+
@@ -0,0 +1,196 @@
+# fds_django/services/lanes.py
+"""
+Priority lanes between ingestion, live detection and replay.
+
+Each outbox row belongs to a lane; the dispatcher routes each lane to its own
+Celery queue, served by its own worker pool (see docker-compose.yml):
+
+  purchase  -> "realtime"  gates payment, never throttled
+  order     -> "orders"
+  bulk      -> "bulk"      replay / backfill, shed under backpressure
+
+Backpressure: when the realtime lane lags more than
+FDS_REALTIME_LAG_SLO_SECONDS (outbox_lag_seconds: oldest READY row or oldest
+dispatched row not yet processed), sheddable lanes are neither dispatched
+nor accepted at ingestion until the realtime lane catches up.
+
+Settings:
+  - FDS_REALTIME_LAG_SLO_SECONDS: realtime lag SLO (default 5.0)
+  - FDS_LAG_CHECK_INTERVAL: seconds between lag checks per process (default 1.0)
+  - FDS_LAG_INFLIGHT_SCAN: most recent SENT rows of a lane checked for
+    in-flight events (default 2000)
+"""
+import time
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from fds_django.models import Outbox, Processed
+
+
+class Lane(NamedTuple):
+    name: str
+    queue: str
+    batch: int          # max rows dispatched per dispatcher run
+    max_queued: int     # max messages waiting in the broker queue
+    sheddable: bool     # throttled / shed while the realtime lane breaches its SLO
+
+
+# Highest priority first; dispatch order follows this tuple
+LANES: Tuple[Lane, ...] = (
+    Lane("purchase", "realtime", batch=500, max_queued=2000, sheddable=False),
+    Lane("order", "orders", batch=500, max_queued=2000, sheddable=False),
+    Lane("bulk", "bulk", batch=200, max_queued=200, sheddable=True),
+)
+LANES_BY_NAME: Dict[str, Lane] = {lane.name: lane for lane in LANES}
+
+REALTIME_LANE = "purchase"
+
+# Structure: shard_id -> (checked_at monotonic, lag seconds)
+_LAG_CACHE: Dict[str, Tuple[float, float]] = {}
+_LOCK = Lock()
+
+
+def lane_for_event(kind: str, lane: Optional[str] = None) -> str:
+    """
+    Resolve the lane of a new outbox event.
+    An explicit lane (e.g. "bulk" for backfill) wins over the default per kind.
+    """
+    if lane is not None:
+        if lane not in LANES_BY_NAME:
+            raise ValueError(f"Unsupported lane: {lane}")
+        return lane
+    return "purchase" if kind == "purchase" else "order"
+
+
+def _age(created_at) -> float:
+    if created_at is None:
+        return 0.0
+    return max(0.0, (timezone.now() - created_at).total_seconds())
+
+
+def ready_age_seconds(shard_id: str, lane: str, using: str = "default") -> float:
+    """
+    Age of the oldest READY outbox row of a lane (0.0 when empty).
+    Served by the partial index outbox_ready_lane_idx.
+    """
+    return _age(
+        Outbox.objects.using(using)
+        .filter(shard_id=shard_id, lane=lane, status=Outbox.Status.READY)
+        .order_by("id")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+
+
+def inflight_age_seconds(shard_id: str, lane: str, scan: Optional[int] = None, using: str = "default") -> float:
+    """
+    Age of the oldest dispatched (SENT) row of a lane without a Processed
+    row, i.e. still in the broker queue or on a worker (0.0 when none).
+    Only the `scan` (FDS_LAG_INFLIGHT_SCAN) most recent SENT rows are
+    checked, so the anti-join cost does not grow with history.
+    """
+    if scan is None:
+        scan = getattr(settings, "FDS_LAG_INFLIGHT_SCAN", 2000)
+    recent = (
+        Outbox.objects.using(using)
+        .filter(shard_id=shard_id, lane=lane, status=Outbox.Status.SENT)
+        .order_by("-id")
+        .values("id")[:scan]
+    )
+    processed = Processed.objects.using(using).filter(
+        shard_id=OuterRef("shard_id"),
+        event_type=OuterRef("event_type"),
+        aggregate_id=OuterRef("aggregate_id"),
+    )
+    return _age(
+        Outbox.objects.using(using)
+        .filter(id__in=recent)
+        .filter(~Exists(processed))
+        .order_by("id")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+
+
+def outbox_lag_seconds(shard_id: str, lane: str, using: str = "default") -> float:
+    """
+    How far a lane is behind: the older of its oldest READY row (waiting
+    for dispatch) and its oldest in-flight row (dispatched, not processed).
+    """
+    return max(
+        ready_age_seconds(shard_id, lane, using=using),
+        inflight_age_seconds(shard_id, lane, using=using),
+    )
+
+
+def realtime_lag_exceeded(shard_id: str = "default", using: str = "default") -> bool:
+    """
+    True while the realtime lane lag is above FDS_REALTIME_LAG_SLO_SECONDS.
+
+    The lag is re-measured at most every FDS_LAG_CHECK_INTERVAL seconds per
+    process, so ingestion does not pay a query per request.
+    """
+    slo = getattr(settings, "FDS_REALTIME_LAG_SLO_SECONDS", 5.0)
+    interval = getattr(settings, "FDS_LAG_CHECK_INTERVAL", 1.0)
+
+    now = time.monotonic()
+    with _LOCK:
+        cached = _LAG_CACHE.get(shard_id)
+    if cached is None or now - cached[0] >= interval:
+        lag = outbox_lag_seconds(shard_id, REALTIME_LANE, using=using)
+        with _LOCK:
+            _LAG_CACHE[shard_id] = (now, lag)
+    else:
+        lag = cached[1]
+    return lag > slo
+
+
+def queue_depths(queues: Iterable[str]) -> Dict[str, Optional[int]]:
+    """
+    Number of messages waiting per broker queue (None when unavailable).
+    """
+    from celery import current_app
+
+    depths: Dict[str, Optional[int]] = {q: None for q in queues}
+    try:
+        with current_app.connection_or_acquire() as conn:
+            channel = conn.default_channel
+            for q in depths:
+                try:
+                    depths[q] = channel.queue_declare(queue=q, passive=True).message_count
+                except Exception:
+                    depths[q] = 0  # queue not declared yet: nothing waiting
+    except Exception as e:
+        print(f"[lanes] queue depth unavailable: {e}")
+    return depths
+
+
+def lane_stats(shard_id: str = "default", using: str = "default") -> List[Dict[str, object]]:
+    """
+    Per-lane snapshot: broker queue depth, READY backlog, the ages of the
+    oldest READY and in-flight rows, and the lane lag (the larger age).
+    """
+    depths = queue_depths(lane.queue for lane in LANES)
+    stats: List[Dict[str, object]] = []
+    for lane in LANES:
+        ready = (
+            Outbox.objects.using(using)
+            .filter(shard_id=shard_id, lane=lane.name, status=Outbox.Status.READY)
+            .count()
+        )
+        ready_age = ready_age_seconds(shard_id, lane.name, using=using)
+        inflight_age = inflight_age_seconds(shard_id, lane.name, using=using)
+        stats.append({
+            "lane": lane.name,
+            "queue": lane.queue,
+            "queue_depth": depths[lane.queue],
+            "ready": ready,
+            "ready_age_seconds": ready_age,
+            "inflight_age_seconds": inflight_age,
+            "lag_seconds": max(ready_age, inflight_age),
+        })
+    return stats
@@ -0,0 +1,254 @@
+# fds_django/services/metrics.py
+"""
+Pipeline metrics: how far detection is behind ingestion.
+
+Counters are incremented by the dispatcher and workers and shared across
+processes through a Redis hash (FDS_METRICS_REDIS_URL, else REDIS_URL). When
+Redis is not configured they fall back to per-process memory.
+
+Gauges are computed on scrape from the outbox table:
+  - age of the oldest READY row per shard        ((shard_id, status, id) index)
+  - READY backlog per shard
+  - dead-lettered (ERROR) rows per shard
+  - SENT rows without a Processed row, over the most recent
+    FDS_METRICS_INFLIGHT_SCAN SENT rows per shard
+  - per-lane queue depth, oldest READY and in-flight row ages and lag
+    (services.lanes)
+
+render_prometheus() returns the Prometheus text exposition format.
+"""
+import os
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from fds_django.models import Outbox, Processed
+from fds_django.services.lanes import lane_stats
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+
+METRICS_KEY = "fds:metrics"
+
+# Structure: metric name -> help text (counters only)
+COUNTERS: Dict[str, str] = {
+    "fds_outbox_dispatched_total": "Outbox rows dispatched to detection workers.",
+    "fds_detection_events_total": "Outbox events handled by workers, by result status.",
+    "fds_detection_decisions_total": "Final detection decisions.",
+    "fds_detection_seconds_total": "Worker time spent in detection.",
+    "fds_outbox_to_decision_seconds_total": "Time from outbox commit to final decision, summed.",
+    "fds_detection_escalations_total": "Deadline-mode decisions made stricter by the deferred rules.",
+    "fds_detection_reads_total": "Worker alias choices for rule evaluation (replica caught up, or primary fallback reason).",
+    "fds_detection_failures_total": "Failed detection attempts, by error class and outcome (retry / dead_letter).",
+    "fds_detection_failure_seconds_total": "Worker time spent on failed detection attempts, by error class.",
+    "fds_dead_letter_replayed_total": "Dead-lettered outbox rows put back to READY.",
+}
+
+# Structure: "name{labels}" -> value (fallback when Redis is not configured)
+_LOCAL: Dict[str, float] = {}
+_LOCK = Lock()
+_CLIENT = None
+
+
+def _client():
+    global _CLIENT
+    if redis is None:
+        return None
+    if _CLIENT is None:
+        url = getattr(settings, "FDS_METRICS_REDIS_URL", None) or os.environ.get("REDIS_URL")
+        if not url:
+            return None
+        _CLIENT = redis.Redis.from_url(url)
+    return _CLIENT
+
+
+def series(name: str, **labels: object) -> str:
+    """
+    Prometheus series key, e.g. fds_outbox_dispatched_total{lane="order",shard="default"}
+    """
+    if not labels:
+        return name
+    body = ",".join(f'{k}="{labels[k]}"' for k in sorted(labels))
+    return f"{name}{{{body}}}"
+
+
+def incr_many(values: Dict[str, float]) -> None:
+    """
+    Add to several counters in one round trip. Keys come from series().
+    """
+    if not values:
+        return
+    client = _client()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.hincrbyfloat(METRICS_KEY, key, value)
+            pipe.execute()
+            return
+        except Exception as e:
+            print(f"[metrics] redis unavailable, counting locally: {e}")
+    with _LOCK:
+        for key, value in values.items():
+            _LOCAL[key] = _LOCAL.get(key, 0.0) + value
+
+
+def incr(name: str, value: float = 1.0, **labels: object) -> None:
+    incr_many({series(name, **labels): value})
+
+
+def counter_values() -> Dict[str, float]:
+    """
+    Current counter values (Redis hash merged with local fallback).
+    """
+    values: Dict[str, float] = {}
+    client = _client()
+    if client is not None:
+        try:
+            for key, value in client.hgetall(METRICS_KEY).items():
+                values[key.decode()] = float(value)
+        except Exception as e:
+            print(f"[metrics] redis unavailable: {e}")
+    with _LOCK:
+        for key, value in _LOCAL.items():
+            values[key] = values.get(key, 0.0) + value
+    return values
+
+
+# --------------------------
+# Gauges
+# --------------------------
+
+def oldest_ready_age_seconds(shard_id: str, using: str = "default") -> float:
+    """Age of the oldest READY outbox row of a shard (0.0 when empty)."""
+    oldest = (
+        Outbox.objects.using(using)
+        .filter(shard_id=shard_id, status=Outbox.Status.READY)
+        .order_by("id")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+    if oldest is None:
+        return 0.0
+    return max(0.0, (timezone.now() - oldest).total_seconds())
+
+
+def ready_count(shard_id: str, using: str = "default") -> int:
+    return Outbox.objects.using(using).filter(shard_id=shard_id, status=Outbox.Status.READY).count()
+
+
+def dead_letter_count(shard_id: str, using: str = "default") -> int:
+    return Outbox.objects.using(using).filter(shard_id=shard_id, status=Outbox.Status.ERROR).count()
+
+
+def sent_unprocessed_count(shard_id: str, scan: int, using: str = "default") -> int:
+    """
+    SENT rows with no Processed row, among the `scan` most recent SENT rows.
+    Bounded so the anti-join cost does not grow with total history.
+    """
+    recent = (
+        Outbox.objects.using(using)
+        .filter(shard_id=shard_id, status=Outbox.Status.SENT)
+        .order_by("-id")
+        .values("id")[:scan]
+    )
+    processed = Processed.objects.using(using).filter(
+        shard_id=OuterRef("shard_id"),
+        event_type=OuterRef("event_type"),
+        aggregate_id=OuterRef("aggregate_id"),
+    )
+    return (
+        Outbox.objects.using(using)
+        .filter(id__in=recent)
+        .filter(~Exists(processed))
+        .count()
+    )
+
+
+# --------------------------
+# Exposition
+# --------------------------
+
+def _name(key: str) -> str:
+    return key.split("{", 1)[0]
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "NaN" if value is None else repr(float(value))
+
+
+def render_prometheus(shards: Optional[Iterable[str]] = None, using: str = "default") -> str:
+    """
+    Render counters and gauges in the Prometheus text format (version 0.0.4).
+    """
+    if shards is None:
+        shards = getattr(settings, "FDS_SHARDS", ["default"])
+    shards = list(shards)
+    scan = getattr(settings, "FDS_METRICS_INFLIGHT_SCAN", 10000)
+
+    lines: List[str] = []
+
+    def gauge(name: str, help_text: str, samples: List[tuple]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{series(name, **labels)} {_fmt(value)}")
+
+    gauge(
+        "fds_outbox_oldest_ready_age_seconds",
+        "Age of the oldest READY outbox row.",
+        [({"shard": s}, oldest_ready_age_seconds(s, using=using)) for s in shards],
+    )
+    gauge(
+        "fds_outbox_ready",
+        "READY outbox rows waiting for dispatch.",
+        [({"shard": s}, ready_count(s, using=using)) for s in shards],
+    )
+    gauge(
+        "fds_outbox_dead_letter",
+        "Dead-lettered (ERROR) outbox rows awaiting replay.",
+        [({"shard": s}, dead_letter_count(s, using=using)) for s in shards],
+    )
+    gauge(
+        "fds_outbox_sent_unprocessed",
+        f"SENT outbox rows without a Processed row (latest {scan} SENT rows).",
+        [({"shard": s}, sent_unprocessed_count(s, scan, using=using)) for s in shards],
+    )
+
+    lanes = [(s, lane) for s in shards for lane in lane_stats(s, using=using)]
+    gauge(
+        "fds_lane_queue_depth",
+        "Messages waiting in the lane's broker queue.",
+        # queue depth is per broker queue, not per shard
+        [({"lane": lane["lane"], "queue": lane["queue"]}, lane["queue_depth"]) for s, lane in lanes if s == shards[0]],
+    )
+    gauge(
+        "fds_lane_oldest_ready_age_seconds",
+        "Age of the oldest READY outbox row per lane.",
+        [({"lane": lane["lane"], "shard": s}, lane["ready_age_seconds"]) for s, lane in lanes],
+    )
+    gauge(
+        "fds_lane_oldest_inflight_age_seconds",
+        "Age of the oldest dispatched, not yet processed outbox row per lane.",
+        [({"lane": lane["lane"], "shard": s}, lane["inflight_age_seconds"]) for s, lane in lanes],
+    )
+    gauge(
+        "fds_lane_lag_seconds",
+        "Lane lag: the larger of the oldest READY and oldest in-flight ages.",
+        [({"lane": lane["lane"], "shard": s}, lane["lag_seconds"]) for s, lane in lanes],
+    )
+
+    values = counter_values()
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for key in sorted(k for k in values if _name(k) == name):
+            lines.append(f"{key} {_fmt(values[key])}")
+
+    return "\n".join(lines) + "\n"
@@ -10,10 +10,11 @@ def filter_model_defaults(model: Type[models.Model], data: Dict[str, Any]) -> Di
     - Drops keys that don't exist as model fields
     - Ignores many-to-many and reverse relations
     - Ignores auto-created fields
+    - Accepts foreign keys by attname too (e.g. "order_id" for Purchase.order)
     """
-    field_names = {
-        f.name
-        for f in model._meta.get_fields()
-        if getattr(f, "concrete", False) and not f.many_to_many and not getattr(f, "auto_created", False)
-    }
+    field_names = set()
+    for f in model._meta.get_fields():
+        if getattr(f, "concrete", False) and not f.many_to_many and not getattr(f, "auto_created", False):
+            field_names.add(f.name)
+            field_names.add(f.attname)
     return {k: v for k, v in data.items() if k in field_names}
\ No newline at end of file
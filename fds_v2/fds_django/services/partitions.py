@@ -0,0 +1,511 @@
+# fds_django/services/partitions.py
+"""
+Time partitioning and retention for the append-mostly pipeline tables:
+outbox, Processed and DetectionLog (PostgreSQL only).
+
+Each table is range-partitioned by created_at into FDS_PARTITION_DAYS-wide
+partitions named "<table>_pYYYYMMDD", plus:
+  - "<table>_legacy": the pre-partitioning table, attached as the partition
+    for everything before the conversion (convert_to_partitioned)
+  - "<table>_default": catches rows outside every range, so ingestion
+    never fails when maintenance is late; ensure_partitions moves such
+    rows into their range partition when it creates it
+
+Maintenance (`manage.py partitions`, e.g. hourly from cron / Beat):
+  - ensure_partitions: create partitions FDS_PARTITION_PREMAKE windows ahead
+  - expire_partitions: partitions entirely older than the table's retention
+    are archived to gzip JSON lines in FDS_PARTITION_ARCHIVE_DIR, then
+    detached and dropped (or only detached, kept as standalone tables)
+Outbox partitions that still hold READY rows are never expired.
+
+Hot-path indexes stay the size of the live partitions: the dispatcher and
+lane gauges use the partial READY index, and old partitions only cost one
+index probe per lookup until they expire.
+
+Idempotency: Processed lookups span every attached partition, so a key is
+seen for the whole Processed retention, which must cover the outbox
+retention. A unique constraint on a partitioned table has to include
+created_at, so it no longer covers the key: record_processed serializes
+inserts of a key with an advisory lock instead. Until Processed is
+converted, record_processed checks the catalog on every insert (one
+lookup), so running workers switch to the locked path as soon as the
+conversion commits.
+
+Archives are read back by read_archive (e.g. replay_dead_letters --archive).
+
+Rolling back (`manage.py partitions --revert`, revert_partitioned): stop
+the workers and the dispatcher first. Each table is rebuilt as the plain
+table Django creates for the model (its original primary key, unique
+constraints and indexes), holding the rows of all attached partitions;
+the ids continue after the highest one. Partitions already expired are
+not brought back: restore detached ones by re-attaching them before the
+revert, archived ones by loading the archive (read_archive). Workers that
+saw Processed partitioned keep the advisory-lock path until restarted,
+which is also correct on the plain table.
+
+Settings:
+  - FDS_PARTITION_DAYS: partition width in days (default 1)
+  - FDS_PARTITION_PREMAKE: partitions kept ahead of now (default 7)
+  - FDS_OUTBOX_RETENTION_DAYS (default 14), FDS_PROCESSED_RETENTION_DAYS
+    (default 30), FDS_DETECTION_LOG_RETENTION_DAYS (default 90)
+  - FDS_PARTITION_ARCHIVE_DIR: archive directory (default "archive")
+"""
+import gzip
+import os
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Type
+
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from fds_core.codec import JSON_CODEC
+from fds_django.models import DetectionLog, Outbox, Processed
+
+ARCHIVE_FORMAT = 1
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Partitioned(NamedTuple):
+    model: Type[models.Model]
+    retention_setting: str
+    retention_days: int
+
+
+PARTITIONED: Tuple[Partitioned, ...] = (
+    Partitioned(Outbox, "FDS_OUTBOX_RETENTION_DAYS", 14),
+    Partitioned(Processed, "FDS_PROCESSED_RETENTION_DAYS", 30),
+    Partitioned(DetectionLog, "FDS_DETECTION_LOG_RETENTION_DAYS", 90),
+)
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[datetime]  # None: MINVALUE
+    end: Optional[datetime]    # None: MAXVALUE
+    default: bool
+
+
+def retention_days(spec: Partitioned) -> int:
+    return getattr(settings, spec.retention_setting, spec.retention_days)
+
+
+def _width() -> timedelta:
+    return timedelta(days=getattr(settings, "FDS_PARTITION_DAYS", 1))
+
+
+def window_start(ts: datetime) -> datetime:
+    """Start of the partition window holding `ts` (UTC, aligned to the epoch)."""
+    width = _width()
+    return EPOCH + ((ts - EPOCH) // width) * width
+
+
+def _literal(ts: datetime) -> str:
+    return "'" + ts.astimezone(dt_timezone.utc).isoformat() + "'"
+
+
+# --------------------------
+# Catalog
+# --------------------------
+
+# Structure: (alias, table) -> partitioned? (False is only cached off PostgreSQL)
+_IS_PARTITIONED: Dict[Tuple[str, str], bool] = {}
+
+_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def is_partitioned(model: Type[models.Model], using: str = "default") -> bool:
+    """
+    Whether the table is partitioned. On PostgreSQL only True is cached: a
+    table converted while workers run (`manage.py partitions --convert`) is
+    picked up by their next check, without a restart.
+    """
+    key = (using, model._meta.db_table)
+    if key in _IS_PARTITIONED:
+        return _IS_PARTITIONED[key]
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        _IS_PARTITIONED[key] = False
+        return False
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+            [model._meta.db_table],
+        )
+        partitioned = bool(cur.fetchone()[0])
+    if partitioned:
+        _IS_PARTITIONED[key] = True
+    return partitioned
+
+
+def _bound(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def partitions(model: Type[models.Model], using: str = "default") -> List[Partition]:
+    """Attached partitions of a table, oldest first (default partition last)."""
+    with connections[using].cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [model._meta.db_table],
+        )
+        rows = cur.fetchall()
+
+    out: List[Partition] = []
+    for name, expr in rows:
+        match = _BOUND.search(expr)
+        if match is None:
+            out.append(Partition(name, None, None, True))
+        else:
+            out.append(Partition(name, _bound(match.group(1)), _bound(match.group(2)), False))
+    return sorted(out, key=lambda p: (p.default, p.start or EPOCH.replace(year=1)))
+
+
+# --------------------------
+# Conversion (one-time)
+# --------------------------
+
+def _parent_indexes(model: Type[models.Model]) -> List[models.Index]:
+    """
+    The model's indexes for the partitioned parent: renamed ("_p") so they do
+    not clash with the legacy table's, unique constraints as plain indexes.
+    """
+    out: List[models.Index] = []
+    for index in model._meta.indexes:
+        clone = index.clone()
+        clone.name = f"{index.name[:28]}_p"
+        out.append(clone)
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields:
+            out.append(models.Index(fields=list(constraint.fields), name=f"{constraint.name[:28]}_p"))
+    return out
+
+
+def convert_to_partitioned(model: Type[models.Model], using: str = "default") -> bool:
+    """
+    Turn a table into a partitioned one in one transaction (ACCESS EXCLUSIVE
+    lock for the duration): the existing table becomes "<table>_legacy", the
+    partition for everything before the end of the current window. Its
+    primary key is replaced by the parent's (pk, created_at); integer ids
+    continue from a new sequence. Returns False if already partitioned.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        raise RuntimeError("table partitioning needs PostgreSQL")
+    if is_partitioned(model, using):
+        return False
+
+    q = connection.ops.quote_name
+    table = model._meta.db_table
+    legacy = f"{table}_legacy"
+    pk = model._meta.pk.column
+    auto_id = isinstance(model._meta.pk, models.fields.AutoFieldMixin)
+    cutover = window_start(timezone.now()) + _width()
+
+    with transaction.atomic(using=using):
+        with connection.cursor() as cur:
+            cur.execute(f"LOCK TABLE {q(table)} IN ACCESS EXCLUSIVE MODE")
+            cur.execute(f"ALTER TABLE {q(table)} RENAME TO {q(legacy)}")
+            cur.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'",
+                [legacy],
+            )
+            for (name,) in cur.fetchall():
+                cur.execute(f"ALTER TABLE {q(legacy)} DROP CONSTRAINT {q(name)}")
+
+            next_id = None
+            if auto_id:
+                cur.execute(f"SELECT COALESCE(MAX({q(pk)}), 0) + 1 FROM {q(legacy)}")
+                next_id = cur.fetchone()[0]
+                # identity columns cannot be attached as partitions before PostgreSQL 17
+                cur.execute(f"ALTER TABLE {q(legacy)} ALTER COLUMN {q(pk)} DROP IDENTITY IF EXISTS")
+                cur.execute(f"ALTER TABLE {q(legacy)} ALTER COLUMN {q(pk)} DROP DEFAULT")
+
+            cur.execute(
+                f"CREATE TABLE {q(table)} (LIKE {q(legacy)} INCLUDING DEFAULTS INCLUDING STORAGE) "
+                f"PARTITION BY RANGE (created_at)"
+            )
+            if auto_id:
+                seq = f"{table}_pid_seq"
+                cur.execute(f"CREATE SEQUENCE {q(seq)} START WITH {int(next_id)}")
+                cur.execute(f"ALTER TABLE {q(table)} ALTER COLUMN {q(pk)} SET DEFAULT nextval('{seq}')")
+                cur.execute(f"ALTER SEQUENCE {q(seq)} OWNED BY {q(table)}.{q(pk)}")
+            cur.execute(f"ALTER TABLE {q(table)} ADD PRIMARY KEY ({q(pk)}, created_at)")
+
+        with connection.schema_editor(atomic=False) as editor:
+            for index in _parent_indexes(model):
+                editor.add_index(model, index)
+
+        with connection.cursor() as cur:
+            cur.execute(
+                f"ALTER TABLE {q(table)} ATTACH PARTITION {q(legacy)} "
+                f"FOR VALUES FROM (MINVALUE) TO ({_literal(cutover)})"
+            )
+            cur.execute(f"CREATE TABLE {q(table + '_default')} PARTITION OF {q(table)} DEFAULT")
+
+    _IS_PARTITIONED[(using, table)] = True
+    print(f"[partitions] {table}: converted, legacy rows before {cutover.isoformat()}")
+    return True
+
+
+def revert_partitioned(model: Type[models.Model], using: str = "default") -> bool:
+    """
+    Undo convert_to_partitioned in one transaction (ACCESS EXCLUSIVE lock):
+    the rows of all attached partitions are copied aside, the partitioned
+    table is dropped with its partitions and recreated from the model.
+    Fails, changing nothing, if the rows break a restored unique
+    constraint. Returns False if the table is not partitioned.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        raise RuntimeError("table partitioning needs PostgreSQL")
+    if not is_partitioned(model, using):
+        return False
+
+    q = connection.ops.quote_name
+    table = model._meta.db_table
+    saved = f"{table}_revert"
+    columns = ", ".join(q(f.column) for f in model._meta.concrete_fields)
+    pk = model._meta.pk.column
+
+    with transaction.atomic(using=using):
+        with connection.cursor() as cur:
+            cur.execute(f"LOCK TABLE {q(table)} IN ACCESS EXCLUSIVE MODE")
+            cur.execute(f"CREATE TABLE {q(saved)} AS SELECT {columns} FROM {q(table)}")
+            cur.execute(f"DROP TABLE {q(table)}")
+        with connection.schema_editor(atomic=False) as editor:
+            editor.create_model(model)
+        with connection.cursor() as cur:
+            cur.execute(f"INSERT INTO {q(table)} ({columns}) SELECT {columns} FROM {q(saved)}")
+            rows = cur.rowcount
+            cur.execute(f"DROP TABLE {q(saved)}")
+            if isinstance(model._meta.pk, models.fields.AutoFieldMixin):
+                cur.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({q(pk)}), 0) + 1, false) FROM {q(table)}",
+                    [table, pk],
+                )
+
+    _IS_PARTITIONED.pop((using, table), None)
+    print(f"[partitions] {table}: reverted to a plain table, {rows} rows")
+    return True
+
+
+# --------------------------
+# Maintenance
+# --------------------------
+
+def _create_partition(model: Type[models.Model], start: datetime, end: datetime, using: str) -> str:
+    """
+    Create one range partition. Rows already in the default partition for
+    that range are moved into it (the default partition is detached while
+    the range is created, as PostgreSQL requires).
+    """
+    connection = connections[using]
+    q = connection.ops.quote_name
+    table = model._meta.db_table
+    name = f"{table}_p{start:%Y%m%d}"
+    default = f"{table}_default"
+    create = f"CREATE TABLE {q(name)} PARTITION OF {q(table)} FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+
+    with transaction.atomic(using=using), connection.cursor() as cur:
+        cur.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {q(default)} WHERE created_at >= %s AND created_at < %s)",
+            [start, end],
+        )
+        if not cur.fetchone()[0]:
+            cur.execute(create)
+            return name
+
+        cur.execute(f"ALTER TABLE {q(table)} DETACH PARTITION {q(default)}")
+        cur.execute(create)
+        cur.execute(
+            f"WITH moved AS (DELETE FROM {q(default)} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {q(table)} SELECT * FROM moved",
+            [start, end],
+        )
+        cur.execute(f"ALTER TABLE {q(table)} ATTACH PARTITION {q(default)} DEFAULT")
+    print(f"[partitions] {name}: moved rows out of {default}")
+    return name
+
+
+def ensure_partitions(model: Type[models.Model], ahead: Optional[int] = None, using: str = "default") -> List[str]:
+    """
+    Create the range partitions from the current window to `ahead` windows
+    past it (FDS_PARTITION_PREMAKE). Returns the created partition names.
+    """
+    if ahead is None:
+        ahead = getattr(settings, "FDS_PARTITION_PREMAKE", 7)
+    width = _width()
+    existing = [p for p in partitions(model, using) if not p.default]
+    covered = max((p.end for p in existing if p.end is not None), default=None)
+
+    start = window_start(timezone.now())
+    if covered is not None and covered > start:
+        start = covered
+    last = window_start(timezone.now()) + width * (ahead + 1)
+
+    created: List[str] = []
+    while start < last:
+        created.append(_create_partition(model, start, start + width, using))
+        start += width
+    return created
+
+
+def _has_ready_rows(name: str, using: str) -> bool:
+    connection = connections[using]
+    with connection.cursor() as cur:
+        cur.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {connection.ops.quote_name(name)} WHERE status = %s)",
+            [Outbox.Status.READY],
+        )
+        return bool(cur.fetchone()[0])
+
+
+def archive_partition(model: Type[models.Model], part: Partition, archive_dir: str, using: str = "default") -> str:
+    """
+    Write all rows of a partition to <archive_dir>/<partition>.jsonl.gz:
+    a header line (format, table, partition, bounds, columns), then one
+    JSON object per row. Written to a temporary file and renamed.
+    """
+    connection = connections[using]
+    # jsonb columns are fetched as text by Django's PostgreSQL backend
+    json_columns = {f.column for f in model._meta.concrete_fields if isinstance(f, models.JSONField)}
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{part.name}.jsonl.gz")
+    tmp = path + ".tmp"
+
+    header = {
+        "format": ARCHIVE_FORMAT,
+        "table": model._meta.db_table,
+        "partition": part.name,
+        "from": part.start,
+        "to": part.end,
+    }
+    rows = 0
+    with transaction.atomic(using=using):
+        cur = connection.chunked_cursor()  # server-side cursor on PostgreSQL
+        try:
+            cur.execute(f"SELECT * FROM {connection.ops.quote_name(part.name)} ORDER BY created_at")
+            columns = [c[0] for c in cur.description]
+            with gzip.open(tmp, "wb") as f:
+                f.write(JSON_CODEC.dumps({**header, "columns": columns}) + b"\n")
+                while True:
+                    batch = cur.fetchmany(2000)
+                    if not batch:
+                        break
+                    for row in batch:
+                        record = dict(zip(columns, row))
+                        for column in json_columns:
+                            if isinstance(record.get(column), str):
+                                record[column] = JSON_CODEC.loads(record[column])
+                        f.write(JSON_CODEC.dumps(record) + b"\n")
+                    rows += len(batch)
+        finally:
+            cur.close()
+    os.replace(tmp, path)
+    print(f"[partitions] {part.name}: archived {rows} rows to {path}")
+    return path
+
+
+def expire_partitions(
+    spec: Partitioned,
+    archive_dir: Optional[str] = None,
+    detach_only: bool = False,
+    dry_run: bool = False,
+    using: str = "default",
+) -> List[Dict[str, Any]]:
+    """
+    Partitions whose range ends before now - retention: archived, then
+    detached and dropped; with `detach_only`, detached and kept as
+    standalone tables. Returns what was done per partition.
+    """
+    model = spec.model
+    connection = connections[using]
+    q = connection.ops.quote_name
+    if archive_dir is None:
+        archive_dir = getattr(settings, "FDS_PARTITION_ARCHIVE_DIR", "archive")
+    cutoff = timezone.now() - timedelta(days=retention_days(spec))
+
+    done: List[Dict[str, Any]] = []
+    for part in partitions(model, using):
+        if part.default or part.end is None or part.end > cutoff:
+            continue
+        if model is Outbox and _has_ready_rows(part.name, using):
+            print(f"[partitions] {part.name}: READY rows left, not expired")
+            done.append({"partition": part.name, "action": "kept_ready_rows"})
+            continue
+        if dry_run:
+            done.append({"partition": part.name, "action": "would_expire"})
+            continue
+
+        path = None if detach_only else archive_partition(model, part, archive_dir, using)
+        with transaction.atomic(using=using), connection.cursor() as cur:
+            cur.execute(f"ALTER TABLE {q(model._meta.db_table)} DETACH PARTITION {q(part.name)}")
+            if not detach_only:
+                cur.execute(f"DROP TABLE {q(part.name)}")
+        done.append({"partition": part.name, "action": "detached" if detach_only else "archived", "path": path})
+    return done
+
+
+# --------------------------
+# Idempotency
+# --------------------------
+
+def record_processed(shard_id: str, event_type: str, aggregate_id: str, using: str = "default") -> bool:
+    """
+    Insert the Processed row of an event; False when it is already there
+    (a concurrent redelivery won). On a partitioned Processed table the
+    check and insert run under a transaction advisory lock on the key.
+    Safe inside the caller's transaction (the insert runs in a savepoint).
+    """
+    if not is_partitioned(Processed, using):
+        try:
+            with transaction.atomic(using=using):
+                Processed.objects.using(using).create(shard_id=shard_id, event_type=event_type, aggregate_id=aggregate_id)
+        except IntegrityError:
+            return False
+        return True
+
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cur:
+            cur.execute(
+                "SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))",
+                [f"processed|{shard_id}|{event_type}|{aggregate_id}"],
+            )
+        rows = Processed.objects.using(using).filter(shard_id=shard_id, event_type=event_type, aggregate_id=aggregate_id)
+        if rows.exists():
+            return False
+        rows.create(shard_id=shard_id, event_type=event_type, aggregate_id=aggregate_id)
+    return True
+
+
+# --------------------------
+# Archives
+# --------------------------
+
+def read_archive(path: str) -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]]]:
+    """
+    (header, rows) of an archive file written by archive_partition. Rows
+    are dicts of column -> value as stored (timestamps as ISO strings).
+    """
+    f = gzip.open(path, "rb")
+    header = JSON_CODEC.loads(f.readline())
+    if header.get("format") != ARCHIVE_FORMAT:
+        f.close()
+        raise ValueError(f"{path}: unsupported archive format {header.get('format')!r}")
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        with f:
+            for line in f:
+                if line.strip():
+                    yield JSON_CODEC.loads(line)
+
+    return header, rows()
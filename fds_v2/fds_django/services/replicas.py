@@ -0,0 +1,99 @@
+# fds_django/services/replicas.py
+"""
+Replica selection for detection reads.
+
+Workers evaluate rules on a read replica when one has caught up with the
+events they handle, so detection load stays off the primary that takes
+ingestion writes. Writes, Processed and the blocklists stay on the primary
+(fds_django.db_router.ReplicaRouter).
+
+Lag check (PostgreSQL streaming replication): outbox rows reach a worker
+only after they committed, so the primary's current WAL position read by
+the worker (pg_current_wal_lsn) is at or past their commit. A replica whose
+replay position (pg_last_wal_replay_lsn) has reached it sees those rows, and
+the velocity / entity link state written with them. Otherwise the case is
+evaluated on the primary. Aliases on other vendors are not lag-checked
+(local testing).
+
+Settings:
+  - FDS_REPLICA_ALIASES: DATABASES aliases of read replicas
+    (default: (), every read on the primary)
+  - FDS_REPLICA_WAIT_MS: how long to wait for a lagging replica before
+    falling back to the primary (default 0)
+"""
+import itertools
+import time
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import connections
+
+from fds_django.services import metrics
+
+_POLL_SECONDS = 0.005
+_NEXT = itertools.count()
+
+
+def replica_aliases() -> List[str]:
+    return [a for a in getattr(settings, "FDS_REPLICA_ALIASES", ()) if a in connections.databases]
+
+
+def primary_lsn(using: str = "default") -> Optional[str]:
+    """
+    Current WAL position of the primary (None when not PostgreSQL).
+    """
+    if connections[using].vendor != "postgresql":
+        return None
+    with connections[using].cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        return cur.fetchone()[0]
+
+
+def replica_caught_up(alias: str, lsn: Optional[str]) -> bool:
+    """
+    True when the replica has replayed the primary's WAL up to `lsn`.
+    A replica that is not in recovery (pg_last_wal_replay_lsn() is NULL)
+    cannot be checked and counts as lagging.
+    """
+    if lsn is None or connections[alias].vendor != "postgresql":
+        return True
+    with connections[alias].cursor() as cur:
+        cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", [lsn])
+        return bool(cur.fetchone()[0])
+
+
+def detection_alias(using: str = "default") -> str:
+    """
+    Alias to evaluate rules on for events already committed on `using`:
+    the first caught-up replica (round robin), else `using`.
+    """
+    aliases = replica_aliases()
+    if not aliases:
+        return using
+
+    start = next(_NEXT) % len(aliases)
+    ordered = aliases[start:] + aliases[:start]
+    reason = "lagging"
+    try:
+        lsn = primary_lsn(using)
+    except Exception as e:
+        print(f"[replicas] primary WAL position unavailable: {e}")
+        lsn, reason = None, "error"
+
+    if reason != "error":
+        deadline = time.monotonic() + getattr(settings, "FDS_REPLICA_WAIT_MS", 0) / 1000.0
+        while True:
+            for alias in ordered:
+                try:
+                    if replica_caught_up(alias, lsn):
+                        metrics.incr("fds_detection_reads_total", alias=alias, reason="caught_up")
+                        return alias
+                except Exception as e:
+                    print(f"[replicas] skip {alias}: {e}")
+                    reason = "error"
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(_POLL_SECONDS)
+
+    metrics.incr("fds_detection_reads_total", alias=using, reason=reason)
+    return using
@@ -0,0 +1,137 @@
+# fds_django/services/rule_stats.py
+"""
+Rule effectiveness rollup maintenance (query side: fds_core.rule_stats).
+
+  - record_detection: count one final decision, called by
+    side_effects.log_decision inside the DetectionLog transaction
+  - rebuild_rule_stats: recompute the rollups from DetectionLog
+
+Both paths share stat_rows, so a rebuild reproduces the incremental counts
+(logs written before evaluated rules were logged only count their hits as
+evaluations).
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import connections, transaction
+
+from fds_core.rule_stats import COUNTS, hour_start
+from fds_django.models import DetectionLog, RuleStatHour
+
+# Multi-row: one statement per detection, whatever the rule count ({values})
+_UPSERT_SQL = """
+    INSERT INTO fds_django_rulestathour
+        (rule_id, case_kind, hour_start, evaluations, hits, block_decisions, review_decisions, sole_hits)
+    VALUES {values}
+    ON CONFLICT (rule_id, case_kind, hour_start)
+    DO UPDATE SET
+        evaluations = fds_django_rulestathour.evaluations + EXCLUDED.evaluations,
+        hits = fds_django_rulestathour.hits + EXCLUDED.hits,
+        block_decisions = fds_django_rulestathour.block_decisions + EXCLUDED.block_decisions,
+        review_decisions = fds_django_rulestathour.review_decisions + EXCLUDED.review_decisions,
+        sole_hits = fds_django_rulestathour.sole_hits + EXCLUDED.sole_hits
+"""
+
+def _decision(value: Any) -> str:
+    # "block", Decision.BLOCK and legacy "Decision.BLOCK" log values
+    return str(getattr(value, "value", value)).split(".")[-1].lower()
+
+
+def _field(hit: Any, name: str) -> Any:
+    return hit[name] if isinstance(hit, dict) else getattr(hit, name)
+
+
+def stat_rows(decision: Any, hits: Iterable[Any], evaluated: Iterable[str]) -> Dict[str, List[int]]:
+    """
+    Counts of one detection per rule_id, in COUNTS order.
+    `hits` are Hit objects or their logged dicts.
+    """
+    final = _decision(decision)
+    hit_decisions = {str(_field(h, "rule_id")): _decision(_field(h, "decision")) for h in hits}
+    deciding = [rid for rid, d in hit_decisions.items() if d == final]
+
+    rows: Dict[str, List[int]] = {}
+    for rule_id in set(map(str, evaluated)) | set(hit_decisions):
+        hit = rule_id in hit_decisions
+        rows[rule_id] = [
+            1,
+            int(hit),
+            int(hit and final == "block"),
+            int(hit and final == "review"),
+            int(hit and final != "allow" and deciding == [rule_id]),
+        ]
+    return rows
+
+
+def record_detection(
+    kind: str,
+    decision: Any,
+    hits: Iterable[Any],
+    evaluated: Iterable[str],
+    ts: Optional[float] = None,
+    using: str = "default",
+) -> None:
+    """
+    Add one final decision to the hourly rollups: a single upsert with one
+    row per rule, in rule_id order so concurrent workers lock rows in the
+    same order.
+    """
+    hour = hour_start(time.time() if ts is None else ts)
+    rows = sorted(stat_rows(decision, hits, evaluated).items())
+    if not rows:
+        return
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+    args = [v for rule_id, counts in rows for v in (rule_id, kind, hour, *counts)]
+    with connections[using].cursor() as cur:
+        cur.execute(_UPSERT_SQL.format(values=values), args)
+
+
+def rebuild_rule_stats(since: Optional[float] = None, using: str = "default", batch: int = 1000) -> Dict[str, int]:
+    """
+    Recompute the rollups from final decisions in DetectionLog, for the
+    hours from `since` (epoch seconds) on, or for all retained history:
+    rollups older than the oldest log (expired partitions,
+    services.partitions) are kept, and nothing changes when no log is left.
+    Run while detection is quiet; decisions logged meanwhile may be lost.
+    """
+    logs = DetectionLog.objects.using(using).only("case_kind", "decision", "extra", "created_at")
+    rollups = RuleStatHour.objects.using(using)
+    if since is None:
+        oldest = logs.order_by("created_at").values_list("created_at", flat=True).first()
+        if oldest is None:
+            print("[rule_stats] no detection logs: rollups kept")
+            return {"detections": 0, "rows": 0}
+        since = oldest.timestamp()
+    since = hour_start(since)
+    logs = logs.filter(created_at__gte=datetime.fromtimestamp(since, tz=dt_timezone.utc))
+    rollups = rollups.filter(hour_start__gte=since)
+
+    # Structure: (rule_id, case_kind, hour_start) -> counts in COUNTS order
+    totals: Dict[tuple, List[int]] = {}
+    scanned = 0
+    for log in logs.iterator(chunk_size=batch):
+        extra = log.extra or {}
+        if extra.get("stage", "final") != "final":
+            continue
+        scanned += 1
+        hour = hour_start(log.created_at.timestamp())
+        for rule_id, counts in stat_rows(log.decision, extra.get("hits", []), extra.get("evaluated_rules", [])).items():
+            key = (rule_id, log.case_kind, hour)
+            current = totals.setdefault(key, [0] * len(COUNTS))
+            for i, n in enumerate(counts):
+                current[i] += n
+
+    with transaction.atomic(using=using):
+        rollups.delete()
+        RuleStatHour.objects.using(using).bulk_create(
+            [
+                RuleStatHour(rule_id=k[0], case_kind=k[1], hour_start=k[2], **dict(zip(COUNTS, counts)))
+                for k, counts in totals.items()
+            ],
+            batch_size=batch,
+        )
+
+    stats = {"detections": scanned, "rows": len(totals)}
+    print(f"[rule_stats] rebuilt: {stats}")
+    return stats
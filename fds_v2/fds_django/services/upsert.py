@@ -4,6 +4,7 @@ from django.db import transaction
 
 from fds_django.models import Order, OrderItem, Purchase
 from fds_django.services.model_utils import filter_model_defaults
+from fds_django.services import entity_links, velocity
 
 
 def upsert_order_sync(data: Dict[str, Any]) -> None:
@@ -16,10 +17,12 @@ def upsert_order_sync(data: Dict[str, Any]) -> None:
     items_data = data.get("items", [])
 
     with transaction.atomic(using=using):
-        order_obj, _ = Order.objects.using(using).update_or_create(
+        order_obj, created = Order.objects.using(using).update_or_create(
             order_id=data["order_id"],
             defaults=order_defaults,
         )
+        velocity.record_order(data, created, using=using)
+        entity_links.record_order(data, using=using)
 
         # Replace all items
         OrderItem.objects.using(using).filter(order=order_obj).delete()
@@ -46,7 +49,15 @@ def upsert_purchase_sync(data: Dict[str, Any]) -> None:
     purchase_defaults = filter_model_defaults(Purchase, data)
 
     with transaction.atomic(using=using):
-        Purchase.objects.using(using).update_or_create(
+        previous_status = (
+            Purchase.objects.using(using)
+            .filter(purchase_id=data["purchase_id"])
+            .values_list("payment_status", flat=True)
+            .first()
+        )
+        _, created = Purchase.objects.using(using).update_or_create(
             purchase_id=data["purchase_id"],
             defaults=purchase_defaults,
         )
+        velocity.record_purchase(data, previous_status, created, using=using)
+        entity_links.record_purchase(data, using=using)
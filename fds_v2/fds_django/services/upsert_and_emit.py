@@ -1,32 +1,43 @@
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Optional
 from django.db import transaction
 
+from fds_core import tracing
 from fds_django.models import Order, OrderItem, Purchase, Outbox
 from fds_django.services.payload import minimal_order_payload, minimal_purchase_payload
 from fds_django.services.model_utils import filter_model_defaults
+from fds_django.services import entity_links, velocity
+from fds_django.services.lanes import lane_for_event
 
 
-def upsert_order_and_emit(order_data: Dict[str, Any], shard_id: str = "default") -> None:
+def upsert_order_and_emit(order_data: Dict[str, Any], shard_id: str = "default", lane: Optional[str] = None) -> None:
     """
     Ingest an order snapshot in an idempotent way and emit an outbox event.
 
     One transaction performs:
-      1. Upsert the Order (update_or_create)
+      1. Upsert the Order (update_or_create), counting new orders in the
+         velocity buckets and linking account / device
       2. Replace all OrderItems for that Order (full snapshot overwrite)
-      3. Insert an Outbox event in READY state
+      3. Insert an Outbox event in READY state, with the event's trace
+         context when sampled (fds_core.tracing)
+
+    `lane` overrides the priority lane (e.g. "bulk" for backfill).
     """
     using = "default"  # Later: route shard_id -> DB alias
 
     # Extract only model-backed fields for the Order table
     order_defaults = filter_model_defaults(Order, order_data)
     items_data = order_data.get("items", [])
+    trace = tracing.new_context("order_upserted", order_data["order_id"])
 
     with transaction.atomic(using=using):
         # 1. Upsert Order
-        order_obj, _ = Order.objects.using(using).update_or_create(
+        order_obj, created = Order.objects.using(using).update_or_create(
             order_id=order_data["order_id"],
             defaults=order_defaults,
         )
+        velocity.record_order(order_data, created, using=using)
+        entity_links.record_order(order_data, using=using)
 
         # 2. Replace OrderItems (snapshot overwrite)
         OrderItem.objects.using(using).filter(order=order_obj).delete()
@@ -46,35 +57,56 @@ def upsert_order_and_emit(order_data: Dict[str, Any], shard_id: str = "default")
         # 3. Outbox event
         Outbox.objects.using(using).create(
             shard_id=shard_id,
+            lane=lane_for_event("order", lane),
             event_type="order_upserted",
             aggregate_id=order_data["order_id"],
             payload=minimal_order_payload(order_data),
             status="READY",
+            trace=trace,
         )
+    if trace is not None:
+        tracing.record(trace, "ingest", trace["started"], time.time())
 
 
-def upsert_purchase_and_emit(purchase_data: Dict[str, Any], shard_id: str = "default") -> None:
+def upsert_purchase_and_emit(purchase_data: Dict[str, Any], shard_id: str = "default", lane: Optional[str] = None) -> None:
     """
     Ingest a purchase snapshot idempotently and emit an outbox event.
 
     Steps inside a single transaction:
-      1. Upsert the Purchase row
-      2. Insert outbox event for downstream asynchronous detection
+      1. Upsert the Purchase row, counting new / newly failed purchases in
+         the velocity buckets and linking the card to the order's entities
+      2. Insert outbox event for downstream asynchronous detection, with
+         the event's trace context when sampled (fds_core.tracing)
+
+    `lane` overrides the priority lane (e.g. "bulk" for backfill).
     """
     using = "default"
 
     purchase_defaults = filter_model_defaults(Purchase, purchase_data)
+    trace = tracing.new_context("purchase_upserted", purchase_data["purchase_id"])
 
     with transaction.atomic(using=using):
-        Purchase.objects.using(using).update_or_create(
+        previous_status = (
+            Purchase.objects.using(using)
+            .filter(purchase_id=purchase_data["purchase_id"])
+            .values_list("payment_status", flat=True)
+            .first()
+        )
+        _, created = Purchase.objects.using(using).update_or_create(
             purchase_id=purchase_data["purchase_id"],
             defaults=purchase_defaults,
         )
+        velocity.record_purchase(purchase_data, previous_status, created, using=using)
+        entity_links.record_purchase(purchase_data, using=using)
 
         Outbox.objects.using(using).create(
             shard_id=shard_id,
+            lane=lane_for_event("purchase", lane),
             event_type="purchase_upserted",
             aggregate_id=purchase_data["purchase_id"],
             payload=minimal_purchase_payload(purchase_data),
             status="READY",
-        )
\ No newline at end of file
+            trace=trace,
+        )
+    if trace is not None:
+        tracing.record(trace, "ingest", trace["started"], time.time())
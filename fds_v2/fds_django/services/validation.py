@@ -0,0 +1,55 @@
+# fds_django/services/validation.py
+from typing import Dict, Any, Type
+
+import pydantic
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils import html
+
+from fds_core.schemas import DetectOrderSchema, DetectPurchaseSchema, drf_errors
+from fds_django.serializers import DetectOrderSerializer, DetectPurchaseSerializer
+
+# Set FDS_FAST_VALIDATION = False to validate with the DRF serializers only
+FAST_VALIDATION: bool = getattr(settings, "FDS_FAST_VALIDATION", True)
+
+
+def _validate(
+    schema: Type[pydantic.BaseModel],
+    serializer_class: Type[serializers.Serializer],
+    data: Any,
+) -> Dict[str, Any]:
+    """
+    Validate request data with the fast-path schema.
+
+    - Returns the same validated data as serializer.validated_data
+    - Raises rest_framework ValidationError with the same detail as
+      serializer.is_valid(raise_exception=True)
+    - Falls back to the DRF serializer (reference implementation) for
+      form-encoded input or when FDS_FAST_VALIDATION is disabled
+    """
+    if not FAST_VALIDATION or html.is_html_input(data):
+        s = serializer_class(data=data)
+        s.is_valid(raise_exception=True)
+        return s.validated_data
+
+    try:
+        return schema.model_validate(data).validated_data()
+    except pydantic.ValidationError as e:
+        as_dict = getattr(api_settings, "LIST_SERIALIZER_ERRORS_AS_DICT", False)
+        raise ValidationError(drf_errors(e, data, list_errors_as_dict=as_dict))
+
+
+def validate_order(data: Any) -> Dict[str, Any]:
+    """
+    Validate an order payload (DetectOrderSerializer rules).
+    """
+    return _validate(DetectOrderSchema, DetectOrderSerializer, data)
+
+
+def validate_purchase(data: Any) -> Dict[str, Any]:
+    """
+    Validate a purchase payload (DetectPurchaseSerializer rules).
+    """
+    return _validate(DetectPurchaseSchema, DetectPurchaseSerializer, data)
@@ -0,0 +1,185 @@
+# fds_django/services/velocity.py
+"""
+Velocity bucket maintenance (window definitions: fds_core.velocity).
+
+  - record_order / record_purchase: increment buckets at ingestion, inside
+    the upsert transaction, so counts commit together with the snapshot
+  - rebuild_velocity: recompute buckets from Order / Purchase history,
+    e.g. after a window with a new bucket size is defined
+  - purge_velocity: drop buckets older than every window using them
+
+Counting is idempotent per snapshot: an order or purchase is counted when it
+is first created, and "purchase_fail" when payment_status changes into a
+failed status, so re-ingesting the same snapshot does not inflate counts.
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from fds_core.velocity import (
+    FAILED_PAYMENT_STATUSES,
+    METRIC_ENTITIES,
+    bucket_sizes,
+    bucket_start,
+    get_windows,
+)
+from fds_django.models import Order, Purchase, VelocityBucket
+
+# Structure: (metric, entity) -> (model, entity column, timestamp column)
+_SOURCES: Dict[Tuple[str, str], Tuple[Any, str, str]] = {
+    ("order", "account"): (Order, "account_id", "created_at"),
+    ("order", "device"): (Order, "device_id", "created_at"),
+    ("purchase", "card"): (Purchase, "card_id", "created_at"),
+    ("purchase", "bin"): (Purchase, "bin", "created_at"),
+    # last status change is not stored; updated_at approximates the failure time
+    ("purchase_fail", "card"): (Purchase, "card_id", "updated_at"),
+    ("purchase_fail", "bin"): (Purchase, "bin", "updated_at"),
+}
+
+_UPSERT_SQL = """
+    INSERT INTO fds_django_velocitybucket
+        (metric, entity_type, entity_id, bucket_seconds, bucket_start, count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (metric, entity_type, entity_id, bucket_seconds, bucket_start)
+    DO UPDATE SET count = fds_django_velocitybucket.count + EXCLUDED.count
+"""
+
+
+def record_event(metric: str, entities: Dict[str, Optional[str]], ts: Optional[float] = None, using: str = "default") -> None:
+    """
+    Count one event of `metric` for each non-empty entity, in every bucket
+    size maintained for it.
+    """
+    ts = time.time() if ts is None else ts
+    rows = [
+        (metric, entity, entity_id, size, bucket_start(ts, size), 1)
+        for entity, entity_id in entities.items()
+        if entity_id
+        for size in bucket_sizes(metric, entity)
+    ]
+    if not rows:
+        return
+    with connections[using].cursor() as cur:
+        cur.executemany(_UPSERT_SQL, rows)
+
+
+def record_order(order_data: Dict[str, Any], created: bool, using: str = "default") -> None:
+    if created:
+        record_event(
+            "order",
+            {"account": order_data.get("account_id"), "device": order_data.get("device_id")},
+            using=using,
+        )
+
+
+def record_purchase(purchase_data: Dict[str, Any], previous_status: Optional[str], created: bool, using: str = "default") -> None:
+    entities = {"card": purchase_data.get("card_id"), "bin": purchase_data.get("bin")}
+    if created:
+        record_event("purchase", entities, using=using)
+
+    status = purchase_data.get("payment_status")
+    if status in FAILED_PAYMENT_STATUSES and previous_status not in FAILED_PAYMENT_STATUSES:
+        record_event("purchase_fail", entities, using=using)
+
+
+# --------------------------
+# Rebuild / purge
+# --------------------------
+
+def _spans() -> Dict[Tuple[str, str, int], int]:
+    """
+    Structure: (metric, entity, bucket_seconds) -> longest window span using it
+    """
+    spans: Dict[Tuple[str, str, int], int] = {}
+    for w in get_windows().values():
+        key = (w.metric, w.entity, w.bucket_seconds)
+        spans[key] = max(spans.get(key, 0), w.seconds)
+    return spans
+
+
+def rebuild_velocity(window_names: Optional[Iterable[str]] = None, using: str = "default", batch: int = 1000) -> Dict[str, int]:
+    """
+    Recompute buckets from history for the given windows (default: all).
+
+    Every bucket size of the affected (metric, entity) pairs is rebuilt, over
+    the longest span that uses it; older history is not read. Run it while
+    ingestion is quiet: events ingested during the rebuild may be counted twice.
+
+    Returns {"<metric>:<entity>:<bucket_seconds>": buckets written}.
+    """
+    windows = get_windows()
+    names = list(windows) if window_names is None else list(window_names)
+    unknown = [n for n in names if n not in windows]
+    if unknown:
+        raise ValueError(f"Unknown velocity window: {', '.join(unknown)}")
+
+    pairs = {(windows[n].metric, windows[n].entity) for n in names}
+    spans = _spans()
+    now = time.time()
+    written: Dict[str, int] = {}
+
+    with transaction.atomic(using=using):
+        for metric, entity in sorted(pairs):
+            model, column, ts_column = _SOURCES[(metric, entity)]
+            sizes = {size: span for (m, e, size), span in spans.items() if (m, e) == (metric, entity)}
+            since = timezone.now() - timedelta(seconds=max(sizes.values()) + max(sizes))
+
+            qs = model.objects.using(using).filter(**{f"{ts_column}__gte": since}).exclude(**{f"{column}__isnull": True})
+            if metric == "purchase_fail":
+                qs = qs.filter(payment_status__in=FAILED_PAYMENT_STATUSES)
+
+            counts: Counter = Counter()
+            for entity_id, ts in qs.values_list(column, ts_column).iterator():
+                if not entity_id:
+                    continue
+                epoch = ts.timestamp()
+                for size, span in sizes.items():
+                    if epoch >= now - span - size:
+                        counts[(entity_id, size, bucket_start(epoch, size))] += 1
+
+            VelocityBucket.objects.using(using).filter(
+                metric=metric, entity_type=entity, bucket_seconds__in=list(sizes)
+            ).delete()
+            VelocityBucket.objects.using(using).bulk_create(
+                [
+                    VelocityBucket(
+                        metric=metric,
+                        entity_type=entity,
+                        entity_id=entity_id,
+                        bucket_seconds=size,
+                        bucket_start=start,
+                        count=n,
+                    )
+                    for (entity_id, size, start), n in counts.items()
+                ],
+                batch_size=batch,
+            )
+            for size in sizes:
+                written[f"{metric}:{entity}:{size}"] = sum(1 for key in counts if key[1] == size)
+
+    print(f"[velocity] rebuilt {len(written)} bucket series: {written}")
+    return written
+
+
+def purge_velocity(using: str = "default") -> int:
+    """
+    Delete buckets no window can read anymore: older than the longest span
+    using their bucket size, or of a bucket size no window uses.
+    """
+    spans = _spans()
+    now = time.time()
+    deleted = 0
+    for metric, entities in METRIC_ENTITIES.items():
+        for entity in entities:
+            sizes = {size: span for (m, e, size), span in spans.items() if (m, e) == (metric, entity)}
+            qs = VelocityBucket.objects.using(using).filter(metric=metric, entity_type=entity)
+            deleted += qs.exclude(bucket_seconds__in=list(sizes)).delete()[0]
+            for size, span in sizes.items():
+                cutoff = bucket_start(now, size) - span
+                deleted += qs.filter(bucket_seconds=size, bucket_start__lt=cutoff).delete()[0]
+    return deleted
+
@@ -1,12 +1,25 @@
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional
 
 from celery import shared_task
-from django.db import transaction
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
 
+from fds_core import tracing
 from fds_core.enums import CaseKind
 from fds_core.models import CaseParams, EntityRefs
 from fds_core.detector import detect_case
+from fds_core.replica import reading_from
+from fds_core.rule_cache import ensure_rules_loaded
 from fds_django.models import Outbox, Processed, UserBlock, DeviceBlock, CardBlock
+from fds_django.services import metrics
+from fds_django.services.dead_letter import classify, find_outbox_id, record_failure
+from fds_django.services.detection import complete_deferred_detection
+from fds_django.services.lanes import LANES, Lane, queue_depths, realtime_lag_exceeded
+from fds_django.services.partitions import record_processed
+from fds_django.services.replicas import detection_alias
 
 
 def _build_case_params_from_payload(payload: Dict[str, Any]) -> CaseParams:
@@ -20,7 +33,7 @@ def _build_case_params_from_payload(payload: Dict[str, Any]) -> CaseParams:
         case_id = payload["purchase_id"]
 
     refs = EntityRefs(
-        user=payload.get("user_id") or None,
+        user=payload.get("user_id") or payload.get("account_id") or None,
         device=payload.get("device_id") or None,
         card=payload.get("card_id") or None,
     )
@@ -41,73 +54,343 @@ def _apply_blocklist_transactionally(acc, using: str) -> None:
             CardBlock.objects.using(using).get_or_create(card_id=rp.card)
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
-def detect_case_task(self, event_type: str, shard_id: str, aggregate_id: str, payload: Dict[str, Any]):
+def _process_event(
+    event_type: str,
+    shard_id: str,
+    aggregate_id: str,
+    payload: Dict[str, Any],
+    using: str,
+    trace: Optional[Dict[str, Any]] = None,
+    dispatched_at: Optional[float] = None,
+) -> Dict[str, Any]:
     """
-    Worker task:
+    Detection for one outbox event:
     1) idempotency guard via Processed table
     2) run core detection
     3) apply blocklist side effects
     4) mark as processed
+    Steps 2-4 run in one transaction on `using`.
+
+    A sampled event's trace (fds_core.tracing) gets its queue span, the
+    worker stage spans and is closed with the end_to_end span.
+    """
+    if trace is not None and dispatched_at is not None:
+        tracing.record(trace, "queue", dispatched_at, time.time())
+
+    with tracing.active(trace):
+        # 1) Idempotency guard
+        with tracing.span("processed_check"):
+            seen = Processed.objects.using(using).filter(
+                shard_id=shard_id,
+                event_type=event_type,
+                aggregate_id=aggregate_id,
+            ).exists()
+        if seen:
+            return {"status": "skipped"}
+
+        # Rules load (and are EXPLAINed) lazily on first use: do it before the
+        # event's transaction, so the load neither runs nor rolls back with it
+        ensure_rules_loaded()
+
+        # 2)-4) in one transaction: the decision log, its rule rollups and
+        # the blocklist writes commit only with the Processed row, so a
+        # redelivery that loses the Processed race (or a failure before it)
+        # rolls them back instead of counting the decision twice
+        with transaction.atomic(using=using):
+            # 2) Detection (deferred events finish a deadline-mode detection)
+            params = _build_case_params_from_payload(payload)
+            started = time.perf_counter()
+            if payload.get("deferred"):
+                acc = complete_deferred_detection(params, payload, using=using)
+            else:
+                acc = detect_case(params.kind, params)
+            elapsed = time.perf_counter() - started
+
+            # 3) Blocklist side effects
+            with tracing.span("blocklist"):
+                _apply_blocklist_transactionally(acc, using=using)
+
+            # 4) Mark as processed (idempotent at DB level, services.partitions:
+            #    a concurrent redelivery of the same event loses here)
+            with tracing.span("processed_mark"):
+                if not record_processed(shard_id, event_type, aggregate_id, using=using):
+                    transaction.set_rollback(True, using=using)
+                    return {"status": "skipped"}
+
+    if trace is not None:
+        tracing.record(trace, "end_to_end", trace["started"], time.time())
+    return {"status": "done", "decision": acc.decision, "kind": params.kind.value, "seconds": elapsed}
+
+
+def _tally(counts: Dict[str, float], shard_id: str, event_type: str, result: Dict[str, Any]) -> None:
+    """Accumulate worker counters for one event (flushed with metrics.incr_many)."""
+    def add(key: str, value: float = 1.0) -> None:
+        counts[key] = counts.get(key, 0.0) + value
+
+    add(metrics.series("fds_detection_events_total", shard=shard_id, event_type=event_type, status=result["status"]))
+    if result["status"] == "done":
+        decision = getattr(result["decision"], "value", result["decision"])
+        add(metrics.series("fds_detection_decisions_total", kind=result["kind"], decision=decision))
+        add(metrics.series("fds_detection_seconds_total", kind=result["kind"]), result["seconds"])
+
+
+def _backoff(retries: int) -> int:
+    """Retry delay in seconds: exponential with full jitter, capped (as retry_backoff=True)."""
+    return get_exponential_backoff_interval(factor=1, retries=retries, maximum=600, full_jitter=True)
+
+
+def _retries_left(task) -> bool:
+    return task.request.retries < task.max_retries
+
+
+def _fail_event(task, exc: Exception, outbox_ids: List[int], started: float, using: str) -> str:
+    """
+    Handle one failed event (services.dead_letter): "retry" for retryable
+    errors with retries left, else "dead_letter" once the row is
+    dead-lettered. "retry" too when the row could not be dead-lettered but
+    the task can still retry; with no retries left that re-raises.
+    """
+    _, retryable = classify(exc)
+    attempt = task.request.retries + 1
+    seconds = time.perf_counter() - started
+    if retryable and _retries_left(task):
+        record_failure(outbox_ids, exc, attempt, dead=False, seconds=seconds, using=using)
+        return "retry"
+    if record_failure(outbox_ids, exc, attempt, dead=True, seconds=seconds, using=using):
+        return "dead_letter"
+    if _retries_left(task):
+        return "retry"
+    raise exc
+
+
+@shared_task(bind=True, max_retries=5)
+def detect_case_task(
+    self,
+    event_type: str,
+    shard_id: str,
+    aggregate_id: str,
+    payload: Dict[str, Any],
+    trace: Optional[Dict[str, Any]] = None,
+    outbox_id: Optional[int] = None,
+    created_at: Optional[float] = None,
+):
+    """
+    Worker task (payload mode): the message carries the full outbox payload,
+    the outbox row id and creation time (epoch seconds), and the trace
+    context of sampled events (with the dispatch time).
+
+    Retryable failures are retried with backoff; permanent ones dead-letter
+    the outbox row (services.dead_letter).
     """
     using = "default"  # map shard_id to DB alias here if needed
+    dispatched_at = trace.get("dispatched_at") if trace else None
+    started = time.perf_counter()
+    try:
+        with reading_from(detection_alias(using)):
+            result = _process_event(event_type, shard_id, aggregate_id, payload, using, trace, dispatched_at)
+    except Exception as exc:
+        if outbox_id is None:  # messages dispatched before outbox ids were sent
+            try:
+                outbox_id = find_outbox_id(shard_id, event_type, aggregate_id, using=using)
+            except DatabaseError:
+                pass
+        status = _fail_event(self, exc, [outbox_id] if outbox_id else [], started, using)
+        metrics.incr("fds_detection_events_total", shard=shard_id, event_type=event_type, status=status)
+        if status == "retry":
+            raise self.retry(exc=exc, countdown=_backoff(self.request.retries))
+        return {"status": status}
+
+    counts: Dict[str, float] = {}
+    _tally(counts, shard_id, event_type, result)
+    if result["status"] == "done":
+        if created_at is None and outbox_id is not None:  # messages sent without created_at
+            row_created = Outbox.objects.using(using).filter(id=outbox_id).values_list("created_at", flat=True).first()
+            created_at = row_created.timestamp() if row_created is not None else None
+        if created_at is not None:
+            key = metrics.series("fds_outbox_to_decision_seconds_total", shard=shard_id)
+            counts[key] = max(0.0, time.time() - created_at)
+    metrics.incr_many(counts)
+    return {"status": result["status"], "decision": result.get("decision")}
 
-    # 1) Idempotency guard
-    if Processed.objects.using(using).filter(
-        shard_id=shard_id,
-        event_type=event_type,
-        aggregate_id=aggregate_id,
-    ).exists():
-        return {"status": "skipped"}
-
-    # 2) Detection
-    params = _build_case_params_from_payload(payload)
-    acc = detect_case(params.kind, params)
-
-    # 3) Blocklist side effects
-    _apply_blocklist_transactionally(acc, using=using)
-
-    # 4) Mark as processed (UNIQUE constraint enforces idempotency at DB level)
-    Processed.objects.using(using).create(
-        shard_id=shard_id,
-        event_type=event_type,
-        aggregate_id=aggregate_id,
+
+@shared_task(bind=True, max_retries=5)
+def detect_outbox_chunk_task(self, shard_id: str, outbox_ids: List[int], dispatched_at: Optional[float] = None):
+    """
+    Worker task (claim-check mode): the message carries only outbox ids
+    (and the dispatch time, for the queue span of traced rows).
+
+    Payloads are loaded from the outbox table in one query. Rules are
+    evaluated on a caught-up replica when one is configured
+    (services.replicas), checked once per chunk.
+
+    Failures are isolated per event (services.dead_letter): a permanent
+    failure dead-letters its row and the chunk goes on; events with
+    retryable failures are retried together, with backoff, as a smaller
+    chunk. Events already recorded in Processed are skipped on retry.
+    """
+    using = "default"  # map shard_id to DB alias here if needed
+
+    rows = (
+        Outbox.objects.using(using)
+        .filter(id__in=outbox_ids)
+        .only("id", "shard_id", "event_type", "aggregate_id", "payload", "trace", "created_at")
+        .order_by("id")
     )
-    return {"status": "done", "decision": acc.decision}
+
+    counts: Dict[str, int] = {"done": 0, "skipped": 0, "missing": 0, "retry": 0, "dead_letter": 0}
+    tally: Dict[str, float] = {}
+    found = 0
+    # Structure: outbox ids to retry, with the last retryable error
+    failed: List[int] = []
+    last_exc: Optional[Exception] = None
+    rows = list(rows)
+    with reading_from(detection_alias(using) if rows else using):
+        for row in rows:
+            found += 1
+            started = time.perf_counter()
+            try:
+                result = _process_event(
+                    row.event_type, row.shard_id, row.aggregate_id, row.payload, using, row.trace, dispatched_at
+                )
+            except Exception as exc:
+                result = {"status": _fail_event(self, exc, [row.id], started, using)}
+                if result["status"] == "retry":
+                    failed.append(row.id)
+                    last_exc = exc
+            counts[result["status"]] += 1
+            _tally(tally, row.shard_id, row.event_type, result)
+            if result["status"] == "done":
+                lag = (timezone.now() - row.created_at).total_seconds()
+                key = metrics.series("fds_outbox_to_decision_seconds_total", shard=row.shard_id)
+                tally[key] = tally.get(key, 0.0) + lag
+    counts["missing"] = len(outbox_ids) - found
+
+    metrics.incr_many(tally)
+    if failed:
+        raise self.retry(
+            kwargs={"shard_id": shard_id, "outbox_ids": failed, "dispatched_at": dispatched_at},
+            exc=last_exc,
+            countdown=_backoff(self.request.retries),
+        )
+    return {"status": "ok", **counts}
+
+
+def _trace_dispatch(rows: List[tuple], claimed: float, sent: float) -> None:
+    """
+    Spans for the traced (created_at, trace) rows of one task message:
+    outbox_ready until the dispatcher claimed the batch, dispatch until the
+    message was handed to the broker (publishing is part of the queue span).
+    """
+    for created_at, trace in rows:
+        if trace is not None:
+            tracing.record(trace, "outbox_ready", created_at.timestamp(), claimed)
+            tracing.record(trace, "dispatch", claimed, sent)
+
+
+def _dispatch_lane(shard_id: str, lane: Lane, limit: int, mode: str, chunk: int, using: str) -> int:
+    """
+    Enqueue up to `limit` READY rows of one lane onto the lane's queue
+    and mark them SENT. Returns the number of rows dispatched.
+
+    Traced rows (fds_core.tracing) get their outbox_ready and dispatch
+    spans; the dispatch time travels in the message for the queue span.
+    """
+    claimed = time.time()
+    with transaction.atomic(using=using):
+        rows = (
+            Outbox.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(shard_id=shard_id, lane=lane.name, status="READY")
+            .order_by("id")
+        )
+        if mode == "claim_check":
+            # ids only: payloads stay in the table until the worker claims them
+            selected = list(rows.values_list("id", "created_at", "trace")[:limit])
+            ids = [row_id for row_id, _, _ in selected]
+            for i in range(0, len(ids), chunk):
+                sent = time.time()
+                detect_outbox_chunk_task.apply_async(
+                    kwargs={"shard_id": shard_id, "outbox_ids": ids[i:i + chunk], "dispatched_at": sent},
+                    queue=lane.queue,
+                )
+                _trace_dispatch([(at, trace) for _, at, trace in selected[i:i + chunk]], claimed, sent)
+        else:
+            ids = []
+            for row in rows[:limit]:
+                kwargs = {
+                    "event_type": row.event_type,
+                    "shard_id": row.shard_id,
+                    "aggregate_id": row.aggregate_id,
+                    "payload": row.payload,
+                    "outbox_id": row.id,
+                    "created_at": row.created_at.timestamp(),
+                }
+                sent = time.time()
+                if row.trace:
+                    kwargs["trace"] = {**row.trace, "dispatched_at": sent}
+                detect_case_task.apply_async(kwargs=kwargs, queue=lane.queue)
+                _trace_dispatch([(row.created_at, row.trace)], claimed, sent)
+                ids.append(row.id)
+
+        if ids:
+            # READY only: a worker may already have dead-lettered a row (ERROR)
+            Outbox.objects.using(using).filter(id__in=ids, status="READY").update(status="SENT")
+    return len(ids)
 
 
 @shared_task
 def dispatch_outbox_batch(shard_id: str, batch: int = 500):
     """
     Dispatcher task:
-    - Select READY outbox rows for a shard
-    - Enqueue detect_case_task for each
+    - Select READY outbox rows for a shard, lane by lane in priority order
+    - Enqueue detection tasks on each lane's queue
     - Mark them as SENT
     Typically triggered by Celery Beat.
+
+    Dispatch mode (settings.FDS_DISPATCH_MODE):
+    - "claim_check" (default): one detect_outbox_chunk_task per
+      FDS_DISPATCH_CHUNK rows, carrying outbox ids only, so broker
+      message size does not depend on order size
+    - "payload": one detect_case_task per row, carrying the payload
+
+    Per lane (services.lanes.LANES):
+    - at most min(batch, lane.batch) rows per run
+    - nothing while the lane's queue holds lane.max_queued messages
+    - sheddable lanes are skipped while the realtime lane breaches its SLO
     """
     using = "default"
+    mode = getattr(settings, "FDS_DISPATCH_MODE", "claim_check")
+    chunk = getattr(settings, "FDS_DISPATCH_CHUNK", 50)
+    rows_per_message = chunk if mode == "claim_check" else 1
 
-    rows = (
-        Outbox.objects.using(using)
-        .select_for_update(skip_locked=True)
-        .filter(shard_id=shard_id, status="READY")
-        .order_by("id")[:batch]
-    )
+    over_slo = realtime_lag_exceeded(shard_id, using=using)
+    depths = queue_depths(lane.queue for lane in LANES)
 
-    if not rows:
-        return {"status": "empty"}
+    dispatched: Dict[str, int] = {}
+    throttled: List[str] = []
+    for lane in LANES:
+        if lane.sheddable and over_slo:
+            throttled.append(lane.name)
+            continue
 
-    dispatched = 0
-    with transaction.atomic(using=using):
-        for row in rows:
-            detect_case_task.delay(
-                event_type=row.event_type,
-                shard_id=row.shard_id,
-                aggregate_id=row.aggregate_id,
-                payload=row.payload,
-            )
-            row.status = "SENT"
-            row.save(using=using, update_fields=["status"])
-            dispatched += 1
-
-    return {"status": "ok", "dispatched": dispatched}
\ No newline at end of file
+        limit = min(batch, lane.batch)
+        depth = depths.get(lane.queue)
+        if depth is not None:
+            limit = min(limit, (lane.max_queued - depth) * rows_per_message)
+        if limit <= 0:
+            throttled.append(lane.name)
+            continue
+
+        n = _dispatch_lane(shard_id, lane, limit, mode, chunk, using)
+        if n:
+            dispatched[lane.name] = n
+
+    metrics.incr_many({
+        metrics.series("fds_outbox_dispatched_total", shard=shard_id, lane=name): n
+        for name, n in dispatched.items()
+    })
+
+    total = sum(dispatched.values())
+    if not total:
+        return {"status": "empty", "throttled": throttled}
+    return {"status": "ok", "dispatched": total, "lanes": dispatched, "throttled": throttled}
@@ -0,0 +1,872 @@
+# fds_django/tests.py
+import copy
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from typing import Any, Callable, Dict, List, Tuple
+
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory
+
+from fds_core import rule_analyzer, rule_cache, rules_engine
+from fds_core import velocity
+from fds_core.codec import CODECS, JSON_CODEC, CodecJSONDecoder, CodecJSONEncoder
+from fds_core.enums import Decision
+from fds_django import tasks
+from fds_django.models import (
+    DetectionLog,
+    DeviceBlock,
+    EntityCluster,
+    EntityLink,
+    EntityNode,
+    Order,
+    Outbox,
+    Processed,
+    RuleGeneration,
+    Rules,
+    UserBlock,
+    VelocityBucket,
+)
+from fds_django.services import dead_letter, entity_links, partitions
+from fds_django.services import velocity as velocity_buckets
+from fds_django.services.lanes import LANES_BY_NAME
+from fds_django.serializers import DetectOrderSerializer, DetectPurchaseSerializer
+from fds_django.services.upsert import upsert_order_sync, upsert_purchase_sync
+from fds_django.services.validation import validate_order, validate_purchase
+from fds_django.views import DEADLINE_RESERVE_MS, MAX_DEADLINE_MS, DetectOrderView, _requested_deadline
+from fds_django.views_async import IngestOrderView
+
+ORDER: Dict[str, Any] = {
+    "order_id": "ORD123",
+    "account_id": "A100",
+    "device_id": "D200",
+    "order_country": "JP",
+    "total_price": 3000.00,
+    "currency": "JPY",
+    "order_status": "CREATED",
+    "items": [
+        {"product_id": "P100", "unit_price": 1000, "quantity": 2},
+        {"product_id": "P200", "unit_price": "1000.00", "quantity": "1.0"},
+    ],
+}
+
+PURCHASE: Dict[str, Any] = {
+    "purchase_id": "PUR123",
+    "order_id": "ORD123",
+    "method_type": "CARD",
+    "card_brand": "VISA",
+    "bin": 411111,
+    "card_id": "C100",
+    "payment_country": "JP",
+    "payment_status": "SUCCESS",
+    "price": "12.3",
+    "currency": "JPY",
+    "metadata": {"source": "mobile-web"},
+}
+
+# Structure: (label, path into the payload, value); value MISSING drops the key
+MISSING = object()
+ORDER_CHANGES: List[Tuple[str, Tuple[Any, ...], Any]] = [
+    ("id as int", ("order_id",), 42),
+    ("id padded", ("order_id",), "  ORD123  "),
+    ("id blank", ("order_id",), "   "),
+    ("id null", ("order_id",), None),
+    ("id missing", ("order_id",), MISSING),
+    ("id too long", ("order_id",), "x" * 65),
+    ("id null character", ("order_id",), "a\x00b"),
+    ("id surrogate", ("order_id",), "\ud800"),
+    ("id bool", ("order_id",), True),
+    ("id list", ("order_id",), []),
+    ("country too long", ("order_country",), "x" * 17),
+    ("price string", ("total_price",), "3000.5"),
+    ("price exponent", ("total_price",), "1e3"),
+    ("price NaN", ("total_price",), "NaN"),
+    ("price not a number", ("total_price",), "abc"),
+    ("price too many places", ("total_price",), "0.001"),
+    ("price too many digits", ("total_price",), "12345678901.1"),
+    ("price too many whole digits", ("total_price",), "99999999999"),
+    ("price null", ("total_price",), None),
+    ("items missing", ("items",), MISSING),
+    ("items null", ("items",), None),
+    ("items not a list", ("items",), {"product_id": "P1"}),
+    ("items empty", ("items",), []),
+    ("item null", ("items", 0), None),
+    ("item not a mapping", ("items", 1), "P200"),
+    ("item product missing", ("items", 0, "product_id"), MISSING),
+    ("item quantity zero", ("items", 1, "quantity"), 0),
+    ("item quantity fraction", ("items", 1, "quantity"), "1.5"),
+    ("item quantity text", ("items", 0, "quantity"), "two"),
+    ("item price invalid", ("items", 0, "unit_price"), "1.234"),
+    ("metadata object", ("metadata",), {"a": [1, None]}),
+    ("metadata null", ("metadata",), None),
+]
+PURCHASE_CHANGES: List[Tuple[str, Tuple[Any, ...], Any]] = [
+    ("optional null", ("card_brand",), None),
+    ("optional missing", ("card_brand",), MISSING),
+    ("optional blank", ("bin",), ""),
+    ("optional too long", ("bin",), "4" * 17),
+    ("failure reason set", ("failure_reason",), "declined"),
+    ("required missing", ("payment_status",), MISSING),
+    ("required null", ("method_type",), None),
+    ("price int", ("price",), 12000),
+    ("price invalid", ("price",), "12,3"),
+    ("metadata missing", ("metadata",), MISSING),
+]
+
+
+def _changed(base: Dict[str, Any], path: Tuple[Any, ...], value: Any) -> Dict[str, Any]:
+    data = copy.deepcopy(base)
+    target = data
+    for key in path[:-1]:
+        target = target[key]
+    if value is MISSING:
+        del target[path[-1]]
+    else:
+        target[path[-1]] = value
+    return data
+
+
+def _plain(value: Any) -> Any:
+    """Errors / validated data as plain JSON values (ErrorDetail codes and Decimal types ignored)."""
+    return json.loads(json.dumps(value, default=str))
+
+
+def _reference(serializer_class, data: Any) -> Tuple[str, Any]:
+    s = serializer_class(data=data)
+    if s.is_valid():
+        return "valid", s.validated_data
+    return "invalid", _plain(s.errors)
+
+
+def _fast(validate: Callable[[Any], Dict[str, Any]], data: Any) -> Tuple[str, Any]:
+    try:
+        return "valid", validate(data)
+    except ValidationError as e:
+        return "invalid", _plain(e.detail)
+
+
+class ValidationParityTests(SimpleTestCase):
+    """
+    The fast-path schemas (fds_core.schemas via services.validation) must
+    accept, transform and reject payloads exactly like the DRF serializers.
+    """
+
+    def assertParity(self, serializer_class, validate, data: Any) -> None:
+        expected = _reference(serializer_class, data)
+        actual = _fast(validate, data)
+        self.assertEqual(actual[0], expected[0])
+        if expected[0] == "valid":
+            # same keys, values and types (Decimal, int, str)
+            self.assertEqual(actual[1], expected[1])
+            self.assertEqual(_plain(actual[1]), _plain(expected[1]))
+            self.assertEqual(
+                {k: type(v) for k, v in actual[1].items()},
+                {k: type(v) for k, v in expected[1].items()},
+            )
+        else:
+            self.assertEqual(actual[1], expected[1])
+
+    def test_order_payloads(self):
+        self.assertParity(DetectOrderSerializer, validate_order, ORDER)
+        for label, path, value in ORDER_CHANGES:
+            with self.subTest(label):
+                self.assertParity(DetectOrderSerializer, validate_order, _changed(ORDER, path, value))
+
+    def test_purchase_payloads(self):
+        self.assertParity(DetectPurchaseSerializer, validate_purchase, PURCHASE)
+        for label, path, value in PURCHASE_CHANGES:
+            with self.subTest(label):
+                self.assertParity(DetectPurchaseSerializer, validate_purchase, _changed(PURCHASE, path, value))
+
+    def test_several_errors_at_once(self):
+        data = _changed(_changed(ORDER, ("order_id",), ""), ("items", 1, "quantity"), -1)
+        data["currency"] = None
+        self.assertParity(DetectOrderSerializer, validate_order, data)
+
+    def test_not_a_mapping(self):
+        for data in (None, [], "order", 1):
+            with self.subTest(data=data):
+                self.assertParity(DetectOrderSerializer, validate_order, data)
+                self.assertParity(DetectPurchaseSerializer, validate_purchase, data)
+
+
+class RuleLoadTransactionTests(TestCase):
+    """
+    Lazy rule loads (and their EXPLAIN pass) must not run in, or abort, a
+    caller's transaction: on PostgreSQL a failed statement aborts it.
+    """
+
+    def setUp(self):
+        Rules.objects.create(
+            rule_id="R_BROKEN", rule_sql="SELECT 1 FROM no_such_table WHERE id = %s", rule_action="BLOCK", target="order",
+        )
+        Rules.objects.create(
+            rule_id="R_OK", rule_sql="SELECT 1 FROM fds_django_order WHERE order_id = %s", rule_action="REVIEW", target="order",
+        )
+        rule_cache.clear_rules()
+        self.addCleanup(rule_cache.clear_rules)
+
+    def test_broken_rule_inside_outer_atomic(self):
+        with transaction.atomic():
+            rule_cache.ensure_rules_loaded()
+            # fails with "current transaction is aborted" if the EXPLAIN error leaked
+            Processed.objects.create(shard_id="default", event_type="order_upserted", aggregate_id="o1")
+
+        self.assertEqual([r[0] for r in rule_cache.get_rules("order")], ["R_BROKEN", "R_OK"])
+        report = RuleGeneration.objects.get().report
+        flags = {e["rule_id"]: e["flags"] for e in report["rules"]}
+        self.assertIn("error", flags["R_BROKEN"])
+        self.assertNotIn("error", flags["R_OK"])
+
+    def test_worker_event_with_cold_rule_cache(self):
+        result = tasks._process_event("order_upserted", "default", "o1", {"kind": "order", "order_id": "o1"}, "default")
+
+        self.assertEqual(result["status"], "done")
+        self.assertTrue(Processed.objects.filter(aggregate_id="o1").exists())
+        self.assertEqual(RuleGeneration.objects.count(), 1)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "table partitioning needs PostgreSQL")
+class PartitionTests(TransactionTestCase):
+    """
+    services.partitions DDL against a real PostgreSQL: convert, ensure,
+    expire / archive, revert, and the advisory-locked record_processed.
+    """
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.old = timezone.now() - timedelta(days=40)
+
+        old_log = DetectionLog.objects.create(case_kind="order", case_id="o-old", decision="BLOCK", extra={"n": 2**70})
+        DetectionLog.objects.filter(pk=old_log.pk).update(created_at=self.old)
+        Outbox.objects.create(event_type="order_upserted", aggregate_id="o-old", payload={"order_id": "o-old"})
+        Processed.objects.create(shard_id="default", event_type="order_upserted", aggregate_id="o-old")
+
+        for spec in partitions.PARTITIONED:
+            self.assertTrue(partitions.convert_to_partitioned(spec.model))
+        for spec in partitions.PARTITIONED:
+            self.addCleanup(partitions.revert_partitioned, spec.model)
+
+    def _partition_of(self, model, **filters) -> str:
+        row = model.objects.filter(**filters).get()
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT tableoid::regclass::text FROM {model._meta.db_table} WHERE {model._meta.pk.column} = %s",
+                [row.pk],
+            )
+            return cur.fetchone()[0]
+
+    def test_convert_keeps_rows_and_ids(self):
+        for spec in partitions.PARTITIONED:
+            table = spec.model._meta.db_table
+            self.assertTrue(partitions.is_partitioned(spec.model))
+            names = [p.name for p in partitions.partitions(spec.model)]
+            self.assertEqual(names, [f"{table}_legacy", f"{table}_default"])
+            self.assertFalse(partitions.convert_to_partitioned(spec.model))
+
+        old = Outbox.objects.get()
+        new = Outbox.objects.create(event_type="order_upserted", aggregate_id="o-new", payload={})
+        self.assertGreater(new.id, old.id)
+        self.assertEqual(DetectionLog.objects.get().extra, {"n": 2**70})
+
+    def test_ensure_moves_rows_out_of_the_default_partition(self):
+        ahead = partitions.window_start(timezone.now()) + timedelta(days=3)
+        log = DetectionLog.objects.create(case_kind="order", case_id="o-ahead", decision="ALLOW")
+        DetectionLog.objects.filter(pk=log.pk).update(created_at=ahead)
+        self.assertEqual(self._partition_of(DetectionLog, case_id="o-ahead"), "fds_django_detectionlog_default")
+
+        created = partitions.ensure_partitions(DetectionLog, ahead=7)
+
+        # the legacy partition covers the current window
+        self.assertEqual(len(created), 7)
+        self.assertEqual(self._partition_of(DetectionLog, case_id="o-ahead"), f"fds_django_detectionlog_p{ahead:%Y%m%d}")
+        self.assertEqual(partitions.ensure_partitions(DetectionLog, ahead=7), [])
+
+    def test_expire_archives_and_drops(self):
+        partitions.ensure_partitions(DetectionLog, ahead=1)
+        partitions.ensure_partitions(Outbox, ahead=1)
+        spec = {s.model: s for s in partitions.PARTITIONED}
+
+        with override_settings(FDS_DETECTION_LOG_RETENTION_DAYS=-30, FDS_OUTBOX_RETENTION_DAYS=-30):
+            self.assertEqual(
+                {d["action"] for d in partitions.expire_partitions(spec[DetectionLog], dry_run=True)}, {"would_expire"},
+            )
+            done = partitions.expire_partitions(spec[DetectionLog], archive_dir=self.archive_dir)
+            kept = partitions.expire_partitions(spec[Outbox], archive_dir=self.archive_dir)
+
+        self.assertEqual([d["action"] for d in done], ["archived", "archived"])
+        self.assertEqual([p.name for p in partitions.partitions(DetectionLog)], ["fds_django_detectionlog_default"])
+        self.assertFalse(DetectionLog.objects.exists())
+        header, rows = partitions.read_archive(done[0]["path"])
+        self.assertEqual(header["partition"], "fds_django_detectionlog_legacy")
+        rows = list(rows)
+        self.assertEqual([(r["case_id"], r["extra"]) for r in rows], [("o-old", {"n": 2**70})])
+
+        # the READY outbox row keeps the legacy partition
+        self.assertEqual([d["action"] for d in kept], ["kept_ready_rows", "archived"])
+        self.assertTrue(Outbox.objects.filter(aggregate_id="o-old").exists())
+
+    def test_record_processed_serializes_concurrent_inserts(self):
+        # past the legacy partition, which still has the old unique index
+        partitions.ensure_partitions(Processed, ahead=1)
+        later = partitions.window_start(timezone.now()) + timedelta(days=1, hours=1)
+        patcher = mock.patch("django.utils.timezone.now", return_value=later)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        key = ("default", "order_upserted", "o-race")
+        inserted, release = threading.Event(), threading.Event()
+        results: Dict[str, bool] = {}
+
+        def first():
+            try:
+                with transaction.atomic():
+                    results["first"] = partitions.record_processed(*key)
+                    inserted.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        def second():
+            try:
+                results["second"] = partitions.record_processed(*key)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        threads[0].start()
+        inserted.wait(5)
+        threads[1].start()
+        time.sleep(0.2)  # the second insert waits on the first one's lock
+        self.assertNotIn("second", results)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(results, {"first": True, "second": False})
+        self.assertEqual(Processed.objects.filter(aggregate_id="o-race").count(), 1)
+        self.assertEqual(self._partition_of(Processed, aggregate_id="o-race"), f"fds_django_processed_p{later:%Y%m%d}")
+
+
+class DeadLetterTests(TestCase):
+    """
+    services.dead_letter and the worker / dispatcher paths around it:
+    classification, failure records, per-event isolation in a chunk, replay.
+    """
+
+    def _outbox(self, aggregate_id: str, **fields) -> Outbox:
+        return Outbox.objects.create(
+            event_type="order_upserted", aggregate_id=aggregate_id, payload={"kind": "order", "order_id": aggregate_id},
+            **fields,
+        )
+
+    def test_classify(self):
+        class Cause(Exception):
+            def __init__(self, sqlstate):
+                self.sqlstate = sqlstate
+
+        def chained(sqlstate):
+            exc = DatabaseError("db")
+            exc.__cause__ = Cause(sqlstate)
+            return exc
+
+        cases = [
+            (OperationalError("server closed the connection"), True),
+            (rule_cache.RulesUnavailable("no rules"), True),
+            (IntegrityError("fk"), False),
+            (ValueError("bad payload"), False),
+            (KeyError("order_id"), False),
+            (chained("40001"), True),
+            (chained("40P01"), True),
+            (chained("57014"), True),
+            (chained("42P01"), False),
+            (DatabaseError("no cause"), False),
+        ]
+        for exc, retryable in cases:
+            with self.subTest(exc=repr(exc)):
+                self.assertEqual(dead_letter.classify(exc)[1], retryable)
+        self.assertEqual(dead_letter.classify(ValueError())[0], "builtins.ValueError")
+
+    def test_record_failure(self):
+        row = self._outbox("o1")
+
+        self.assertTrue(dead_letter.record_failure([row.id], OperationalError("down"), attempt=1, dead=False))
+        row.refresh_from_db()
+        self.assertEqual(row.status, Outbox.Status.READY)
+        self.assertEqual([(a["attempt"], a["retryable"]) for a in row.attempts], [(1, True)])
+
+        try:
+            raise ValueError("bad payload")
+        except ValueError as exc:
+            self.assertTrue(dead_letter.record_failure([row.id], exc, attempt=2, dead=True))
+        row.refresh_from_db()
+        self.assertEqual(row.status, Outbox.Status.ERROR)
+        self.assertEqual(row.error_class, "builtins.ValueError")
+        self.assertIn("bad payload", row.last_error)
+        self.assertIn("Traceback", row.last_error)
+        self.assertEqual([a["attempt"] for a in row.attempts], [1, 2])
+
+        for attempt in range(dead_letter.MAX_HISTORY + 5):
+            dead_letter.record_failure([row.id], OperationalError("down"), attempt=attempt, dead=False)
+        row.refresh_from_db()
+        self.assertEqual(len(row.attempts), dead_letter.MAX_HISTORY)
+        self.assertEqual(row.attempts[-1]["attempt"], dead_letter.MAX_HISTORY + 4)
+
+    def test_chunk_retries_only_the_failed_events(self):
+        ok, flaky, bad = self._outbox("ok"), self._outbox("flaky"), self._outbox("bad")
+
+        def process(event_type, shard_id, aggregate_id, *args):
+            if aggregate_id == "flaky":
+                raise OperationalError("server closed the connection")
+            if aggregate_id == "bad":
+                raise ValueError("bad payload")
+            return {"status": "done", "decision": "ALLOW", "kind": "order", "seconds": 0.0}
+
+        task = tasks.detect_outbox_chunk_task
+        with mock.patch.object(tasks, "_process_event", side_effect=process), \
+                mock.patch.object(task, "retry", side_effect=RuntimeError("retry")) as retry:
+            with self.assertRaisesMessage(RuntimeError, "retry"):
+                task.run("default", [ok.id, flaky.id, bad.id])
+
+        self.assertEqual(retry.call_args.kwargs["kwargs"]["outbox_ids"], [flaky.id])
+        self.assertIsInstance(retry.call_args.kwargs["exc"], OperationalError)
+        statuses = dict(Outbox.objects.values_list("aggregate_id", "status"))
+        self.assertEqual(statuses, {"ok": "READY", "flaky": "READY", "bad": "ERROR"})
+        self.assertEqual(len(Outbox.objects.get(aggregate_id="flaky").attempts), 1)
+
+    def test_dispatcher_keeps_rows_dead_lettered_meanwhile(self):
+        for mode in ("claim_check", "payload"):
+            with self.subTest(mode=mode):
+                Outbox.objects.all().delete()
+                fast, other = self._outbox("fast"), self._outbox("other")
+
+                def worker(*args, **kwargs):
+                    # the worker dead-letters the event before the dispatcher commits
+                    Outbox.objects.filter(id=fast.id).update(status=Outbox.Status.ERROR)
+
+                target = tasks.detect_outbox_chunk_task if mode == "claim_check" else tasks.detect_case_task
+                with mock.patch.object(target, "apply_async", side_effect=worker):
+                    n = tasks._dispatch_lane("default", LANES_BY_NAME["order"], 10, mode, 50, "default")
+
+                self.assertEqual(n, 2)
+                statuses = dict(Outbox.objects.values_list("aggregate_id", "status"))
+                self.assertEqual(statuses, {"fast": "ERROR", "other": "SENT"})
+
+    def test_replay_dead_letters(self):
+        a = self._outbox("a", status=Outbox.Status.ERROR, error_class="builtins.ValueError")
+        b = self._outbox("b", status=Outbox.Status.ERROR, error_class="django.db.utils.IntegrityError")
+        sent = self._outbox("c", status=Outbox.Status.SENT)
+
+        self.assertEqual(dead_letter.replay_dead_letters(dry_run=True), [a.id, b.id])
+        self.assertFalse(Outbox.objects.filter(status=Outbox.Status.READY).exists())
+
+        self.assertEqual(dead_letter.replay_dead_letters(error_class="builtins.ValueError", lane="bulk"), [a.id])
+        a.refresh_from_db()
+        self.assertEqual((a.status, a.lane), (Outbox.Status.READY, "bulk"))
+        self.assertTrue(a.attempts[-1]["replayed"])
+
+        self.assertEqual(dead_letter.replay_dead_letters(ids=[b.id, sent.id]), [b.id])
+        b.refresh_from_db()
+        sent.refresh_from_db()
+        self.assertEqual((b.status, b.lane), (Outbox.Status.READY, "order"))
+        self.assertEqual(sent.status, Outbox.Status.SENT)
+
+    def test_replay_archived(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "outbox_p20260101.jsonl.gz")
+        base = {"shard_id": "default", "lane": "order", "event_type": "order_upserted", "attempts": [{"attempt": 1}]}
+        with gzip.open(path, "wb") as f:
+            f.write(JSON_CODEC.dumps({"format": partitions.ARCHIVE_FORMAT, "table": "outbox", "partition": "outbox_p20260101"}) + b"\n")
+            for row_id, status in ((7, "ERROR"), (8, "SENT"), (9, "ERROR")):
+                row = {**base, "id": row_id, "status": status, "aggregate_id": f"o{row_id}", "payload": {"order_id": f"o{row_id}", "n": 2**70}}
+                f.write(JSON_CODEC.dumps(row) + b"\n")
+
+        self.assertEqual(dead_letter.replay_archived(path, dry_run=True), [7, 9])
+        self.assertFalse(Outbox.objects.exists())
+
+        self.assertEqual(dead_letter.replay_archived(path, ids=[9], lane="bulk"), [9])
+        row = Outbox.objects.get()
+        self.assertEqual((row.status, row.lane, row.aggregate_id), (Outbox.Status.READY, "bulk", "o9"))
+        self.assertEqual(row.payload, {"order_id": "o9", "n": 2**70})
+        self.assertEqual(row.attempts[-1]["archived_id"], 9)
+
+        with gzip.open(path, "wb") as f:
+            f.write(JSON_CODEC.dumps({"format": partitions.ARCHIVE_FORMAT, "table": "fds_django_processed", "partition": "x"}) + b"\n")
+        with self.assertRaises(ValueError):
+            dead_letter.replay_archived(path)
+
+
+def _clusters() -> Dict[frozenset, Tuple[int, int]]:
+    """Entity link index as {members: (size, blocked)}, independent of cluster ids."""
+    members: Dict[int, set] = {}
+    for entity_type, entity_id, cluster_id in EntityNode.objects.values_list("entity_type", "entity_id", "cluster_id"):
+        members.setdefault(cluster_id, set()).add((entity_type, entity_id))
+    sizes = {c.id: (c.size, c.blocked) for c in EntityCluster.objects.all()}
+    return {frozenset(m): sizes[cluster_id] for cluster_id, m in members.items()}
+
+
+def _links() -> set:
+    return set(EntityLink.objects.values_list("src_type", "src_id", "dst_type", "dst_id"))
+
+
+class EntityLinkTests(TestCase):
+    """
+    services.entity_links: incremental cluster merges, the MergeConflict
+    rollback and rebuild_entity_links agreeing with the incremental index.
+    """
+
+    def _order(self, order_id: str, account_id: str, device_id: str) -> Dict[str, Any]:
+        data = validate_order({**ORDER, "order_id": order_id, "account_id": account_id, "device_id": device_id})
+        upsert_order_sync(data)
+        return data
+
+    def _purchase(self, purchase_id: str, order_id: str, card_id: str) -> None:
+        upsert_purchase_sync(validate_purchase({**PURCHASE, "purchase_id": purchase_id, "order_id": order_id, "card_id": card_id}))
+
+    def test_merge_two_clusters(self):
+        DeviceBlock.objects.create(device_id="D2")
+        self._order("O1", "A1", "D1")
+        self._order("O2", "A2", "D2")
+        self._order("O3", "A3", "D3")
+        self.assertEqual(EntityCluster.objects.count(), 3)
+
+        self._order("O4", "A1", "D2")
+
+        clusters = _clusters()
+        self.assertEqual(clusters[frozenset({("account", "A1"), ("device", "D1"), ("account", "A2"), ("device", "D2")})], (4, 1))
+        self.assertEqual(clusters[frozenset({("account", "A3"), ("device", "D3")})], (2, 0))
+        self.assertEqual(EntityCluster.objects.count(), 2)
+
+        # a card shared by both remaining clusters merges them too
+        self._purchase("P1", "O1", "C1")
+        self._purchase("P3", "O3", "C1")
+        self.assertEqual(list(_clusters().values()), [(7, 1)])
+
+    def test_merge_conflict_rolls_back_the_links(self):
+        self._order("O1", "A100", "D1")
+        self._order("O2", "A2", "D200")
+        links, clusters = _links(), _clusters()
+        factory = APIRequestFactory()
+
+        with mock.patch.object(entity_links, "_MERGE_RETRIES", 0):
+            for view in (DetectOrderView.as_view(), IngestOrderView.as_view()):
+                with self.subTest(view=view.__name__):
+                    response = view(factory.post("/", ORDER, format="json"))
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response["Retry-After"], "1")
+
+        self.assertEqual(_links(), links)
+        self.assertEqual(_clusters(), clusters)
+        self.assertFalse(Order.objects.filter(order_id=ORDER["order_id"]).exists())
+        self.assertFalse(Outbox.objects.exists())
+
+    def test_rebuild_matches_the_incremental_index(self):
+        UserBlock.objects.create(user_id="A2")
+        DeviceBlock.objects.create(device_id="D4")
+        for n, (account, device) in enumerate([("A1", "D1"), ("A2", "D1"), ("A3", "D2"), ("A4", "D4"), ("A1", "D1")]):
+            self._order(f"O{n}", account, device)
+        self._purchase("P1", "O0", "C1")
+        self._purchase("P2", "O2", "C1")
+        self._purchase("P3", "O3", "C2")
+        # blocklisted after its node exists
+        UserBlock.objects.create(user_id="A3")
+        entity_links.mark_blocked(("account", "A3"))
+        links, clusters = _links(), _clusters()
+
+        stats = entity_links.rebuild_entity_links()
+
+        self.assertEqual(_links(), links)
+        self.assertEqual(_clusters(), clusters)
+        self.assertEqual(stats, {"links": len(links) // 2, "nodes": 9, "clusters": 2})
+
+
+class VelocityTests(TestCase):
+    """
+    Velocity windows (fds_core.velocity) and their bucket maintenance
+    (services.velocity): window edges, the rule parser, rebuild parity.
+    """
+
+    T0 = 1_800_000_000  # aligned to every default bucket size
+
+    def test_window_edges(self):
+        window = velocity.get_windows()["device_orders_10m"]  # 600 s in 60 s buckets
+        for ts in (self.T0 - 61, self.T0 - 1, self.T0, self.T0 + 59):
+            velocity_buckets.record_event("order", {"device": "D1", "account": None}, ts=ts)
+
+        def count(now):
+            return velocity.velocity_count(window, "D1", now=now)
+
+        self.assertEqual(count(self.T0 + 59), 4)
+        # the oldest bucket (T0 - 120) leaves the window when the clock enters bucket T0 + 480
+        self.assertEqual(count(self.T0 + 479), 4)
+        self.assertEqual(count(self.T0 + 480), 3)
+        self.assertEqual(count(self.T0 + 539), 3)
+        self.assertEqual(count(self.T0 + 540), 2)
+        self.assertEqual(count(self.T0 + 599), 2)
+        self.assertEqual(count(self.T0 + 600), 0)
+        # buckets are per entity and per bucket size
+        self.assertEqual(velocity.velocity_count(window, "D2", now=self.T0), 0)
+        self.assertEqual(velocity.velocity_count(window, None, now=self.T0), 0)
+        self.assertEqual(VelocityBucket.objects.filter(entity_type="device").count(), 3)
+        self.assertFalse(VelocityBucket.objects.filter(entity_type="account").exists())
+
+    def test_rule_parser(self):
+        windows = velocity.get_windows()
+        valid = [
+            ("VELOCITY device_orders_10m > 5", "device_orders_10m", ">", 5),
+            ("  velocity card_fails_1h>=3;", "card_fails_1h", ">=", 3),
+            ("VELOCITY account_orders_24h <= 10 ;\n", "account_orders_24h", "<=", 10),
+            ("Velocity bin_fails_1h < 1", "bin_fails_1h", "<", 1),
+            ("VELOCITY card_purchases_1h = 0", "card_purchases_1h", "=", 0),
+        ]
+        for rule_sql, name, op, threshold in valid:
+            with self.subTest(rule_sql):
+                self.assertTrue(velocity.is_velocity_rule(rule_sql))
+                self.assertEqual(velocity.parse_velocity_rule(rule_sql), (windows[name], op, threshold))
+
+        invalid = [
+            "VELOCITY device_orders_10m > -1",
+            "VELOCITY device_orders_10m => 5",
+            "VELOCITY device_orders_10m > 5 AND 1 = 1",
+            "VELOCITY device_orders_10m",
+            "VELOCITY > 5",
+            "VELOCITY unknown_window > 5",
+        ]
+        for rule_sql in invalid:
+            with self.subTest(rule_sql):
+                with self.assertRaises(ValueError):
+                    velocity.parse_velocity_rule(rule_sql)
+
+        self.assertFalse(velocity.is_velocity_rule("SELECT 1 FROM fds_django_order WHERE order_id = %s"))
+        self.assertFalse(velocity.is_velocity_rule("VELOCIT"))
+
+    def test_rebuild_matches_incremental_counts(self):
+        now = timezone.now()
+
+        def buckets():
+            return set(VelocityBucket.objects.values_list(
+                "metric", "entity_type", "entity_id", "bucket_seconds", "bucket_start", "count",
+            ))
+
+        with mock.patch("django.utils.timezone.now", return_value=now), \
+                mock.patch("time.time", return_value=now.timestamp()):
+            for order_id, account, device in [("O1", "A1", "D1"), ("O2", "A1", "D2"), ("O3", "A2", "D1")]:
+                upsert_order_sync(validate_order({**ORDER, "order_id": order_id, "account_id": account, "device_id": device}))
+            # re-ingesting a snapshot counts nothing
+            upsert_order_sync(validate_order({**ORDER, "order_id": "O1", "account_id": "A1", "device_id": "D1"}))
+
+            purchases = [("P1", "O1", "C1", "PENDING"), ("P2", "O2", "C1", "SUCCESS"), ("P3", "O3", "C2", "FAIL")]
+            for purchase_id, order_id, card, payment_status in purchases:
+                upsert_purchase_sync(validate_purchase({
+                    **PURCHASE, "purchase_id": purchase_id, "order_id": order_id, "card_id": card, "payment_status": payment_status,
+                }))
+            # failing later counts once; staying failed does not count again
+            for payment_status in ("FAIL", "FAIL"):
+                upsert_purchase_sync(validate_purchase({
+                    **PURCHASE, "purchase_id": "P1", "order_id": "O1", "card_id": "C1", "payment_status": payment_status,
+                }))
+
+            incremental = buckets()
+            written = velocity_buckets.rebuild_velocity()
+
+        self.assertEqual(buckets(), incremental)
+        self.assertEqual(sum(written.values()), len(incremental))
+        window = velocity.get_windows()["card_fails_1h"]
+        self.assertEqual(velocity.velocity_count(window, "C1", now=now.timestamp()), 1)
+        window = velocity.get_windows()["account_orders_24h"]
+        self.assertEqual(velocity.velocity_count(window, "A1", now=now.timestamp()), 2)
+
+
+class RuleGenerationTests(TestCase):
+    """
+    Rule generations (fds_core.rule_analyzer): one row per rule set, and the
+    representative case ids bound when EXPLAINing rules.
+    """
+
+    def _report(self, fingerprint: str, cost: float = 1.0) -> Dict[str, Any]:
+        return {"fingerprint": fingerprint, "rules": [{"rule_id": "R1", "cost": cost, "flags": []}]}
+
+    def test_one_generation_per_rule_set(self):
+        self.assertIsNone(rule_analyzer.latest_generation())
+        a = rule_analyzer.save_generation(self._report("a" * 64))
+        self.assertEqual(rule_analyzer.save_generation(self._report("a" * 64, cost=2.0)), a)
+        b = rule_analyzer.save_generation(self._report("b" * 64))
+        self.assertEqual(rule_analyzer.latest_generation()["id"], b)
+
+        # back to the first rule set: its generation is refreshed and the latest again
+        self.assertEqual(rule_analyzer.save_generation(self._report("a" * 64, cost=3.0)), a)
+        latest = rule_analyzer.latest_generation()
+        self.assertEqual((latest["id"], latest["fingerprint"], latest["rule_count"]), (a, "a" * 64, 1))
+        self.assertEqual(latest["report"]["rules"][0]["cost"], 3.0)
+        self.assertEqual(RuleGeneration.objects.count(), 2)
+
+    def test_representative_ids(self):
+        self.assertEqual(rule_analyzer.representative_ids(), {"order": "0", "purchase": "0"})
+        for order_id in ("O1", "O3", "O2"):
+            Order.objects.create(order_id=order_id, account_id="A1", device_id="D1", **{
+                k: ORDER[k] for k in ("order_country", "total_price", "currency", "order_status")
+            })
+        self.assertEqual(rule_analyzer.representative_ids()["order"], "O3")
+        with override_settings(FDS_RULE_EXPLAIN_IDS={"order": "O1"}):
+            self.assertEqual(rule_analyzer.representative_ids()["order"], "O1")
+
+    def test_representative_id_lookups_use_the_primary_key(self):
+        with connection.cursor() as cur:
+            for target, sql in rule_analyzer._CASE_ID_SQL.items():
+                with self.subTest(target):
+                    if connection.vendor == "postgresql":
+                        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+                        doc = cur.fetchone()[0]
+                        plan = json.loads(doc) if isinstance(doc, str) else doc
+                        nodes = [n["Node Type"] for n in rule_analyzer._walk(plan[0]["Plan"])]
+                        self.assertNotIn("Sort", nodes)
+                        self.assertNotIn("Seq Scan", nodes)
+                    else:
+                        cur.execute("EXPLAIN QUERY PLAN " + sql)
+                        details = " ".join(str(row[-1]) for row in cur.fetchall())
+                        self.assertNotIn("TEMP B-TREE", details)
+
+
+class RuleSavepointTests(TestCase):
+    """
+    A rule failing inside a caller's transaction (the worker's) must not
+    abort it, whatever its kind.
+    """
+
+    @staticmethod
+    def _failing_query(*args):
+        with connection.cursor() as cur:
+            cur.execute("SELECT count FROM no_such_table")
+        return True
+
+    def test_failing_rules_keep_the_transaction_usable(self):
+        rules = {
+            "velocity": "VELOCITY device_orders_10m > 5",
+            "link": "LINK accounts device > 1",
+            "sql": "SELECT 1 FROM no_such_table WHERE id = %s",
+        }
+        with mock.patch.object(rules_engine, "run_velocity_rule", side_effect=self._failing_query), \
+                mock.patch.object(rules_engine, "run_link_rule", side_effect=self._failing_query):
+            for kind, rule_sql in rules.items():
+                with self.subTest(kind):
+                    with transaction.atomic():
+                        with self.assertRaises(DatabaseError):
+                            rules_engine._run_one_rule(rule_sql, {"order_id": "O1"}, "order")
+                        # "current transaction is aborted" on PostgreSQL without the savepoint
+                        self.assertFalse(Order.objects.filter(order_id="O1").exists())
+
+
+class DeadlineTests(SimpleTestCase):
+    """Request deadlines (views._requested_deadline)."""
+
+    def _deadline(self, value: str, header: bool = False):
+        factory = APIRequestFactory()
+        if header:
+            request = factory.post("/", HTTP_X_DEADLINE_MS=value)
+        else:
+            request = factory.post(f"/?deadline_ms={value}")
+        return _requested_deadline(DetectOrderView().initialize_request(request), 100.0)
+
+    def test_budgets_within_the_reserve_are_rejected(self):
+        for value in ("0", "-5", "abc", str(DEADLINE_RESERVE_MS), str(MAX_DEADLINE_MS + 1)):
+            with self.subTest(value):
+                deadline, rejected = self._deadline(value)
+                self.assertIsNone(deadline)
+                self.assertEqual(rejected.status_code, 400)
+                self.assertIn(str(DEADLINE_RESERVE_MS + 1), rejected.data["deadline_ms"][0])
+
+    def test_deadline_keeps_the_reserve(self):
+        self.assertEqual(self._deadline(str(DEADLINE_RESERVE_MS + 1)), (100.0 + 0.001, None))
+        self.assertEqual(self._deadline("50", header=True), (100.0 + (50 - DEADLINE_RESERVE_MS) / 1000.0, None))
+        self.assertEqual(self._deadline(str(MAX_DEADLINE_MS))[1], None)
+
+    def test_without_a_budget_every_rule_runs(self):
+        self.assertEqual(_requested_deadline(DetectOrderView().initialize_request(APIRequestFactory().post("/")), 100.0), (None, None))
+
+
+# integers within 64 bits (signed or unsigned): every codec
+INTS_64 = [2**64 - 1, -(2**63), 2**63, 10**18, -1, 0]
+# beyond 64 bits: the JSON codecs only (msgpack raises OverflowError)
+INTS_WIDE = [2**70, -(2**63) - 1, 2**64, -(10**30)]
+
+
+class CodecTests(SimpleTestCase):
+    """
+    Round trips through every codec in fds_core.codec.CODECS and through
+    the JSONField hooks.
+    """
+
+    def test_integers(self):
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name):
+                doc = {"ints": INTS_64, "nested": {"n": 2**64 - 1}}
+                self.assertEqual(codec.loads(codec.dumps(doc)), doc)
+                if name == "msgpack":
+                    with self.assertRaises(OverflowError):
+                        codec.dumps({"n": 2**70})
+                    continue
+                doc = {"ints": INTS_WIDE, "nested": [{"n": 2**70}], "float": 1.5, "id": "0" * 20}
+                decoded = codec.loads(codec.dumps(doc))
+                self.assertEqual(decoded, doc)
+                self.assertEqual([type(v) for v in decoded["ints"]], [int] * len(INTS_WIDE))
+
+    def test_values_encoded_by_the_default_hook(self):
+        moment = datetime(2026, 10, 19, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        uid = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        doc = {
+            "price": Decimal("3000.50"),
+            "tiny": Decimal("0.00000001"),
+            "at": moment,
+            "day": date(2026, 10, 19),
+            "id": uid,
+            "decision": Decision.BLOCK,
+        }
+        expected = {
+            "price": "3000.50",
+            "tiny": "1E-8",
+            "at": "2026-10-19T12:30:15.123456+00:00",
+            "day": "2026-10-19",
+            "id": str(uid),
+            "decision": Decision.BLOCK.value,
+        }
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name):
+                self.assertEqual(codec.loads(codec.dumps(doc)), expected)
+
+    def test_json_field_hooks(self):
+        doc = {"big": 2**70, "ints": INTS_64, "price": Decimal("12.30"), "at": datetime(2026, 1, 2, tzinfo=dt_timezone.utc)}
+        text = json.dumps(doc, cls=CodecJSONEncoder)
+        self.assertEqual(
+            json.loads(text, cls=CodecJSONDecoder),
+            {"big": 2**70, "ints": INTS_64, "price": "12.30", "at": "2026-01-02T00:00:00+00:00"},
+        )
+
+
+class CodecJSONFieldTests(TestCase):
+    """JSONFields with the codec hooks, through the database."""
+
+    def test_outbox_payload_and_detection_log_extra(self):
+        doc = {"big": 2**70, "neg": -(2**63) - 1, "u64": 2**64 - 1, "price": Decimal("12.30"),
+               "at": datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)}
+        expected = {"big": 2**70, "neg": -(2**63) - 1, "u64": 2**64 - 1, "price": "12.30",
+                    "at": "2026-01-02T03:04:05+00:00"}
+
+        row = Outbox.objects.create(event_type="order_upserted", aggregate_id="o1", payload=doc)
+        self.assertEqual(Outbox.objects.get(pk=row.pk).payload, expected)
+        log = DetectionLog.objects.create(case_kind="order", case_id="o1", decision="ALLOW", extra=doc)
+        self.assertEqual(DetectionLog.objects.get(pk=log.pk).extra, expected)
+        # also through values() (no model instance)
+        self.assertEqual(Outbox.objects.values_list("payload", flat=True).get(), expected)
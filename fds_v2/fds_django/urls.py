@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import DetectOrderView, DetectPurchaseView
-from .views_async import IngestOrderView, IngestPurchaseView
+from .views_async import IngestOrderView, IngestPurchaseView, LaneStatsView, MetricsView, RuleStatsView
 
 urlpatterns = [
     # Synchronous detection (for debugging / direct calls)
@@ -10,4 +10,13 @@ urlpatterns = [
     # Asynchronous ingestion (recommended for production)
     path("orders", IngestOrderView.as_view(), name="ingest-order"),
     path("purchases", IngestPurchaseView.as_view(), name="ingest-purchase"),
+
+    # Priority lanes (queue depth / backlog / lag)
+    path("fds/lanes", LaneStatsView.as_view(), name="lane-stats"),
+
+    # Pipeline lag / throughput (Prometheus text format)
+    path("metrics", MetricsView.as_view(), name="metrics"),
+
+    # Per-rule effectiveness (hourly rollups)
+    path("fds/rules/stats", RuleStatsView.as_view(), name="rule-stats"),
 ]
\ No newline at end of file
@@ -1,52 +1,122 @@
+import time
+
+from django.conf import settings
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .serializers import DetectOrderSerializer, DetectPurchaseSerializer
+from .services.entity_links import MergeConflict
 from .services.upsert import upsert_order_sync, upsert_purchase_sync
-from .services.detection import run_detection_sync
+from .services.detection import run_detection_sync, run_detection_within
+from .services.validation import validate_order, validate_purchase
 from fds_core.enums import CaseKind
+from fds_core.rule_cache import RulesUnavailable
+
+# Upper bound for a client deadline; time kept back for the response / logging
+MAX_DEADLINE_MS = 60000
+DEADLINE_RESERVE_MS: int = getattr(settings, "FDS_DEADLINE_RESERVE_MS", 10)
+
+
+def _requested_deadline(request, started: float):
+    """
+    Optional latency budget: ?deadline_ms=50 or the X-Deadline-Ms header.
+    Returns (deadline as time.monotonic(), error response); deadline None
+    means evaluate every rule in the request. A budget must exceed
+    DEADLINE_RESERVE_MS: anything shorter would expire before the first rule.
+    """
+    raw = request.query_params.get("deadline_ms") or request.headers.get("X-Deadline-Ms")
+    if raw is None:
+        return None, None
+    try:
+        budget_ms = int(raw)
+    except (TypeError, ValueError):
+        budget_ms = 0
+    if not DEADLINE_RESERVE_MS < budget_ms <= MAX_DEADLINE_MS:
+        return None, Response(
+            {"deadline_ms": [f"Must be an integer between {DEADLINE_RESERVE_MS + 1} and {MAX_DEADLINE_MS}."]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return started + (budget_ms - DEADLINE_RESERVE_MS) / 1000.0, None
+
+
+def retry_later() -> Response:
+    """
+    503 for an upsert rolled back on a transient entity link conflict
+    (MergeConflict): nothing was stored, the client retries.
+    """
+    return Response(
+        {"status": "conflict", "detail": "Concurrent entity link update, retry the request."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+def _detect(kind: CaseKind, data, deadline):
+    """
+    Full detection, or deadline mode: a provisional decision over the rules
+    evaluated in time, the rest completed by a worker via the outbox.
+    """
+    try:
+        if deadline is None:
+            acc = run_detection_sync(kind, data)
+        else:
+            acc, detection_id = run_detection_within(kind, data, deadline)
+    except RulesUnavailable:
+        # Fail closed: no rule set loaded yet, never answer "allow"
+        return Response(
+            {"status": "unavailable", "detail": "Detection rules are not loaded."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "5"},
+        )
+    body = {}
+    if deadline is not None:
+        body = {
+            "provisional": acc.provisional,
+            "evaluated_rules": acc.evaluated_rules,
+            "pending_rules": acc.pending_rules,
+            "detection_id": detection_id,
+        }
+    return Response(
+        {
+            "decision": acc.decision,
+            "reasons": acc.reasons,
+            "register_blocklist": acc.register_blocklist,
+            "register_params": acc.register_params.dict(),
+            **body,
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 class DetectOrderView(APIView):
     def post(self, request, *args, **kwargs):
-        s = DetectOrderSerializer(data=request.data)
-        s.is_valid(raise_exception=True)
+        deadline, rejected = _requested_deadline(request, time.monotonic())
+        if rejected is not None:
+            return rejected
+        data = validate_order(request.data)
 
         # Upsert
-        upsert_order_sync(s.validated_data)
+        try:
+            upsert_order_sync(data)
+        except MergeConflict:
+            return retry_later()
 
         # Run detection
-        acc = run_detection_sync(CaseKind.ORDER, s.validated_data)
-
-        return Response(
-            {
-                "decision": acc.decision,
-                "reasons": acc.reasons,
-                "register_blocklist": acc.register_blocklist,
-                "register_params": acc.register_params.dict(),
-            },
-            status=status.HTTP_200_OK,
-        )
+        return _detect(CaseKind.ORDER, data, deadline)
 
 
 class DetectPurchaseView(APIView):
     def post(self, request, *args, **kwargs):
-        s = DetectPurchaseSerializer(data=request.data)
-        s.is_valid(raise_exception=True)
+        deadline, rejected = _requested_deadline(request, time.monotonic())
+        if rejected is not None:
+            return rejected
+        data = validate_purchase(request.data)
 
         # Upsert
-        upsert_purchase_sync(s.validated_data)
+        try:
+            upsert_purchase_sync(data)
+        except MergeConflict:
+            return retry_later()
 
         # Run detection
-        acc = run_detection_sync(CaseKind.PURCHASE, s.validated_data)
-
-        return Response(
-            {
-                "decision": acc.decision,
-                "reasons": acc.reasons,
-                "register_blocklist": acc.register_blocklist,
-                "register_params": acc.register_params.dict(),
-            },
-            status=status.HTTP_200_OK,
-        )
\ No newline at end of file
+        return _detect(CaseKind.PURCHASE, data, deadline)
@@ -1,9 +1,37 @@
+import time
+
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .serializers import DetectOrderSerializer, DetectPurchaseSerializer
+from .services.entity_links import MergeConflict
+from .services.validation import validate_order, validate_purchase
 from .services.upsert_and_emit import upsert_order_and_emit, upsert_purchase_and_emit
+from .services.lanes import LANES_BY_NAME, lane_stats, realtime_lag_exceeded
+from .services.metrics import render_prometheus
+from .views import retry_later
+from fds_core import rule_stats
+
+
+def _requested_lane(request):
+    """
+    Optional ?lane=bulk for replay / backfill traffic.
+    Returns (lane, error response); lane None means the default per kind.
+    """
+    lane = request.query_params.get("lane")
+    if lane is None:
+        return None, None
+    if lane not in LANES_BY_NAME:
+        return None, Response({"lane": [f"Unsupported lane: {lane}"]}, status=status.HTTP_400_BAD_REQUEST)
+    if LANES_BY_NAME[lane].sheddable and realtime_lag_exceeded("default"):
+        # Backpressure: realtime detection is behind its SLO, shed low-priority work
+        return None, Response(
+            {"status": "throttled", "lane": lane},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": "5"},
+        )
+    return lane, None
 
 
 class IngestOrderView(APIView):
@@ -14,16 +42,64 @@ class IngestOrderView(APIView):
     - Actual detection runs on worker
     """
     def post(self, request, *args, **kwargs):
-        s = DetectOrderSerializer(data=request.data)
-        s.is_valid(raise_exception=True)
-        upsert_order_and_emit(s.validated_data, shard_id="default")
+        lane, rejected = _requested_lane(request)
+        if rejected is not None:
+            return rejected
+        data = validate_order(request.data)
+        try:
+            upsert_order_and_emit(data, shard_id="default", lane=lane)
+        except MergeConflict:
+            return retry_later()
         return Response({"status": "queued"}, status=status.HTTP_201_CREATED)
 
 
 class IngestPurchaseView(APIView):
     """Asynchronous ingestion endpoint for purchases."""
     def post(self, request, *args, **kwargs):
-        s = DetectPurchaseSerializer(data=request.data)
-        s.is_valid(raise_exception=True)
-        upsert_purchase_and_emit(s.validated_data, shard_id="default")
-        return Response({"status": "queued"}, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        lane, rejected = _requested_lane(request)
+        if rejected is not None:
+            return rejected
+        data = validate_purchase(request.data)
+        try:
+            upsert_purchase_and_emit(data, shard_id="default", lane=lane)
+        except MergeConflict:
+            return retry_later()
+        return Response({"status": "queued"}, status=status.HTTP_201_CREATED)
+
+
+class LaneStatsView(APIView):
+    """Per-lane queue depth, READY backlog and outbox lag."""
+    def get(self, request, *args, **kwargs):
+        shard_id = request.query_params.get("shard_id", "default")
+        return Response({"shard_id": shard_id, "lanes": lane_stats(shard_id)}, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Pipeline lag and throughput in the Prometheus text format, for scraping
+    (worker autoscaling and detection-latency alerts).
+    """
+    def get(self, request, *args, **kwargs):
+        shards = request.query_params.getlist("shard") or None
+        return HttpResponse(render_prometheus(shards), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class RuleStatsView(APIView):
+    """
+    Per-rule effectiveness from the hourly rollups (fds_core.rule_stats):
+    ?hours=24&kind=order for totals per rule, &rule=R001 for its hourly series.
+    """
+    def get(self, request, *args, **kwargs):
+        try:
+            hours = int(request.query_params.get("hours", 24))
+        except ValueError:
+            return Response({"hours": ["Must be an integer."]}, status=status.HTTP_400_BAD_REQUEST)
+        kind = request.query_params.get("kind")
+        rule_id = request.query_params.get("rule")
+        since = time.time() - hours * 3600
+
+        if rule_id:
+            body = {"rule_id": rule_id, "hours": rule_stats.rule_timeseries(rule_id, since, kind=kind)}
+        else:
+            body = {"rules": rule_stats.rule_summary(since, kind=kind)}
+        return Response({"since": since, **body}, status=status.HTTP_200_OK)